@@ -38,7 +38,44 @@ class ClusterUser(models.Model):
         return ContentType.objects.get_for_model(cls)
 
     def cast(self):
-        return self.real_type.get_object_for_this_type(pk=self.pk)
+        """
+        Returns this ClusterUser as its real type.  The result is cached, and
+        may have been loaded by cast_all().
+        """
+        if not hasattr(self, '_cast_cache'):
+            real_type = ContentType.objects.get_for_id(self.real_type_id)
+            self._cast_cache = real_type.get_object_for_this_type(pk=self.pk)
+        return self._cast_cache
+
+    @classmethod
+    def cast_all(cls, cluster_users):
+        """
+        Cast ClusterUsers to their real types in one query per type, caching
+        the result on each of them.  None is ignored, so that nullable
+        foreign keys can be passed directly.
+
+        @returns a list of the real objects, in the same order
+        """
+        cluster_users = list(cluster_users)
+        by_type = {}
+        for cluster_user in cluster_users:
+            if cluster_user is not None \
+                    and cluster_user.real_type_id is not None \
+                    and not hasattr(cluster_user, '_cast_cache'):
+                by_type.setdefault(cluster_user.real_type_id, []) \
+                    .append(cluster_user)
+
+        for type_id, members in by_type.items():
+            model = ContentType.objects.get_for_id(type_id).model_class()
+            # the user or group is selected too, for get_absolute_url()
+            casts = model._default_manager.select_related() \
+                .in_bulk([member.pk for member in members])
+            for member in members:
+                if member.pk in casts:
+                    member._cast_cache = casts[member.pk]
+
+        return [cluster_user.cast() if cluster_user is not None else None
+                for cluster_user in cluster_users]
 
     def used_resources(self, cluster=None, only_running=True):
         """
@@ -102,6 +102,29 @@ class TestClusterUser(TestCase):
 
         self.assertTrue(isinstance(organization, (Organization,)))
 
+    def test_cast_all(self):
+        """
+        Tests casting ClusterUsers in one query per type
+        """
+        user = User.objects.create(username='tester')
+        group = Group.objects.create(name='tester')
+        profile = ClusterUser.objects.get(pk=user.get_profile().pk)
+        organization = ClusterUser.objects.get(pk=group.organization.pk)
+
+        with self.assertNumQueries(2):
+            casts = ClusterUser.cast_all([profile, None, organization])
+            # users and groups are selected with them
+            self.assertEqual(user, casts[0].user)
+            self.assertEqual(group, casts[2].group)
+        self.assertTrue(isinstance(casts[0], Profile))
+        self.assertEqual(None, casts[1])
+        self.assertTrue(isinstance(casts[2], Organization))
+
+        # casts are cached
+        with self.assertNumQueries(0):
+            self.assertTrue(profile.cast() is casts[0])
+            self.assertEqual([casts[2]], ClusterUser.cast_all([organization]))
+
     def test_used_resources(self):
         """
         Tests retrieving dictionary of resources used by a cluster user
@@ -0,0 +1,102 @@
+"""
+Background refresh queue for cached cluster objects.
+
+When ``BACKGROUND_CACHE_REFRESH`` is enabled, CachedClusterObjects never
+contact the RAPI while they are being instantiated.  Expired objects are
+handed to the queue in this module instead, and a worker thread refreshes
+them one at a time while the request carries on with the cached copy.
+"""
+
+import logging
+import threading
+from Queue import Queue
+
+from django.db import connection
+
+
+logger = logging.getLogger(__name__)
+
+
+class RefreshQueue(object):
+    """
+    A deduplicating queue of cached objects waiting for a refresh.
+
+    Objects are tracked by (model, pk) so that an object which is loaded many
+    times while it is expired is only refreshed once.  Keys stay pending until
+    the refresh has finished.
+    """
+
+    def __init__(self, threaded=True):
+        """
+        @param threaded - whether to process the queue in a worker thread.
+        If False, the queue is only processed by calling ``drain()``.
+        """
+        self.threaded = threaded
+        self.queue = Queue()
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.worker = None
+
+    def __len__(self):
+        return len(self.pending)
+
+    def __contains__(self, obj):
+        return (obj.__class__, obj.pk) in self.pending
+
+    def enqueue(self, obj):
+        """
+        Schedule a refresh of the given object.
+
+        @returns True if the object was added, False if it was already pending
+        """
+        key = (obj.__class__, obj.pk)
+        with self.lock:
+            if key in self.pending:
+                return False
+            self.pending.add(key)
+            if self.threaded:
+                self._start()
+        self.queue.put(key)
+        return True
+
+    def drain(self):
+        """
+        Process every queued object in the calling thread.
+        """
+        while not self.queue.empty():
+            self._process(self.queue.get())
+
+    def _start(self):
+        if self.worker is None or not self.worker.is_alive():
+            self.worker = threading.Thread(target=self._run,
+                                           name='gwm-cache-refresh')
+            self.worker.daemon = True
+            self.worker.start()
+
+    def _run(self):
+        while True:
+            self._process(self.queue.get())
+            # release the thread's database connection while idle
+            if self.queue.empty():
+                connection.close()
+
+    def _process(self, key):
+        model, pk = key
+        try:
+            # Loading the object does not queue it again because the key is
+            # still pending.  The cache is checked again before refreshing in
+            # case another process refreshed the object in the meantime.
+            obj = model.objects.get(pk=pk)
+            obj.load_info(background=False)
+        except model.DoesNotExist:
+            pass
+        except Exception:
+            logger.exception("Background refresh of %s %s failed",
+                             model.__name__, pk)
+        finally:
+            with self.lock:
+                self.pending.discard(key)
+            self.queue.task_done()
+
+
+queue = RefreshQueue()
@@ -1,17 +1,26 @@
 import binascii
+import logging
 import re
-import cPickle
+import threading
+import uuid
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from hashlib import sha1
 
 from django.conf import settings
-from django.db import models
-from django.db.models import Sum
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, models, transaction, IntegrityError
+from django.db.models import Count, F, Q, Sum
 from django.utils.encoding import force_unicode
 from django.utils.translation import ugettext_lazy as _
+from django.contrib.contenttypes.generic import GenericRelation
 from django.contrib.contenttypes.models import ContentType
 
-from ganeti_webmgr.utils import get_rapi
+from ganeti_webmgr.clusters import background as background_refresh
+from ganeti_webmgr.clusters import reconciliation, serialization
+from ganeti_webmgr.ganeti_web import caps
+from ganeti_webmgr.utils import chunks, get_rapi, query_infos
 from ganeti_webmgr.utils.fields import (
     PatchedEncryptedCharField, PreciseDateTimeField, LowerCaseCharField
 )
@@ -19,6 +28,44 @@ from ganeti_webmgr.utils.client import GanetiApiError
 from ganeti_webmgr.utils.models import Quota
 
 
+logger = logging.getLogger(__name__)
+
+
+# Number of rows inserted per bulk_create() and number of primary keys per
+# batched update when synchronizing with a cluster.  Inserts are kept small
+# to stay below the number of query parameters some databases allow.
+BULK_CREATE_BATCH_SIZE = 40
+UPDATE_BATCH_SIZE = 500
+
+# Number of query parameters per UPDATE of rows with differing values.  Every
+# row takes two parameters per column, and sqlite allows 999 in all.
+UPDATE_ROWS_PARAMS = 900
+
+# Fields queried for every object by an incremental sync to find the objects
+# that changed.  If more objects than INCREMENTAL_FETCH_LIMIT changed, they
+# are retrieved with one bulk call rather than one call each.
+FINGERPRINT_FIELDS = ('name', 'mtime', 'serial_no')
+INCREMENTAL_FETCH_LIMIT = 20
+
+# Whether expired objects are refreshed when they are loaded, per thread.  See
+# no_lazy_refresh().
+_lazy_refresh = threading.local()
+
+
+@contextmanager
+def no_lazy_refresh():
+    """
+    Objects loaded by the current thread within this block are neither
+    refreshed nor queued for a background refresh when they expired.  For
+    callers that refresh the objects they load themselves.
+    """
+    _lazy_refresh.disabled = True
+    try:
+        yield
+    finally:
+        _lazy_refresh.disabled = False
+
+
 class CachedClusterObject(models.Model):
     """
     Parent class for objects which belong to Ganeti but have cached data in
@@ -31,18 +78,25 @@ class CachedClusterObject(models.Model):
     This class provides transparent caching for all of the data that it
     serializes; no explicit cache accesses are required.
 
+    The serialized info is stored in a CachedInfo side table rather than on
+    the object's own row, so that listing, filtering and counting objects
+    only reads their narrow database columns.  It is loaded the first time
+    ``info`` or ``serialized_info`` is accessed.
+
     This model is abstract and may not be instantiated on its own.
     """
 
-    serialized_info = models.TextField(default="", editable=False)
     mtime = PreciseDateTimeField(null=True, editable=False)
+    serial_no = models.PositiveIntegerField(null=True, editable=False)
     cached = PreciseDateTimeField(null=True, editable=False)
     ignore_cache = models.BooleanField(default=False)
+    cached_info = GenericRelation('CachedInfo')
 
     last_job_id = None
     __info = None
+    _serialized_info = None
+    _info_changed = False
     error = None
-    ctime = None
     deleted = False
 
     class Meta:
@@ -50,16 +104,58 @@ class CachedClusterObject(models.Model):
 
     def save(self, *args, **kwargs):
         """
-        overridden to ensure info is serialized prior to save
+        overridden to ensure info is serialized and stored after the object
+        is saved
         """
-        if not self.serialized_info:
-            self.serialized_info = cPickle.dumps(self.__info)
+        created = self.pk is None
         super(CachedClusterObject, self).save(*args, **kwargs)
+        if self._info_changed:
+            if not self._serialized_info:
+                self._serialized_info = self.serialize(self.__info)
+            CachedInfo.store(self, self._serialized_info)
+            self._info_changed = False
+            if self.info:
+                self.store_related_info({self.pk: self.info})
+        elif created:
+            # nothing is stored for a new object without info
+            self._serialized_info = ""
+
+    @staticmethod
+    def serialize(info):
+        """
+        Serialize an info dictionary for storage in ``serialized_info``, using
+        the codec set by SERIALIZED_INFO_CODEC.
+        """
+        return serialization.encode(info)
+
+    @staticmethod
+    def deserialize(serialized_info):
+        """
+        Load an info dictionary from its ``serialized_info`` representation,
+        whichever codec it was encoded with.
+        """
+        return serialization.decode(serialized_info)
 
     def __init__(self, *args, **kwargs):
         super(CachedClusterObject, self).__init__(*args, **kwargs)
         self.load_info()
 
+    @property
+    def serialized_info(self):
+        """
+        The serialized info of this object, queried from its CachedInfo the
+        first time it is accessed.  Writes to this property are stored when
+        the object is saved.
+        """
+        if self._serialized_info is None:
+            self._serialized_info = CachedInfo.load(self)
+        return self._serialized_info
+
+    @serialized_info.setter
+    def serialized_info(self, value):
+        self._serialized_info = value
+        self._info_changed = True
+
     @property
     def info(self):
         """
@@ -74,7 +170,9 @@ class CachedClusterObject(models.Model):
 
         if self.__info is None:
             if self.serialized_info:
-                self.__info = cPickle.loads(str(self.serialized_info))
+                self.__info = self.deserialize(self.serialized_info)
+                if self.__info is not None:
+                    self.parse_transient_info()
         return self.__info
 
     def _set_info(self, value):
@@ -85,7 +183,18 @@ class CachedClusterObject(models.Model):
 
     info = info.setter(_set_info)
 
-    def load_info(self):
+    @property
+    def ctime(self):
+        """
+        Creation time of this object in ganeti, or None if it is unknown.
+        """
+        info = self.info
+        # XXX ganeti 2.1 ctime is always None
+        if info and info.get('ctime') is not None:
+            return datetime.fromtimestamp(info['ctime'])
+        return None
+
+    def load_info(self, background=None):
         """
         Load cached info retrieved from the ganeti cluster.  This function
         includes a lazy cache mechanism that uses a timer to decide whether or
@@ -93,19 +202,55 @@ class CachedClusterObject(models.Model):
         ganeti cluster.
 
         This will ignore the cache when self.ignore_cache is True
+
+        If background is True (default: settings.BACKGROUND_CACHE_REFRESH),
+        expired objects are never refreshed here.  The cached info is used
+        as-is and the object is queued for a refresh by the background worker.
+        Neither happens within no_lazy_refresh().
         """
 
-        epsilon = timedelta(0, 0, 0, settings.LAZY_CACHE_REFRESH)
+        if background is None:
+            background = settings.BACKGROUND_CACHE_REFRESH
 
         if self.id:
-            if (self.ignore_cache
-                    or self.cached is None
-                    or datetime.now() > self.cached + epsilon):
+            stale = self.stale \
+                and not getattr(_lazy_refresh, 'disabled', False)
+            if stale and not background:
                 self.refresh()
-            elif self.info:
-                self.parse_transient_info()
             else:
-                self.error = 'No Cached Info'
+                if stale:
+                    background_refresh.queue.enqueue(self)
+                # objects are cached when their info is stored, so the info
+                # is only loaded here if it may be missing
+                if self.cached is None and not self.info:
+                    self.error = 'No Cached Info'
+
+    @property
+    def stale(self):
+        """
+        Whether the cached info has expired and should be refreshed.
+        """
+        epsilon = timedelta(0, 0, 0, settings.LAZY_CACHE_REFRESH)
+        return (self.ignore_cache
+                or self.cached is None
+                or datetime.now() > self.cached + epsilon)
+
+    @property
+    def cache_age(self):
+        """
+        Time elapsed since the cached info was retrieved, or None if it never
+        was.
+        """
+        if self.cached is None:
+            return None
+        return datetime.now() - self.cached
+
+    @property
+    def refresh_pending(self):
+        """
+        Whether this object is waiting in the background refresh queue.
+        """
+        return self in background_refresh.queue
 
     def parse_info(self):
         """
@@ -124,6 +269,28 @@ class CachedClusterObject(models.Model):
 
         If communication with Ganeti fails, an error will be stored in
         ``error``.
+
+        Only one process refreshes an object at a time.  If another process
+        holds the object's RefreshLease the object is not refreshed, and its
+        cached info is used.
+        """
+        timeout = settings.REFRESH_LOCK_TIMEOUT
+        if self.id is None or not timeout:
+            self._refresh_info()
+            return
+
+        lease = RefreshLease.acquire(self, timeout)
+        if lease is None:
+            return
+        try:
+            self._refresh_info()
+        finally:
+            # released by key, as refreshing may delete the object
+            lease.release()
+
+    def _refresh_info(self):
+        """
+        Retrieve info from the ganeti cluster and store it.  See refresh().
         """
         from ganeti_webmgr.utils.models import GanetiError
 
@@ -135,16 +302,13 @@ class CachedClusterObject(models.Model):
         try:
             info_ = self._refresh()
             if info_:
-                if info_['mtime']:
-                    mtime = datetime.fromtimestamp(info_['mtime'])
-                else:
-                    mtime = None
+                modified = self.is_modified(self.mtime, self.serial_no, info_)
                 self.cached = datetime.now()
             else:
-                # no info retrieved, use current mtime
-                mtime = self.mtime
+                # no info retrieved, keep the current info
+                modified = self.mtime is None
 
-            if self.id and (self.mtime is None or mtime > self.mtime):
+            if self.id and modified:
                 # there was an update. Set info and save the object
                 self.info = info_
                 self.save()
@@ -265,18 +429,13 @@ class CachedClusterObject(models.Model):
         Parse properties from cached info that is stored on the class but not
         in the database.
 
-        These properties will be loaded every time the object is instantiated.
-        Properties stored on the class cannot be search efficiently via the
-        django query api.
+        These properties will be loaded every time the info is loaded, which
+        happens the first time it is accessed.  Properties stored on the class
+        cannot be search efficiently via the django query api.
 
         This method is specific to the child object.
         """
-
-        info_ = self.info
-        # XXX ganeti 2.1 ctime is always None
-        # XXX this means that we could nuke the conditionals!
-        if info_['ctime'] is not None:
-            self.ctime = datetime.fromtimestamp(info_['ctime'])
+        pass
 
     @classmethod
     def parse_persistent_info(cls, info):
@@ -290,8 +449,180 @@ class CachedClusterObject(models.Model):
 
         # mtime is sometimes None if object has never been modified
         if info['mtime'] is None:
-            return {'mtime': None}
-        return {'mtime': datetime.fromtimestamp(info['mtime'])}
+            mtime = None
+        else:
+            mtime = datetime.fromtimestamp(info['mtime'])
+        return {'mtime': mtime, 'serial_no': info.get('serial_no')}
+
+    @staticmethod
+    def is_modified(mtime, serial_no, info):
+        """
+        Returns whether info retrieved from ganeti is newer than the mtime
+        and serial_no stored for an object.  Ganeti bumps serial_no on every
+        modification, which also catches modifications whose stored mtime
+        does not compare as older, such as several within a second.
+        """
+        if mtime is None:
+            return True
+        if serial_no is not None and info.get('serial_no') is not None \
+                and info['serial_no'] != serial_no:
+            return True
+        return bool(info['mtime']) \
+            and datetime.fromtimestamp(info['mtime']) > mtime
+
+    @classmethod
+    def store_related_info(cls, infos, created=False):
+        """
+        Store properties parsed from cached info in tables other than the
+        object's own.  This is called wherever the results of
+        parse_persistent_info() are stored, once the objects have primary
+        keys.
+
+        This method is specific to the child object.
+
+        @param infos - dictionary mapping primary keys to info
+        @param created - whether the objects were just inserted in bulk,
+        without being saved one at a time
+        """
+        pass
+
+
+class CachedInfo(models.Model):
+    """
+    The serialized info of a CachedClusterObject.  This is kept out of the
+    object's own table so that queries which do not need the info never read
+    it.  Each object has at most one CachedInfo, which is deleted with it.
+    """
+    content_type = models.ForeignKey(ContentType, related_name='+')
+    object_id = models.IntegerField()
+    serialized_info = models.TextField(default="")
+
+    class Meta:
+        unique_together = (('content_type', 'object_id'),)
+
+    @classmethod
+    def load(cls, obj):
+        """
+        Returns the serialized info stored for an object, or an empty string
+        if there is none.
+        """
+        if obj.pk is None:
+            return ""
+        content_type = ContentType.objects.get_for_model(obj)
+        rows = cls.objects.filter(content_type=content_type,
+                                  object_id=obj.pk) \
+            .values_list('serialized_info', flat=True)
+        for serialized_info in rows:
+            return serialized_info
+        return ""
+
+    @classmethod
+    def store(cls, obj, serialized_info):
+        """
+        Store the serialized info of a saved object, replacing any it had.
+        """
+        content_type = ContentType.objects.get_for_model(obj)
+        if not cls.objects.filter(content_type=content_type,
+                                  object_id=obj.pk) \
+                .update(serialized_info=serialized_info):
+            cls.objects.create(content_type=content_type, object_id=obj.pk,
+                               serialized_info=serialized_info)
+
+    @classmethod
+    def store_many(cls, model, infos):
+        """
+        Store the serialized info of many objects of one model.  Existing
+        info is updated one row at a time and missing info is inserted in
+        batches.
+
+        @param model - CachedClusterObject subclass the objects belong to
+        @param infos - dictionary mapping primary keys to serialized info
+        """
+        content_type = ContentType.objects.get_for_model(model)
+        rows = cls.objects.filter(content_type=content_type)
+        existing = set()
+        for batch in chunks(infos, UPDATE_BATCH_SIZE):
+            existing.update(rows.filter(object_id__in=batch)
+                            .values_list('object_id', flat=True))
+        for object_id in existing:
+            rows.filter(object_id=object_id) \
+                .update(serialized_info=infos[object_id])
+        new = [cls(content_type=content_type, object_id=object_id,
+                   serialized_info=infos[object_id])
+               for object_id in infos if object_id not in existing]
+        for batch in chunks(new, BULK_CREATE_BATCH_SIZE):
+            cls.objects.bulk_create(batch)
+
+
+class RefreshLease(object):
+    """
+    A lease on refreshing a CachedClusterObject, held by one process at a
+    time.  This prevents every process loading an expired object from
+    refreshing it at once.
+
+    Leases are stored in the cache rather than the database, so that taking
+    one never commits the caller's transaction.  They expire after a timeout
+    so that a process that died while holding one can not block refreshes
+    forever.  Processes only share leases if they share a cache backend, so
+    leases can not be enabled with a cache local to each process.  See
+    check_settings().
+    """
+
+    # cache backends that are not shared between processes
+    LOCAL_BACKENDS = ('django.core.cache.backends.locmem.LocMemCache',
+                      'django.core.cache.backends.dummy.DummyCache')
+
+    def __init__(self, key, token):
+        self.key = key
+        self.token = token
+
+    @staticmethod
+    def key_for(obj):
+        content_type = ContentType.objects.get_for_model(obj)
+        return 'refresh-lease:%s:%s' % (content_type.pk, obj.pk)
+
+    @classmethod
+    def acquire(cls, obj, timeout):
+        """
+        Take the lease on refreshing an object.
+
+        @param obj - the CachedClusterObject to refresh
+        @param timeout - seconds after which the lease expires
+        @returns the lease, or None if another process holds it
+        """
+        lease = cls(cls.key_for(obj), uuid.uuid4().hex)
+        if cache.add(lease.key, lease.token, timeout):
+            return lease
+        return None
+
+    def release(self):
+        """
+        Release the lease.  Nothing is released if the lease expired and was
+        taken over by another process.
+        """
+        if cache.get(self.key) == self.token:
+            cache.delete(self.key)
+
+    @classmethod
+    def check_settings(cls):
+        """
+        Refuse to enable leases unless the default cache is shared by every
+        process.  Otherwise each process would take its own leases, and they
+        would all refresh the same objects at once.
+
+        @raises ImproperlyConfigured if REFRESH_LOCK_TIMEOUT is set and the
+        default cache is local to each process
+        """
+        backend = settings.CACHES['default']['BACKEND']
+        if settings.REFRESH_LOCK_TIMEOUT and backend in cls.LOCAL_BACKENDS:
+            raise ImproperlyConfigured(
+                'REFRESH_LOCK_TIMEOUT requires a cache shared by every '
+                'process, such as memcached, but the default cache is %s.  '
+                'Configure CACHES or set REFRESH_LOCK_TIMEOUT to 0.'
+                % backend)
+
+
+RefreshLease.check_settings()
 
 
 class Cluster(CachedClusterObject):
@@ -309,6 +640,17 @@ class Cluster(CachedClusterObject):
                                          max_length=128, blank=True)
     hash = models.CharField(_('hash'), max_length=40, editable=False)
 
+    # properties parsed from the cached info, stored so that cluster lists
+    # and capability checks do not need to load it
+    software_version = models.CharField(max_length=32, blank=True,
+                                        db_index=True, editable=False)
+    default_hypervisor = models.CharField(max_length=32, blank=True,
+                                          db_index=True, editable=False)
+    master = LowerCaseCharField(max_length=128, blank=True, db_index=True,
+                                editable=False)
+    capability = models.PositiveSmallIntegerField(null=True, db_index=True,
+                                                  editable=False)
+
     # quota properties
     virtual_cpus = models.IntegerField(_('Virtual CPUs'), null=True,
                                        blank=True)
@@ -331,11 +673,27 @@ class Cluster(CachedClusterObject):
     def save(self, *args, **kwargs):
         self.hash = self.create_hash()
         super(Cluster, self).save(*args, **kwargs)
+        reconciliation.invalidate(self)
 
     @models.permalink
     def get_absolute_url(self):
         return 'cluster-detail', (), {'cluster_slug': self.slug}
 
+    @classmethod
+    def parse_persistent_info(cls, info):
+        """
+        Loads all values from cached info, included persistent properties that
+        are stored in the database
+        """
+        data = super(Cluster, cls).parse_persistent_info(info)
+        version = info.get('software_version') or ''
+        data['software_version'] = version
+        data['default_hypervisor'] = info.get('default_hypervisor') or ''
+        data['master'] = info.get('master') or ''
+        data['capability'] = caps.classify_version(version) if version \
+            else None
+        return data
+
     # XXX probably hax
     @property
     def cluster_id(self):
@@ -466,68 +824,461 @@ class Cluster(CachedClusterObject):
 
         return quotas
 
-    def sync_virtual_machines(self, remove=False):
+    def sync_virtual_machines(self, remove=False, nodes=None, query=False,
+                              incremental=False):
         """
         Synchronizes the VirtualMachines in the database with the information
         this ganeti cluster has:
             * VMs no longer in ganeti are deleted
             * VMs missing from the database are added
+            * VMs modified in ganeti are updated
+
+        The info for every instance is retrieved with a single bulk RAPI call.
+        Missing VMs are inserted with bulk_create and the rest are updated in
+        batches, so no per-VM RAPI calls are made.  The cluster's
+        reconciliation counts and statistics are updated afterwards, and the
+        owner tags of VMs whose owner changed are reconciled.
+
+        @param nodes - dictionary mapping node hostnames to primary keys, as
+        returned by sync_nodes().  It is queried if not given.
+        @param query - only retrieve the fields stored in the database, using
+        the RAPI query resource.  See _sync_objects().
+        @param incremental - only retrieve the info of VMs that were added or
+        modified in ganeti.  See _fetch_changed().
         """
         # preventing circular imports
         from ganeti_webmgr.virtualmachines.models import VirtualMachine
 
-        ganeti = self.instances()
-        db = self.virtual_machines.all().values_list('hostname', flat=True)
-
-        # add VMs missing from the database
-        for hostname in filter(lambda x: unicode(x) not in db, ganeti):
-            vm = VirtualMachine.objects.create(cluster=self, hostname=hostname)
-            vm.refresh()
+        if nodes is None:
+            nodes = dict(self.nodes.values_list('hostname', 'id'))
+
+        # VMs being created or deleted are handled by their jobs
+        skip = set(self.virtual_machines
+                   .filter(Q(pending_delete=True) | Q(template__isnull=False))
+                   .values_list('hostname', flat=True))
+
+        names = None
+        if query:
+            infos = query_infos(self.rapi.Query(
+                'instance', list(VirtualMachine.QUERY_FIELDS)))
+        elif incremental:
+            infos, names = self._fetch_changed(
+                VirtualMachine, self.virtual_machines, 'instance',
+                self.rapi.GetInstance, self.rapi.GetInstances, skip)
+        else:
+            infos = self.rapi.GetInstances(bulk=True)
+
+        names = self._sync_objects(VirtualMachine, self.virtual_machines,
+                                   infos, remove, skip=skip, partial=query,
+                                   names=names, nodes=nodes)
+        reconciliation.store_names(self, 'instances', names)
+        self.reconcile(names)
+        ClusterStats.store(self)
+
+        vms = self.virtual_machines.filter(pending_delete=False,
+                                           template__isnull=True)
+        for hostname, error in VirtualMachine.reconcile_owner_tags(self, vms):
+            logger.warning('Could not update the owner tag of %s: %s',
+                           hostname, error)
+
+    def import_virtual_machines(self, hostnames, owner=None, progress=None):
+        """
+        Import instances that are in ganeti but missing from the database.
+        Their info is retrieved with a single bulk RAPI call, and the
+        VirtualMachines are inserted with bulk_create, so they do not need to
+        be refreshed one at a time.
+
+        @param hostnames - hostnames of the instances to import
+        @param owner - ClusterUser that will own the imported VirtualMachines
+        @param progress - function called with the number of VirtualMachines
+        imported so far and the number being imported.  See _insert_objects()
+        @returns the hostnames of the imported VirtualMachines.  Instances
+        that were already imported or are no longer in ganeti are skipped.
+        """
+        # preventing circular imports
+        from ganeti_webmgr.virtualmachines.models import VirtualMachine
 
-        # deletes VMs that are no longer in ganeti
-        if remove:
-            missing_ganeti = filter(lambda x: str(x) not in ganeti, db)
-            if missing_ganeti:
-                self.virtual_machines \
-                    .filter(hostname__in=missing_ganeti).delete()
+        hostnames = set(hostname.lower() for hostname in hostnames)
+        for batch in chunks(hostnames, UPDATE_BATCH_SIZE):
+            hostnames.difference_update(
+                self.virtual_machines.filter(hostname__in=batch)
+                .values_list('hostname', flat=True))
+        if not hostnames:
+            return []
 
-        # Get up to date data on all VMs
-        self.refresh_virtual_machines()
+        infos = [info for info in self.rapi.GetInstances(bulk=True)
+                 if info['name'].lower() in hostnames]
+        nodes = dict(self.nodes.values_list('hostname', 'id'))
+        self._insert_objects(VirtualMachine, self.virtual_machines, infos,
+                             datetime.now(), fields={'owner': owner},
+                             progress=progress, nodes=nodes)
+        return [info['name'].lower() for info in infos]
 
     def refresh_virtual_machines(self):
         for vm in self.virtual_machines.all():
             vm.refresh()
 
-    def sync_nodes(self, remove=False):
+    def sync_nodes(self, remove=False, query=False, incremental=False):
         """
         Synchronizes the Nodes in the database with the information
         this ganeti cluster has:
             * Nodes no longer in ganeti are deleted
             * Nodes missing from the database are added
+            * Nodes modified in ganeti are updated
+
+        The info for every node is retrieved with a single bulk RAPI call.
+        The cluster's statistics are updated afterwards.
+
+        @param query - only retrieve the fields stored in the database, using
+        the RAPI query resource.  See _sync_objects().
+        @param incremental - only retrieve the info of nodes that were added
+        or modified in ganeti.  See _fetch_changed().
+
+        @returns dictionary mapping the hostname of each of this cluster's
+        nodes to its primary key, for passing to sync_virtual_machines()
         """
         # to prevent circular imports
         from ganeti_webmgr.nodes.models import Node
 
-        ganeti = self.rapi.GetNodes()
-        db = self.nodes.all().values_list('hostname', flat=True)
+        names = None
+        if query:
+            infos = query_infos(self.rapi.Query('node',
+                                                list(Node.QUERY_FIELDS)))
+        elif incremental:
+            infos, names = self._fetch_changed(Node, self.nodes, 'node',
+                                               self.rapi.GetNode,
+                                               self.rapi.GetNodes)
+        else:
+            infos = self.rapi.GetNodes(bulk=True)
 
-        # add Nodes missing from the database
-        for hostname in filter(lambda x: unicode(x) not in db, ganeti):
-            node = Node.objects.create(cluster=self, hostname=hostname)
+        names = self._sync_objects(Node, self.nodes, infos, remove,
+                                   partial=query, names=names)
+        reconciliation.store_names(self, 'nodes', names)
+        ClusterStats.store(self)
+        return dict(self.nodes.values_list('hostname', 'id'))
+
+    def refresh_nodes(self):
+        for node in self.nodes.all():
             node.refresh()
 
-        # deletes Nodes that are no longer in ganeti
+    def _fetch_changed(self, model, related, what, get_one, get_all,
+                       skip=()):
+        """
+        Fetch the info of this cluster's objects that were added or modified
+        in ganeti since they were last synchronized.  The FINGERPRINT_FIELDS
+        of every object are queried and compared with the stored mtime and
+        serial_no, so only changed objects are retrieved in full.  See
+        CachedClusterObject.is_modified().
+
+        @param model - CachedClusterObject subclass being synchronized
+        @param related - this cluster's related manager for that model
+        @param what - name of the RAPI query resource for the model
+        @param get_one - RAPI method returning the info of a single object
+        @param get_all - RAPI method returning the info of every object
+        @param skip - hostnames of objects that should not be retrieved
+
+        @returns a list of info dictionaries for the changed objects, and the
+        set of hostnames of every object in ganeti
+        """
+        fingerprints = query_infos(self.rapi.Query(what,
+                                                   list(FINGERPRINT_FIELDS)))
+
+        # values_list() skips field conversion, so convert mtime ourselves
+        to_datetime = model._meta.get_field('mtime').to_python
+        db = dict((hostname, (to_datetime(mtime), serial_no))
+                  for hostname, mtime, serial_no
+                  in related.values_list('hostname', 'mtime', 'serial_no'))
+
+        names = set()
+        changed = []
+        for fingerprint in fingerprints:
+            hostname = fingerprint['name'].lower()
+            names.add(hostname)
+            if hostname in skip:
+                continue
+            if hostname in db:
+                mtime, serial_no = db[hostname]
+                if not model.is_modified(mtime, serial_no, fingerprint):
+                    continue
+            changed.append(fingerprint['name'])
+
+        if len(changed) > INCREMENTAL_FETCH_LIMIT:
+            changed = set(changed)
+            infos = [info for info in get_all(bulk=True)
+                     if info['name'] in changed]
+        else:
+            infos = []
+            for name in changed:
+                try:
+                    infos.append(get_one(name))
+                except GanetiApiError as e:
+                    # removed since the query.  It is removed by the sync.
+                    if e.code != 404:
+                        raise
+                    names.discard(name.lower())
+
+        return infos, names
+
+    def _sync_objects(self, model, related, infos, remove=False, skip=(),
+                      partial=False, names=None, **kwargs):
+        """
+        Synchronize this cluster's cached objects of one type with the bulk
+        info retrieved from ganeti.  Objects are matched by hostname using
+        sets, missing objects are inserted with bulk_create, and existing
+        objects are updated in batches.
+
+        Partial info only contains the model's QUERY_FIELDS, so it is never
+        cached.  Only the database columns of objects whose values changed
+        are updated, and new objects are created without cached info so that
+        they are refreshed when they are first loaded.
+
+        @param model - CachedClusterObject subclass being synchronized
+        @param related - this cluster's related manager for that model
+        @param infos - list of info dictionaries from a bulk RAPI call
+        @param remove - whether to delete objects no longer in ganeti
+        @param skip - hostnames of objects that should not be updated
+        @param partial - whether infos only contain the model's QUERY_FIELDS
+        @param names - hostnames of every object in ganeti, if infos only
+        contains the objects that changed.  The others only have their cache
+        time updated.
+        @param kwargs - passed on to model.parse_persistent_info()
+
+        @returns the set of hostnames of every object in ganeti
+        """
+        # preventing circular imports
+        from ganeti_webmgr.utils.models import GanetiError
+
+        now = datetime.now()
+        ganeti = dict((info['name'].lower(), info) for info in infos)
+        if names is None:
+            names = set(ganeti)
+
+        # values_list() skips field conversion, so convert mtime ourselves
+        to_datetime = model._meta.get_field('mtime').to_python
+        db = dict((hostname, (id, to_datetime(mtime), serial_no))
+                  for id, hostname, mtime, serial_no
+                  in related.values_list('id', 'hostname', 'mtime',
+                                         'serial_no'))
+
+        # add objects missing from the database
+        self._insert_objects(model, related,
+                             [ganeti[hostname]
+                              for hostname in set(ganeti) - set(db)],
+                             now, partial, **kwargs)
+
+        existing = set(ganeti).intersection(db).difference(skip)
+        if partial:
+            self._update_changed_objects(model, related, ganeti, existing,
+                                         **kwargs)
+        else:
+            unchanged = names.difference(ganeti).intersection(db) \
+                .difference(skip)
+            self._update_modified_objects(model, ganeti, db, existing, now,
+                                          unchanged, **kwargs)
+
+        for batch in chunks(names, UPDATE_BATCH_SIZE):
+            GanetiError.objects.clear_errors(
+                obj=related.filter(hostname__in=batch))
+
+        # deletes objects that are no longer in ganeti
         if remove:
-            missing_ganeti = filter(lambda x: str(x) not in ganeti, db)
-            if missing_ganeti:
-                self.nodes.filter(hostname__in=missing_ganeti).delete()
+            for batch in chunks(set(db) - names, UPDATE_BATCH_SIZE):
+                related.filter(hostname__in=batch).delete()
 
-        # Get up to date data for all Nodes
-        self.refresh_nodes()
+        return names
 
-    def refresh_nodes(self):
-        for node in self.nodes.all():
-            node.refresh()
+    def _insert_objects(self, model, related, infos, now, partial=False,
+                        fields=None, progress=None, **kwargs):
+        """
+        Insert objects missing from the database with bulk_create, in batches
+        of BULK_CREATE_BATCH_SIZE.
+
+        @param model - CachedClusterObject subclass being inserted
+        @param related - this cluster's related manager for that model
+        @param infos - list of info dictionaries of the objects to insert
+        @param now - cache time of the objects
+        @param partial - whether infos only contain the model's QUERY_FIELDS.
+        Objects are then inserted without cached info.
+        @param fields - values of other fields to set on every object
+        @param progress - function called after each batch with the number of
+        objects inserted so far and the number being inserted
+        @param kwargs - passed on to model.parse_persistent_info()
+        """
+        fields = fields or {}
+        done = 0
+        for batch in chunks(infos, BULK_CREATE_BATCH_SIZE):
+            new = []
+            serialized = {}
+            batch_infos = {}
+            for info in batch:
+                hostname = info['name'].lower()
+                batch_infos[hostname] = info
+                data = model.parse_persistent_info(info, **kwargs)
+                data.update(fields)
+                if partial:
+                    # a missing mtime forces the first refresh to cache it
+                    data['mtime'] = None
+                else:
+                    data['cached'] = now
+                    serialized[hostname] = model.serialize(info)
+                new.append(model(cluster=self, hostname=hostname,
+                                 cluster_hash=self.hash, **data))
+            model.objects.bulk_create(new)
+
+            # bulk_create() does not set primary keys, so query them to store
+            # the cached and related info of the new objects
+            ids = dict(related.filter(hostname__in=batch_infos)
+                       .values_list('hostname', 'id'))
+            if serialized:
+                CachedInfo.store_many(model, dict(
+                    (ids[hostname], data)
+                    for hostname, data in serialized.items()))
+            model.store_related_info(dict(
+                (ids[hostname], info)
+                for hostname, info in batch_infos.items()), created=True)
+
+            done += len(new)
+            if progress is not None:
+                progress(done, len(infos))
+
+    @staticmethod
+    def _field_names(model, data):
+        """
+        update() and values() expect field names rather than attribute names,
+        so rename foreign key attributes in parsed data.
+        """
+        for field in model._meta.fields:
+            if field.attname != field.name and field.attname in data:
+                data[field.name] = data.pop(field.attname)
+        return data
+
+    def _update_modified_objects(self, model, ganeti, db, hostnames, now,
+                                 unchanged=(), **kwargs):
+        """
+        Update objects that were modified in ganeti.  Unmodified objects, and
+        those known to be unchanged, only have their cache time updated.
+        """
+        unmodified = [db[hostname][0] for hostname in unchanged]
+        serialized = {}
+        modified = {}
+        rows = {}
+        for hostname in hostnames:
+            id, mtime, serial_no = db[hostname]
+            info = ganeti[hostname]
+            if model.is_modified(mtime, serial_no, info):
+                data = model.parse_persistent_info(info, **kwargs)
+                data = self._field_names(model, data)
+                data['cached'] = now
+                rows[id] = data
+                serialized[id] = model.serialize(info)
+                modified[id] = info
+            else:
+                unmodified.append(id)
+        self._update_rows(model, rows)
+        CachedInfo.store_many(model, serialized)
+        model.store_related_info(modified)
+        for batch in chunks(unmodified, UPDATE_BATCH_SIZE):
+            model.objects.filter(pk__in=batch).update(cached=now)
+
+    def _update_changed_objects(self, model, related, ganeti, hostnames,
+                                **kwargs):
+        """
+        Update the database columns of objects whose values differ from the
+        partial info.  mtime, serial_no, cached and the cached info are left
+        alone, so a full refresh still updates the cached info.  Related info
+        is passed on for every object, since it is not compared here.
+        """
+        parsed = {}
+        for hostname in hostnames:
+            data = model.parse_persistent_info(ganeti[hostname], **kwargs)
+            del data['mtime']
+            del data['serial_no']
+            parsed[hostname] = self._field_names(model, data)
+        if not parsed:
+            return
+
+        fields = parsed.values()[0].keys()
+        infos = {}
+        rows = {}
+        for batch in chunks(parsed, UPDATE_BATCH_SIZE):
+            values = related.filter(hostname__in=batch) \
+                .values('id', 'hostname', *fields)
+            for current in values:
+                id = current.pop('id')
+                hostname = current.pop('hostname')
+                infos[id] = ganeti[hostname]
+                data = parsed[hostname]
+                if current != data:
+                    rows[id] = data
+        self._update_rows(model, rows)
+        model.store_related_info(infos)
+
+    @staticmethod
+    def _update_rows(model, rows):
+        """
+        Update rows whose columns have different values, with one UPDATE per
+        batch.  Every column is set with a CASE on the primary key, which
+        update() can not express, so the query is built here.
+
+        @param model - model of the rows
+        @param rows - dictionary mapping primary keys to dictionaries of
+        field values.  Every row must have the same fields.
+        """
+        if not rows:
+            return
+
+        qn = connection.ops.quote_name
+        opts = model._meta
+        pk = qn(opts.pk.column)
+        fields = [opts.get_field(name) for name in rows.values()[0]]
+        size = max(1, UPDATE_ROWS_PARAMS // (2 * len(fields) + 1))
+
+        cursor = connection.cursor()
+        for batch in chunks(rows, size):
+            columns = []
+            params = []
+            for field in fields:
+                column = qn(field.column)
+                # ELSE gives the CASE the column's type, which postgres
+                # needs when every value is NULL
+                columns.append('%s = CASE %s %s ELSE %s END' % (
+                    column, pk, ' '.join(['WHEN %s THEN %s'] * len(batch)),
+                    column))
+                for id in batch:
+                    params.append(id)
+                    params.append(field.get_db_prep_save(rows[id][field.name],
+                                                         connection))
+            params.extend(batch)
+            cursor.execute('UPDATE %s SET %s WHERE %s IN (%s)' % (
+                qn(opts.db_table), ', '.join(columns), pk,
+                ', '.join(['%s'] * len(batch))), params)
+        transaction.commit_unless_managed()
+
+    def reconcile(self, names=None):
+        """
+        Count this cluster's VirtualMachines that are ready to import or
+        missing from ganeti, and store the counts in its
+        ClusterReconciliation.  Only the database is queried if the hostnames
+        of the instances in ganeti are given.
+
+        @param names - hostnames of every instance in ganeti.  They are
+        retrieved if not given, and nothing is stored if that fails.
+        """
+        if names is None:
+            names = reconciliation.ganeti_names(self, 'instances')
+            if names is None:
+                return
+
+        db = set()
+        missing = 0
+        for hostname, template in self.virtual_machines \
+                .values_list('hostname', 'template'):
+            db.add(hostname)
+            if template is None and hostname not in names:
+                missing += 1
+
+        ClusterReconciliation.store(self, import_ready=len(names - db),
+                                    missing=missing)
 
     @property
     def missing_in_ganeti(self):
@@ -535,10 +1286,7 @@ class Cluster(CachedClusterObject):
         Returns a list of VirtualMachines that are missing from the Ganeti
         cluster but present in the database.
         """
-        ganeti = self.instances()
-        qs = self.virtual_machines.exclude(template__isnull=False)
-        db = qs.values_list('hostname', flat=True)
-        return [x for x in db if str(x) not in ganeti]
+        return self._reconcile('instances').missing_in_ganeti
 
     @property
     def missing_in_db(self):
@@ -546,9 +1294,7 @@ class Cluster(CachedClusterObject):
         Returns list of VirtualMachines that are missing from the database, but
         present in ganeti
         """
-        ganeti = self.instances()
-        db = self.virtual_machines.all().values_list('hostname', flat=True)
-        return [x for x in ganeti if unicode(x) not in db]
+        return self._reconcile('instances').missing_in_db
 
     @property
     def nodes_missing_in_db(self):
@@ -556,12 +1302,7 @@ class Cluster(CachedClusterObject):
         Returns list of Nodes that are missing from the database, but present
         in ganeti.
         """
-        try:
-            ganeti = self.rapi.GetNodes()
-        except GanetiApiError:
-            ganeti = []
-        db = self.nodes.all().values_list('hostname', flat=True)
-        return [x for x in ganeti if unicode(x) not in db]
+        return self._reconcile('nodes').missing_in_db
 
     @property
     def nodes_missing_in_ganeti(self):
@@ -569,65 +1310,42 @@ class Cluster(CachedClusterObject):
         Returns list of Nodes that are missing from the ganeti cluster
         but present in the database
         """
+        return self._reconcile('nodes').missing_in_ganeti
+
+    def _reconcile(self, kind):
+        """
+        Returns the Reconciliation of this cluster's nodes or instances.
+        Nothing is missing if they could not be retrieved from ganeti.
+        """
+        for result in reconciliation.reconcile([self], kind):
+            return result
+        return reconciliation.Reconciliation(self, [], [])
+
+    @property
+    def statistics(self):
+        """
+        Returns the ClusterStats of this cluster.  They are computed again if
+        the cluster was refreshed since they were stored, so they stay
+        current even if its nodes and instances are not synchronized.
+        """
         try:
-            ganeti = self.rapi.GetNodes()
-        except GanetiApiError:
-            ganeti = []
-        db = self.nodes.all().values_list('hostname', flat=True)
-        return filter(lambda x: str(x) not in ganeti, db)
+            stats = self.stats
+        except ClusterStats.DoesNotExist:
+            stats = None
+        if stats is None or (self.cached is not None
+                             and stats.updated < self.cached):
+            stats = ClusterStats.store(self)
+        return stats
 
     @property
     def available_ram(self):
         """ returns dict of free and total ram """
-        nodes = self.nodes.exclude(ram_total=-1) \
-            .aggregate(total=Sum('ram_total'), free=Sum('ram_free'))
-        total = max(nodes.get("total", 0), 0)
-        free = max(nodes.get("free", 0), 0)
-        used = total - free
-        values = self.virtual_machines \
-            .filter(status='running') \
-            .exclude(ram=-1).order_by() \
-            .aggregate(used=Sum('ram'))
-
-        if values.get("used") is None:
-            allocated = 0
-        else:
-            allocated = values["used"]
-
-        free = max(total - allocated, 0)
-
-        return {
-            'total': total,
-            'free': free,
-            'allocated': allocated,
-            'used': used,
-        }
+        return self.statistics.ram
 
     @property
     def available_disk(self):
         """ returns dict of free and total disk space """
-        nodes = self.nodes.exclude(disk_total=-1) \
-            .aggregate(total=Sum('disk_total'), free=Sum('disk_free'))
-        total = max(nodes.get("total", 0), 0)
-        free = max(nodes.get("free", 0), 0)
-        used = total - free
-        values = self.virtual_machines \
-            .exclude(disk_size=-1).order_by() \
-            .aggregate(used=Sum('disk_size'))
-
-        if values.get("used") is None:
-            allocated = 0
-        else:
-            allocated = values["used"]
-
-        free = max(total - allocated, 0)
-
-        return {
-            'total': total,
-            'free': free,
-            'allocated': allocated,
-            'used': used,
-        }
+        return self.statistics.disk
 
     def _refresh(self):
         return self.rapi.GetInfo()
@@ -665,3 +1383,161 @@ class Cluster(CachedClusterObject):
         Cluster.objects.filter(pk=self.id) \
             .update(last_job=job, ignore_cache=True)
         return job
+
+
+def _store_cluster_row(model, cluster, values):
+    """
+    Store a row of a model keyed by cluster, replacing the one the cluster
+    had.  The row is created if it does not exist.
+    """
+    if model.objects.filter(cluster=cluster).update(**values):
+        return
+
+    sid = transaction.savepoint()
+    try:
+        model.objects.create(cluster=cluster, **values)
+    except IntegrityError:
+        # stored by another process since the update
+        transaction.savepoint_rollback(sid)
+        model.objects.filter(cluster=cluster).update(**values)
+    else:
+        transaction.savepoint_commit(sid)
+
+
+class ClusterReconciliation(models.Model):
+    """
+    Counts of a cluster's VirtualMachines that need an administrator's
+    attention and can only be found by querying ganeti: those in ganeti but
+    not imported, and those imported but no longer in ganeti.  VirtualMachines
+    without an owner are counted from the database when needed.
+
+    The counts are stored by Cluster.reconcile(), which runs whenever the
+    cluster's VirtualMachines are synchronized, so they can be shown without
+    querying ganeti.  Views that resolve some of them adjust the counts until
+    the next synchronization.
+    """
+    cluster = models.OneToOneField(Cluster, primary_key=True,
+                                   related_name='reconciliation')
+    import_ready = models.IntegerField(default=0)
+    missing = models.IntegerField(default=0)
+    updated = models.DateTimeField()
+
+    @classmethod
+    def store(cls, cluster, **counts):
+        """
+        Store the counts of a cluster, replacing any it had.
+        """
+        counts['updated'] = datetime.now()
+        _store_cluster_row(cls, cluster, counts)
+
+    @classmethod
+    def adjust(cls, name, changes):
+        """
+        Adjust one of the counts of several clusters.
+
+        @param name - name of the count to adjust
+        @param changes - dictionary mapping cluster primary keys to the
+        amount each cluster's count changed by
+        """
+        for cluster_id, change in changes.items():
+            if change:
+                cls.objects.filter(cluster=cluster_id) \
+                    .update(**{name: F(name) + change})
+
+    @classmethod
+    def totals(cls, clusters):
+        """
+        Returns the import ready and missing counts summed over several
+        clusters.  Clusters that were never synchronized count as zero.
+        """
+        totals = cls.objects.filter(cluster__in=clusters) \
+            .aggregate(import_ready=Sum('import_ready'),
+                       missing=Sum('missing'))
+        return tuple(totals[name] or 0 for name in ('import_ready', 'missing'))
+
+
+class ClusterStats(models.Model):
+    """
+    Totals of a cluster's nodes and VirtualMachines, stored so that cluster
+    lists and headers can show them without aggregating on every render.
+
+    The totals are stored whenever the cluster's nodes or VirtualMachines are
+    synchronized, and when they are read after the cluster was refreshed.
+    See Cluster.statistics.
+    """
+    cluster = models.OneToOneField(Cluster, primary_key=True,
+                                   related_name='stats')
+    nodes = models.IntegerField(default=0)
+    nodes_online = models.IntegerField(default=0)
+    virtual_machines = models.IntegerField(default=0)
+    vms_running = models.IntegerField(default=0)
+    ram_total = models.BigIntegerField(default=0)
+    ram_free = models.BigIntegerField(default=0)
+    ram_allocated = models.BigIntegerField(default=0)
+    disk_total = models.BigIntegerField(default=0)
+    disk_free = models.BigIntegerField(default=0)
+    disk_allocated = models.BigIntegerField(default=0)
+    updated = models.DateTimeField()
+
+    @classmethod
+    def store(cls, cluster):
+        """
+        Compute the totals of a cluster and store them, replacing any it had.
+        Nodes are summed with one query and VirtualMachines with three.
+
+        @returns the ClusterStats
+        """
+        stats = cls(cluster=cluster, updated=datetime.now())
+        for offline, ram_total, ram_free, disk_total, disk_free in \
+                cluster.nodes.order_by().values_list(
+                    'offline', 'ram_total', 'ram_free', 'disk_total',
+                    'disk_free'):
+            stats.nodes += 1
+            if not offline:
+                stats.nodes_online += 1
+            # -1 means the node's info is not cached yet
+            if ram_total != -1:
+                stats.ram_total += ram_total
+                stats.ram_free += ram_free
+            if disk_total != -1:
+                stats.disk_total += disk_total
+                stats.disk_free += disk_free
+
+        vms = cluster.virtual_machines.order_by()
+        for values in vms.values('status').annotate(count=Count('pk')):
+            stats.virtual_machines += values['count']
+            if values['status'] == 'running':
+                stats.vms_running = values['count']
+        stats.ram_allocated = vms.filter(status='running').exclude(ram=-1) \
+            .aggregate(ram=Sum('ram'))['ram'] or 0
+        stats.disk_allocated = vms.exclude(disk_size=-1) \
+            .aggregate(disk=Sum('disk_size'))['disk'] or 0
+
+        values = dict((field.attname, getattr(stats, field.attname))
+                      for field in cls._meta.fields
+                      if field.attname != 'cluster_id')
+        _store_cluster_row(cls, cluster, values)
+        cluster.stats = stats
+        return stats
+
+    @staticmethod
+    def _usage(total, free, allocated):
+        total = max(total, 0)
+        free = max(free, 0)
+        return {
+            'total': total,
+            'free': max(total - allocated, 0),
+            'allocated': allocated,
+            'used': total - free,
+        }
+
+    @property
+    def ram(self):
+        """ returns dict of free and total ram """
+        return self._usage(self.ram_total, self.ram_free, self.ram_allocated)
+
+    @property
+    def disk(self):
+        """ returns dict of free and total disk space """
+        return self._usage(self.disk_total, self.disk_free,
+                           self.disk_allocated)
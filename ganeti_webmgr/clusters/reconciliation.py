@@ -0,0 +1,135 @@
+"""
+Reconciliation of the nodes and instances of clusters in ganeti with those
+in the database, for the import pages.
+
+The names of each cluster's objects are fetched from ganeti once and kept for
+RECONCILIATION_CACHE_TIMEOUT seconds, and the database is queried once for
+every cluster.  The differences are found with sets.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+
+from ganeti_webmgr.utils.client import GanetiApiError
+
+
+# RAPI method listing the names of each kind of object
+FETCH = {
+    'instances': 'GetInstances',
+    'nodes': 'GetNodes',
+}
+
+_names = {}
+_lock = threading.Lock()
+
+
+class Reconciliation(object):
+    """
+    The differences between one kind of object of a cluster in ganeti and in
+    the database.
+
+    @param cluster - the Cluster
+    @param missing_in_db - sorted hostnames of the objects in ganeti that are
+    not in the database
+    @param missing_in_ganeti - sorted hostnames of the objects in the
+    database that are not in ganeti
+    """
+
+    def __init__(self, cluster, missing_in_db, missing_in_ganeti):
+        self.cluster = cluster
+        self.missing_in_db = missing_in_db
+        self.missing_in_ganeti = missing_in_ganeti
+
+
+def ganeti_names(cluster, kind):
+    """
+    Returns the set of hostnames of a cluster's nodes or instances in
+    ganeti, or None if they could not be retrieved.
+
+    @param kind - 'instances' or 'nodes'
+    """
+    key = (cluster.pk, kind)
+    now = time.time()
+    with _lock:
+        expires, names = _names.get(key, (0, None))
+    if expires > now:
+        return names
+
+    try:
+        names = getattr(cluster.rapi, FETCH[kind])()
+    except GanetiApiError:
+        return None
+    names = set(name.lower() for name in names)
+    store_names(cluster, kind, names)
+    return names
+
+
+def store_names(cluster, kind, names):
+    """
+    Keep the hostnames of a cluster's nodes or instances in ganeti, which
+    were retrieved by something else, such as a synchronization.
+    """
+    timeout = settings.RECONCILIATION_CACHE_TIMEOUT
+    if timeout:
+        with _lock:
+            _names[(cluster.pk, kind)] = (time.time() + timeout, set(names))
+
+
+def invalidate(cluster):
+    """
+    Forget the hostnames kept for a cluster.
+    """
+    with _lock:
+        for kind in FETCH:
+            _names.pop((cluster.pk, kind), None)
+
+
+def reconcile(clusters, kind):
+    """
+    Find the differences between the nodes or instances of several clusters
+    in ganeti and in the database.  Clusters whose objects could not be
+    retrieved from ganeti are left out, rather than reporting everything in
+    the database as missing.
+
+    @param clusters - iterable of Clusters
+    @param kind - 'instances' or 'nodes'
+    @returns a list of Reconciliations, in the order of the clusters
+    """
+    # preventing circular imports
+    from ganeti_webmgr.nodes.models import Node
+    from ganeti_webmgr.virtualmachines.models import VirtualMachine
+
+    clusters = list(clusters)
+    ganeti = {}
+    for cluster in clusters:
+        names = ganeti_names(cluster, kind)
+        if names is not None:
+            ganeti[cluster.pk] = names
+    if not ganeti:
+        return []
+
+    # instances being created from a template are not expected in ganeti yet
+    db = dict((id, set()) for id in ganeti)
+    expected = dict((id, set()) for id in ganeti)
+    if kind == 'instances':
+        rows = VirtualMachine.objects.filter(cluster__in=ganeti) \
+            .values_list('cluster', 'hostname', 'template')
+    else:
+        rows = ((cluster_id, hostname, None) for cluster_id, hostname
+                in Node.objects.filter(cluster__in=ganeti)
+                .values_list('cluster', 'hostname'))
+    for cluster_id, hostname, template in rows:
+        db[cluster_id].add(hostname)
+        if template is None:
+            expected[cluster_id].add(hostname)
+
+    reconciliations = []
+    for cluster in clusters:
+        if cluster.pk in ganeti:
+            names = ganeti[cluster.pk]
+            reconciliations.append(Reconciliation(
+                cluster, sorted(names - db[cluster.pk]),
+                sorted(expected[cluster.pk] - names)))
+    return reconciliations
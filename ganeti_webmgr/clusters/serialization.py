@@ -0,0 +1,193 @@
+"""
+Codecs for the info of cached cluster objects, which is stored as text in
+``CachedInfo.serialized_info``.
+
+Encoded info is prefixed with the name of the codec that wrote it, so info
+written by any codec can be decoded whichever codec is configured.  Info
+without a prefix was pickled by older versions.  Loading pickles is unsafe,
+so it is only decoded while re-encoding it with reencode(), which the
+migrations do, and is otherwise treated as empty.
+"""
+
+import base64
+import cPickle
+import logging
+import zlib
+
+import simplejson as json
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from ganeti_webmgr.utils import chunks
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+logger = logging.getLogger(__name__)
+
+# Number of rows re-encoded per query by reencode().
+REENCODE_BATCH_SIZE = 100
+
+
+class Codec(object):
+    """
+    Encodes info dictionaries to text and back.
+
+    @param name - name of the codec, stored as the prefix of encoded info
+    @param dumps - function encoding info to a string
+    @param loads - function decoding a string to info
+    @param binary - whether dumps returns binary data.  Binary data is
+    base64 encoded so that it can be stored in a TextField.
+    @param compress - whether encoded info is compressed with zlib
+    """
+
+    def __init__(self, name, dumps, loads, binary=False, compress=False):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+        self.binary = binary or compress
+        self.compress = compress
+
+    def encode(self, info):
+        data = self.dumps(info)
+        if self.compress:
+            data = zlib.compress(data)
+        if self.binary:
+            data = base64.b64encode(data)
+        return '%s:%s' % (self.name, data)
+
+    def decode(self, data):
+        """
+        Decode info, without the codec's prefix.
+        """
+        if self.binary:
+            data = base64.b64decode(data)
+        if self.compress:
+            data = zlib.decompress(data)
+        return self.loads(data)
+
+    @property
+    def available(self):
+        return self.dumps is not None
+
+
+class PickleCodec(Codec):
+    """
+    The format used by older versions.  Pickled info has no prefix, so that
+    it can still be read by those versions.  Loading pickles is unsafe, so
+    this codec can not be configured, and is only used to migrate info
+    backwards.
+    """
+
+    def __init__(self):
+        super(PickleCodec, self).__init__('pickle', cPickle.dumps,
+                                          cPickle.loads)
+
+    def encode(self, info):
+        return cPickle.dumps(info)
+
+    def decode(self, data):
+        return cPickle.loads(str(data))
+
+
+def _json_dumps(info):
+    return json.dumps(info, separators=(',', ':'))
+
+
+_msgpack_dumps = msgpack.packb if msgpack else None
+_msgpack_loads = msgpack.unpackb if msgpack else None
+
+CODECS = dict((codec.name, codec) for codec in (
+    Codec('json', _json_dumps, json.loads),
+    Codec('json+zlib', _json_dumps, json.loads, compress=True),
+    Codec('msgpack', _msgpack_dumps, _msgpack_loads, binary=True),
+    Codec('msgpack+zlib', _msgpack_dumps, _msgpack_loads, compress=True),
+    PickleCodec(),
+))
+
+
+def get_codec(name=None):
+    """
+    Returns a codec by name, or the one set by SERIALIZED_INFO_CODEC.
+    """
+    if name is None:
+        name = settings.SERIALIZED_INFO_CODEC
+        if name == 'pickle':
+            raise ImproperlyConfigured('The "pickle" serialized info codec '
+                                       'is unsafe and can not be configured.')
+    try:
+        codec = CODECS[name]
+    except KeyError:
+        raise ImproperlyConfigured('Unknown serialized info codec "%s". '
+                                   'Choose one of: %s'
+                                   % (name, ', '.join(sorted(CODECS))))
+    if not codec.available:
+        raise ImproperlyConfigured('The "%s" serialized info codec requires '
+                                   'msgpack-python to be installed.' % name)
+    return codec
+
+
+def encode(info, codec=None):
+    """
+    Encode info with the given codec, or the one set by
+    SERIALIZED_INFO_CODEC.
+    """
+    return get_codec(codec).encode(info)
+
+
+def codec_of(data):
+    """
+    Returns the name of the codec that encoded info.
+    """
+    name, sep, rest = data.partition(':')
+    if sep and name in CODECS:
+        return name
+    return 'pickle'
+
+
+def decode(data, allow_pickle=False):
+    """
+    Decode info encoded by any codec.
+
+    @param allow_pickle - whether to unpickle info without a prefix.  Only
+    reencode() should, as pickles can run arbitrary code when loaded.
+    Otherwise such info is logged and decoded as None.
+    """
+    name = codec_of(data)
+    codec = get_codec(name)
+    if name == 'pickle':
+        if not allow_pickle:
+            logger.warning('Ignored cached info without a codec prefix; run '
+                           'the migrations to re-encode pickled info.')
+            return None
+        return codec.decode(data)
+    return codec.decode(data[len(name) + 1:])
+
+
+def reencode(queryset, codec=None):
+    """
+    Re-encode the serialized info of every object in a queryset that was
+    not encoded with the given codec, or the one set by SERIALIZED_INFO_CODEC.
+
+    Rows are read and updated directly, without instantiating the objects.
+
+    @returns the number of objects re-encoded
+    """
+    codec = get_codec(codec)
+    ids = list(queryset.exclude(serialized_info='')
+                       .values_list('id', flat=True))
+    count = 0
+    for batch in chunks(ids, REENCODE_BATCH_SIZE):
+        rows = queryset.filter(id__in=batch) \
+            .values_list('id', 'serialized_info')
+        for id, data in rows:
+            if codec_of(data) != codec.name:
+                queryset.filter(id=id) \
+                    .update(serialized_info=codec.encode(
+                        decode(data, allow_pickle=True)))
+                count += 1
+    return count
@@ -1,3 +1,5 @@
 from .forms import *
 from .models import *
+from .reconciliation import *
+from .serialization import *
 from .views import *
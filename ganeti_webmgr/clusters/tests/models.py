@@ -19,12 +19,20 @@
 from datetime import datetime
 
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
 from django.test import TestCase
 
 from ganeti_webmgr.utils.proxy.constants import INFO, JOB_RUNNING, JOB
 
-from ganeti_webmgr.virtualmachines.models import VirtualMachine
-from ganeti_webmgr.clusters.models import Cluster
+from ganeti_webmgr.authentication.models import ClusterUser
+from ganeti_webmgr.ganeti_web import constants
+from ganeti_webmgr.ganeti_web.caps import classify_version
+from ganeti_webmgr.virtualmachines.models import (NetworkInterface,
+                                                  VirtualMachine)
+from ganeti_webmgr.clusters import models
+from ganeti_webmgr.clusters.models import (CachedInfo, Cluster,
+                                           ClusterReconciliation,
+                                           ClusterStats)
 from ganeti_webmgr.jobs.models import Job
 from ganeti_webmgr.nodes.models import Node
 from ganeti_webmgr.utils.models import Quota
@@ -33,6 +41,15 @@ from ganeti_webmgr.utils.models import Quota
 __all__ = ['TestClusterModel']
 
 
+def serialized_info(model, id):
+    """
+    Returns the serialized info stored for an object, without loading it.
+    """
+    return CachedInfo.objects.filter(
+        content_type=ContentType.objects.get_for_model(model),
+        object_id=id).values_list('serialized_info', flat=True)
+
+
 class TestClusterModel(TestCase):
 
     def test_instantiation(self):
@@ -68,6 +85,7 @@ class TestClusterModel(TestCase):
         Verifies:
             * mtime and ctime are parsed
             * ram, virtual_cpus, and disksize are parsed
+            * version, hypervisor, master and capability are stored
         """
         cluster = Cluster(hostname='foo.fake.hostname')
         cluster.save()
@@ -78,7 +96,40 @@ class TestClusterModel(TestCase):
         self.assertEqual(cluster.mtime,
                          datetime.fromtimestamp(1283552454.2998919))
 
+        cluster.save()
+        cluster = Cluster.objects.get(id=cluster.id)
+        self.assertEqual(INFO['software_version'], cluster.software_version)
+        self.assertEqual(INFO['default_hypervisor'],
+                         cluster.default_hypervisor)
+        self.assertEqual(INFO['master'], cluster.master)
+        self.assertEqual(classify_version(INFO['software_version']),
+                         cluster.capability)
+
+        cluster.delete()
+
+    def test_cached_info(self):
+        """
+        Test storing cached info in the CachedInfo side table
+
+        Verifies:
+            * info is stored when the object is saved
+            * info is not queried until it is accessed
+            * info is deleted with the object
+        """
+        cluster = Cluster(hostname='foo.fake.hostname', cached=datetime.now())
+        cluster.info = INFO
+        cluster.save()
+        self.assertTrue(serialized_info(Cluster, cluster.pk)[0])
+
+        ContentType.objects.get_for_model(Cluster)
+        with self.assertNumQueries(1):
+            cluster = Cluster.objects.get(pk=cluster.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(INFO['name'], cluster.info['name'])
+
+        pk = cluster.pk
         cluster.delete()
+        self.assertFalse(serialized_info(Cluster, pk))
 
     def test_get_quota(self):
         """
@@ -202,6 +253,324 @@ class TestClusterModel(TestCase):
         vm_current.delete()
         cluster.delete()
 
+    def test_sync_owner_tags(self):
+        """
+        Tests that synchronizing virtual machines reconciles owner tags
+
+        Verifies:
+            * instances whose owner is not tagged are tagged once
+            * tags are not changed without the cluster's credentials
+            * the cached info of tagged instances is not loaded again
+        """
+        cluster = Cluster(hostname='ganeti.example.test')
+        cluster.save()
+        owner = ClusterUser.objects.create(name='owner')
+        VirtualMachine.objects.create(cluster=cluster, owner=owner,
+                                      hostname='gimager.example.bak')
+        rapi = cluster.rapi
+        rapi.AddInstanceTags.reset()
+
+        cluster.sync_virtual_machines()
+        rapi.AddInstanceTags.assertNotCalled(self)
+
+        cluster.username = 'foo'
+        cluster.password = 'bar'
+        cluster.save()
+        rapi = cluster.rapi
+        rapi.AddInstanceTags.reset()
+        cluster.sync_virtual_machines()
+        tag = '%s%s' % (constants.OWNER_TAG, owner.id)
+        self.assertEqual([(('gimager.example.bak', [tag]), {})],
+                         rapi.AddInstanceTags.calls)
+        self.assertEqual(owner.id, VirtualMachine.objects.get(
+            hostname='gimager.example.bak').tagged_owner)
+
+        decoded = []
+        deserialize = VirtualMachine.deserialize
+
+        def counting_deserialize(data):
+            decoded.append(data)
+            return deserialize(data)
+        VirtualMachine.deserialize = staticmethod(counting_deserialize)
+        try:
+            cluster.sync_virtual_machines()
+        finally:
+            VirtualMachine.deserialize = staticmethod(deserialize)
+        self.assertEqual([], decoded)
+
+    def test_sync_virtual_machines_bulk(self):
+        """
+        Tests that synchronizing virtual machines uses bulk RAPI data
+
+        Verifies:
+            * instances are retrieved with one bulk call
+            * no per-instance RAPI calls are made
+            * new and existing VMs are updated from the bulk info
+        """
+        cluster = Cluster.objects.create(hostname='ganeti.example.test')
+        vm_current = VirtualMachine.objects.create(
+            cluster=cluster, hostname='gimager2.example.bak')
+        cluster.rapi.GetInstances.reset()
+        cluster.rapi.GetInstance.reset()
+
+        cluster.sync_virtual_machines()
+        self.assertEqual([((), {'bulk': True})],
+                         cluster.rapi.GetInstances.calls)
+        cluster.rapi.GetInstance.assertNotCalled(self)
+
+        for hostname in ('gimager.example.bak', 'gimager2.example.bak'):
+            values = VirtualMachine.objects.filter(
+                cluster=cluster, hostname=hostname).values()[0]
+            self.assertEqual(512, values['ram'])
+            self.assertEqual(5120, values['disk_size'])
+            self.assertEqual('running', values['status'])
+            self.assertTrue(values['cached'])
+            self.assertTrue(serialized_info(VirtualMachine, values['id'])[0])
+            self.assertEqual(cluster.hash, values['cluster_hash'])
+            self.assertEqual(['aa:00:00:c5:47:2e'], list(
+                NetworkInterface.objects.filter(virtual_machine=values['id'])
+                .values_list('mac', flat=True)))
+
+        vm = VirtualMachine.objects.get(pk=vm_current.pk)
+        self.assertEqual('image+gentoo-hardened-cf', vm.info['os'])
+
+        VirtualMachine.objects.filter(cluster=cluster).delete()
+        cluster.delete()
+
+    def test_import_virtual_machines(self):
+        """
+        Tests importing virtual machines missing from the database
+
+        Verifies:
+            * instances are retrieved with one bulk call
+            * instances already imported or not in ganeti are skipped
+            * imported VMs are owned and cached
+            * progress is reported
+        """
+        cluster = Cluster.objects.create(hostname='ganeti.example.test')
+        user = User.objects.create(username='tester')
+        owner = user.get_profile()
+        VirtualMachine.objects.create(cluster=cluster,
+                                      hostname='gimager.example.bak')
+        cluster.rapi.GetInstances.reset()
+        cluster.rapi.GetInstance.reset()
+
+        progress = []
+        hostnames = ['gimager.example.bak', 'GIMAGER2.example.bak',
+                     'gone.example.bak']
+        imported = cluster.import_virtual_machines(
+            hostnames, owner,
+            lambda done, total: progress.append((done, total)))
+        self.assertEqual(['gimager2.example.bak'], imported)
+        self.assertEqual([((), {'bulk': True})],
+                         cluster.rapi.GetInstances.calls)
+        self.assertEqual([(1, 1)], progress)
+
+        values = VirtualMachine.objects.filter(
+            hostname='gimager2.example.bak').values()[0]
+        self.assertEqual(owner.id, values['owner_id'])
+        self.assertEqual(512, values['ram'])
+        self.assertTrue(values['cached'])
+        self.assertTrue(serialized_info(VirtualMachine, values['id'])[0])
+        cluster.rapi.GetInstance.assertNotCalled(self)
+
+        # nothing is fetched if every instance was imported
+        cluster.rapi.GetInstances.reset()
+        self.assertEqual([], cluster.import_virtual_machines(
+            ['gimager2.example.bak']))
+        cluster.rapi.GetInstances.assertNotCalled(self)
+
+        VirtualMachine.objects.filter(cluster=cluster).delete()
+        cluster.delete()
+        user.delete()
+
+    def test_reconcile(self):
+        """
+        Tests storing a cluster's reconciliation counts
+
+        Verifies:
+            * import ready and missing VMs are counted
+            * ganeti is not queried when the hostnames are given
+            * synchronizing VMs updates the counts
+        """
+        cluster = Cluster.objects.create(hostname='ganeti.example.test')
+        user = User.objects.create(username='tester')
+        VirtualMachine.objects.create(cluster=cluster,
+                                      hostname='gimager.example.bak',
+                                      owner=user.get_profile())
+        VirtualMachine.objects.create(cluster=cluster,
+                                      hostname='missing.example.bak')
+
+        cluster.reconcile()
+        counts = ClusterReconciliation.objects.get(cluster=cluster)
+        self.assertEqual(1, counts.import_ready)
+        self.assertEqual(1, counts.missing)
+
+        cluster.rapi.GetInstances.reset()
+        cluster.reconcile(set(['gimager.example.bak', 'missing.example.bak']))
+        cluster.rapi.GetInstances.assertNotCalled(self)
+        self.assertEqual((0, 0), ClusterReconciliation.totals([cluster]))
+
+        cluster.reconcile()
+        self.assertEqual((1, 1), ClusterReconciliation.totals([cluster]))
+
+        cluster.sync_virtual_machines(remove=True)
+        self.assertEqual((0, 0), ClusterReconciliation.totals([cluster]))
+
+        ClusterReconciliation.adjust('missing', {cluster.pk: 1})
+        self.assertEqual((0, 1), ClusterReconciliation.totals([cluster]))
+
+        VirtualMachine.objects.filter(cluster=cluster).delete()
+        cluster.delete()
+        user.delete()
+
+    def test_update_rows(self):
+        """
+        Tests updating rows with different values
+
+        Verifies:
+            * every row of a batch is updated by one query
+            * each row gets its own values, including NULLs
+            * batches stay below the query parameter limit
+        """
+        cluster = Cluster.objects.create(hostname='ganeti.example.test')
+        vm1 = VirtualMachine.objects.create(cluster=cluster, hostname='vm1')
+        vm2 = VirtualMachine.objects.create(cluster=cluster, hostname='vm2',
+                                            network_port=11000)
+        cached = datetime(2012, 1, 1)
+        rows = {vm1.id: dict(ram=512, network_port=11165, cached=cached),
+                vm2.id: dict(ram=1024, network_port=None, cached=cached)}
+
+        with self.assertNumQueries(1):
+            Cluster._update_rows(VirtualMachine, rows)
+        # values_list() skips field conversion, so convert cached ourselves
+        to_datetime = VirtualMachine._meta.get_field('cached').to_python
+        values = VirtualMachine.objects.filter(cluster=cluster) \
+            .order_by('hostname').values_list('ram', 'network_port', 'cached')
+        self.assertEqual([(512, 11165, cached), (1024, None, cached)],
+                         [(ram, port, to_datetime(value))
+                          for ram, port, value in values])
+
+        params = models.UPDATE_ROWS_PARAMS
+        models.UPDATE_ROWS_PARAMS = 7
+        try:
+            with self.assertNumQueries(2):
+                Cluster._update_rows(VirtualMachine, rows)
+        finally:
+            models.UPDATE_ROWS_PARAMS = params
+
+        VirtualMachine.objects.filter(cluster=cluster).delete()
+        cluster.delete()
+
+    def test_sync_virtual_machines_query(self):
+        """
+        Tests synchronizing virtual machines with the RAPI query resource
+
+        Verifies:
+            * only the persisted fields are queried
+            * database columns are updated
+            * the cached info is not touched
+        """
+        cluster = Cluster.objects.create(hostname='ganeti.example.test')
+        VirtualMachine.objects.create(cluster=cluster,
+                                      hostname='gimager2.example.bak')
+        cluster.rapi.GetInstances.reset()
+
+        cluster.sync_virtual_machines(query=True)
+        cluster.rapi.Query.assertCalled(
+            self, 'instance', list(VirtualMachine.QUERY_FIELDS))
+        cluster.rapi.GetInstances.assertNotCalled(self)
+
+        for hostname in ('gimager.example.bak', 'gimager2.example.bak'):
+            values = VirtualMachine.objects.filter(
+                cluster=cluster, hostname=hostname).values()[0]
+            self.assertEqual(512, values['ram'])
+            self.assertEqual(5120, values['disk_size'])
+            self.assertEqual('running', values['status'])
+            self.assertEqual(None, values['cached'])
+            self.assertEqual(None, values['mtime'])
+            self.assertFalse(serialized_info(VirtualMachine, values['id']))
+            self.assertEqual(['bridged'], list(
+                NetworkInterface.objects.filter(virtual_machine=values['id'])
+                .values_list('mode', flat=True)))
+
+        VirtualMachine.objects.filter(cluster=cluster).delete()
+        cluster.delete()
+
+    def test_sync_virtual_machines_incremental(self):
+        """
+        Tests an incremental sync of virtual machines
+
+        Verifies:
+            * only the name, mtime and serial_no of every instance are
+              queried
+            * only new and modified instances are retrieved
+            * modifications that kept the same mtime are found
+            * unchanged instances have their cache time updated
+        """
+        cluster = Cluster.objects.create(hostname='ganeti.example.test')
+        cluster.sync_virtual_machines()
+        VirtualMachine.objects.filter(hostname='gimager.example.bak') \
+            .update(mtime=datetime(2010, 1, 1))
+        VirtualMachine.objects.filter(hostname='gimager2.example.bak') \
+            .update(cached=datetime(2010, 1, 1))
+        cluster.rapi.GetInstances.reset()
+        cluster.rapi.GetInstance.reset()
+        cluster.rapi.Query.reset()
+
+        cluster.sync_virtual_machines(incremental=True)
+        cluster.rapi.Query.assertCalled(self, 'instance',
+                                        ['name', 'mtime', 'serial_no'])
+        cluster.rapi.GetInstances.assertNotCalled(self)
+        self.assertEqual([(('gimager.example.bak',), {})],
+                         cluster.rapi.GetInstance.calls)
+
+        modified = VirtualMachine.objects.get(hostname='gimager.example.bak')
+        self.assertNotEqual(datetime(2010, 1, 1), modified.mtime)
+        unchanged = VirtualMachine.objects.get(
+            hostname='gimager2.example.bak')
+        self.assertTrue(unchanged.cached > datetime(2010, 1, 1))
+
+        # serial_no catches modifications that kept the same mtime
+        VirtualMachine.objects.filter(hostname='gimager.example.bak') \
+            .update(serial_no=7)
+        cluster.rapi.GetInstance.reset()
+        cluster.sync_virtual_machines(incremental=True)
+        self.assertEqual([(('gimager.example.bak',), {})],
+                         cluster.rapi.GetInstance.calls)
+        self.assertEqual(8, VirtualMachine.objects.get(
+            hostname='gimager.example.bak').serial_no)
+
+        VirtualMachine.objects.filter(cluster=cluster).delete()
+        cluster.delete()
+
+    def test_sync_nodes_query(self):
+        """
+        Tests synchronizing nodes with the RAPI query resource
+
+        Verifies:
+            * only the persisted fields are queried
+            * fields without data are handled
+        """
+        cluster = Cluster.objects.create(hostname='ganeti.example.test')
+        cluster.rapi.GetNodes.reset()
+
+        nodes = cluster.sync_nodes(query=True)
+        cluster.rapi.Query.assertCalled(self, 'node',
+                                        list(Node.QUERY_FIELDS))
+        cluster.rapi.GetNodes.assertNotCalled(self)
+        self.assertEqual(3, len(nodes))
+
+        node = Node.objects.filter(hostname='gtest1.example.bak').values()[0]
+        self.assertEqual(1997, node['ram_total'])
+        self.assertEqual('M', node['role'])
+        node = Node.objects.filter(hostname='gtest3.example.bak').values()[0]
+        self.assertEqual(0, node['ram_total'])
+        self.assertTrue(node['offline'])
+
+        Node.objects.filter(cluster=cluster).delete()
+        cluster.delete()
+
     def test_sync_nodes(self):
         """
         Tests synchronizing cached Nodes (stored in db) with info
@@ -247,6 +616,38 @@ class TestClusterModel(TestCase):
         node_removed.delete()
         cluster.delete()
 
+    def test_sync_nodes_bulk(self):
+        """
+        Tests that synchronizing nodes uses bulk RAPI data
+
+        Verifies:
+            * nodes are retrieved with one bulk call, and no per-node calls
+            * a hostname to primary key map is returned
+            * the map is used to set the nodes of synchronized VMs
+        """
+        cluster = Cluster.objects.create(hostname='ganeti.example.test')
+        cluster.rapi.GetNodes.reset()
+        cluster.rapi.GetNode.reset()
+
+        nodes = cluster.sync_nodes()
+        self.assertEqual([((), {'bulk': True})], cluster.rapi.GetNodes.calls)
+        cluster.rapi.GetNode.assertNotCalled(self)
+        self.assertEqual(dict(cluster.nodes.values_list('hostname', 'id')),
+                         nodes)
+        node = Node.objects.get(hostname='gtest1.example.bak')
+        self.assertEqual(1997, node.ram_total)
+        self.assertTrue(node.info)
+
+        cluster.sync_virtual_machines(nodes=nodes)
+        vm = VirtualMachine.objects.get(cluster=cluster,
+                                        hostname='gimager.example.bak')
+        self.assertEqual(nodes['gtest1.example.bak'], vm.primary_node_id)
+        self.assertEqual(None, vm.secondary_node_id)
+
+        VirtualMachine.objects.filter(cluster=cluster).delete()
+        Node.objects.filter(cluster=cluster).delete()
+        cluster.delete()
+
     def test_missing_in_database(self):
         """
         Tests missing_in_ganeti property
@@ -324,9 +725,11 @@ class TestClusterModel(TestCase):
         self.assertEqual(0, ram['used'])
         self.assertEqual(579, ram['allocated'])
 
-        # force refresh of nodes and rerun test for real values
+        # force refresh of nodes and rerun test for real values.  The totals
+        # are stored when the cluster is synchronized.
         node.refresh()
         node1.refresh()
+        ClusterStats.store(c)
         ram = c.available_ram
         self.assertEqual(9999, ram['total'])
         self.assertEqual(9420, ram['free'])
@@ -346,6 +749,37 @@ class TestClusterModel(TestCase):
         c.delete()
         c2.delete()
 
+    def test_statistics(self):
+        """
+        Tests the totals stored when a cluster is synchronized
+
+        Verifies:
+            * node and VM counts and resources are stored by sync
+            * stored totals are read without queries
+            * totals are stored again after the cluster is refreshed
+        """
+        cluster = Cluster.objects.create(hostname='ganeti.example.test')
+        cluster.refresh()
+        cluster.sync_nodes()
+        cluster.sync_virtual_machines()
+        VirtualMachine.objects.filter(cluster=cluster) \
+            .update(status='stopped', disk_size=1024)
+
+        cluster = Cluster.objects.select_related('stats').get(id=cluster.id)
+        with self.assertNumQueries(0):
+            stats = cluster.statistics
+            self.assertEqual(3, stats.nodes)
+            self.assertEqual(2, stats.virtual_machines)
+            self.assertEqual(2, stats.vms_running)
+            self.assertEqual(cluster.available_ram['total'], stats.ram_total)
+
+        cluster.cached = datetime.now()
+        self.assertEqual(0, cluster.statistics.vms_running)
+        self.assertEqual(0, cluster.available_ram['allocated'])
+        self.assertEqual(2048, cluster.available_disk['allocated'])
+        self.assertEqual(0, ClusterStats.objects.get(cluster=cluster)
+                         .vms_running)
+
     def test_available_disk(self):
         """
         Tests that the available_disk property returns the correct values
@@ -385,9 +819,11 @@ class TestClusterModel(TestCase):
         self.assertEqual(0, disk['used'])
         self.assertEqual(1602, disk['allocated'])
 
-        # force refresh of nodes and rerun test for real values
+        # force refresh of nodes and rerun test for real values.  The totals
+        # are stored when the cluster is synchronized.
         node.refresh()
         node1.refresh()
+        ClusterStats.store(c)
         disk = c.available_disk
         self.assertEqual(6666, disk['total'])
         self.assertEqual(5064, disk['free'])
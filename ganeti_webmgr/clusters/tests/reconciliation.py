@@ -0,0 +1,110 @@
+# Copyright (C) 2010 Oregon State University et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+from django.test import TestCase
+
+from ganeti_webmgr.clusters import reconciliation
+from ganeti_webmgr.clusters.models import Cluster
+from ganeti_webmgr.nodes.models import Node
+from ganeti_webmgr.utils.client import GanetiApiError
+from ganeti_webmgr.vm_templates.models import VirtualMachineTemplate
+from ganeti_webmgr.virtualmachines.models import VirtualMachine
+
+
+__all__ = ['TestReconciliation']
+
+
+class TestReconciliation(TestCase):
+
+    def setUp(self):
+        self.cluster = Cluster.objects.create(hostname='ganeti.example.test',
+                                              slug='ganeti')
+        self.rapi = self.cluster.rapi
+        self.rapi.GetInstances.reset()
+        self.rapi.GetNodes.reset()
+
+    def tearDown(self):
+        self.rapi.GetInstances.error = None
+        self.rapi.GetNodes.error = None
+        VirtualMachine.objects.all().delete()
+        VirtualMachineTemplate.objects.all().delete()
+        Node.objects.all().delete()
+        Cluster.objects.all().delete()
+
+    def test_reconcile_instances(self):
+        """
+        Test reconciling instances
+
+        Verifies:
+            * instances in only one place are found
+            * instances being created from a template are not missing
+            * the names in ganeti are only fetched once
+        """
+        template = VirtualMachineTemplate.objects.create(
+            template_name='template', cluster=self.cluster)
+        VirtualMachine.objects.create(cluster=self.cluster,
+                                      hostname='gimager.example.bak')
+        VirtualMachine.objects.create(cluster=self.cluster,
+                                      hostname='missing.example.bak')
+        VirtualMachine.objects.create(cluster=self.cluster,
+                                      hostname='new.example.bak',
+                                      template=template)
+
+        for i in range(2):
+            result, = reconciliation.reconcile([self.cluster], 'instances')
+            self.assertEqual(self.cluster, result.cluster)
+            self.assertEqual(['gimager2.example.bak'], result.missing_in_db)
+            self.assertEqual(['missing.example.bak'],
+                             result.missing_in_ganeti)
+        self.assertEqual(1, len(self.rapi.GetInstances.calls))
+
+        # saving the cluster forgets the names
+        self.cluster.save()
+        reconciliation.reconcile([self.cluster], 'instances')
+        self.assertEqual(2, len(self.rapi.GetInstances.calls))
+
+    def test_reconcile_nodes(self):
+        """
+        Test reconciling nodes
+        """
+        Node.objects.create(cluster=self.cluster,
+                            hostname='gtest1.example.bak')
+        Node.objects.create(cluster=self.cluster, hostname='old.example.bak')
+
+        result, = reconciliation.reconcile([self.cluster], 'nodes')
+        self.assertEqual(['gtest2.example.bak', 'gtest3.example.bak'],
+                         result.missing_in_db)
+        self.assertEqual(['old.example.bak'], result.missing_in_ganeti)
+
+    def test_unreachable_cluster(self):
+        """
+        Test reconciling a cluster that can not be reached
+
+        Verifies:
+            * the cluster is left out rather than everything being missing
+            * the failure is not cached
+        """
+        VirtualMachine.objects.create(cluster=self.cluster,
+                                      hostname='gimager.example.bak')
+        self.rapi.GetInstances.error = GanetiApiError('Testing Error')
+        self.assertEqual([], reconciliation.reconcile([self.cluster],
+                                                      'instances'))
+        self.assertEqual([], self.cluster.missing_in_ganeti)
+
+        self.rapi.GetInstances.error = None
+        result, = reconciliation.reconcile([self.cluster], 'instances')
+        self.assertEqual(['gimager2.example.bak'], result.missing_in_db)
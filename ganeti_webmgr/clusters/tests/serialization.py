@@ -0,0 +1,114 @@
+# Copyright (C) 2010 Oregon State University et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+import cPickle
+from datetime import datetime
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, TestCase
+
+from ganeti_webmgr.clusters import serialization
+from ganeti_webmgr.clusters.models import CachedInfo, Cluster
+from ganeti_webmgr.utils.proxy.constants import INSTANCE
+from ganeti_webmgr.virtualmachines.models import VirtualMachine
+
+
+__all__ = ['TestSerialization', 'TestReencode']
+
+
+class TestSerialization(SimpleTestCase):
+
+    def test_roundtrip(self):
+        """
+        Test that every available codec decodes what it encoded
+        """
+        for name, codec in serialization.CODECS.items():
+            if not codec.available:
+                continue
+            data = serialization.encode(INSTANCE, name)
+            self.assertEqual(name, serialization.codec_of(data))
+            self.assertEqual(INSTANCE,
+                             serialization.decode(data, allow_pickle=True))
+
+    def test_legacy_pickle(self):
+        """
+        Test that info pickled by older versions is only decoded when
+        re-encoding it
+
+        Verifies:
+            * pickled info is decoded as None unless allowed
+            * the pickle codec can not be configured
+        """
+        data = cPickle.dumps(INSTANCE)
+        self.assertEqual('pickle', serialization.codec_of(data))
+        self.assertEqual(None, serialization.decode(data))
+        self.assertEqual(INSTANCE,
+                         serialization.decode(data, allow_pickle=True))
+        self.assertEqual(data, serialization.encode(INSTANCE, 'pickle'))
+
+        with self.settings(SERIALIZED_INFO_CODEC='pickle'):
+            self.assertRaises(ImproperlyConfigured, serialization.get_codec)
+
+    def test_unknown_codec(self):
+        self.assertRaises(ImproperlyConfigured, serialization.get_codec,
+                          'yaml')
+
+
+class TestReencode(TestCase):
+
+    def test_reencode(self):
+        """
+        Test re-encoding stored info with another codec
+
+        Verifies:
+            * only info in another format is re-encoded
+            * re-encoded info is decoded as before
+        """
+        cluster = Cluster.objects.create(hostname='ganeti.example.test')
+        vm = VirtualMachine.objects.create(cluster=cluster,
+                                           hostname='gimager.example.bak')
+        CachedInfo.store(vm, cPickle.dumps(INSTANCE))
+        queryset = vm.cached_info.all()
+
+        self.assertEqual(1, serialization.reencode(queryset, 'json+zlib'))
+        self.assertEqual(0, serialization.reencode(queryset, 'json+zlib'))
+        data = queryset.values_list('serialized_info', flat=True)[0]
+        self.assertEqual('json+zlib', serialization.codec_of(data))
+        self.assertEqual(INSTANCE, serialization.decode(data))
+
+        self.assertEqual(1, serialization.reencode(queryset, 'pickle'))
+        data = queryset.values_list('serialized_info', flat=True)[0]
+        self.assertEqual(INSTANCE, cPickle.loads(str(data)))
+
+        vm.delete()
+        cluster.delete()
+
+    def test_pickled_info_ignored(self):
+        """
+        Test that pickled info is not unpickled when an object is loaded
+        """
+        cluster = Cluster.objects.create(hostname='ganeti.example.test')
+        vm = VirtualMachine.objects.create(cluster=cluster,
+                                           hostname='gimager.example.bak')
+        VirtualMachine.objects.filter(pk=vm.pk).update(cached=datetime.now())
+        CachedInfo.store(vm, cPickle.dumps(INSTANCE))
+
+        vm = VirtualMachine.objects.get(pk=vm.pk)
+        self.assertEqual(None, vm.info)
+
+        vm.delete()
+        cluster.delete()
@@ -16,6 +16,8 @@
 # USA.
 
 
+from datetime import datetime
+
 from django.contrib.auth.models import User, Group
 from django.test import TestCase
 from django.test.client import Client
@@ -29,7 +31,7 @@ from object_permissions import get_user_perms
 
 from ganeti_webmgr.utils.proxy.constants import NODES, NODES_BULK
 
-from ganeti_webmgr.clusters.models import Cluster
+from ganeti_webmgr.clusters.models import CachedInfo, Cluster
 from ganeti_webmgr.virtualmachines.models import VirtualMachine
 from ganeti_webmgr.utils.models import Quota, SSHKey
 
@@ -418,6 +420,39 @@ class TestClusterViews(TestCase, ViewTestMixin, UserTestMixin):
         self.validate_get(url, args, 'ganeti/node/table.html')
         self.cluster.rapi.GetNodes.response = NODES
 
+    def test_view_nodes_columns(self):
+        """
+        The node table is rendered from columns and grouped queries, without
+        loading the cached info of each node.
+        """
+        url = "/cluster/%s/nodes/" % self.cluster.slug
+        self.cluster.rapi.GetNodes.response = NODES_BULK
+        self.cluster.sync_nodes()
+        self.cluster.rapi.GetNodes.response = NODES
+        nodes = self.cluster.nodes.order_by('hostname')
+        nodes.update(cached=datetime.now(), offline=False)
+        nodes.filter(pk=nodes[0].pk).update(offline=True)
+        VirtualMachine.objects.create(cluster=self.cluster, hostname='vm1',
+                                      primary_node=nodes[0],
+                                      secondary_node=nodes[1])
+
+        self.assertTrue(self.c.login(username=self.superuser.username,
+                                     password='secret'))
+        loaded = []
+        load = CachedInfo.load
+
+        def counting_load(obj):
+            loaded.append(obj)
+            return load(obj)
+        CachedInfo.load = staticmethod(counting_load)
+        try:
+            response = self.c.get(url)
+        finally:
+            CachedInfo.load = load
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([], loaded)
+        self.assertContains(response, 'title="Offline"', 1)
+
     def test_view_add_permissions(self):
         """
         Test adding permissions to a new User or Group
@@ -1174,3 +1209,24 @@ class TestClusterVMListView(TestCase):
         vms = [vm.pk for vm in response.context['object_list']]
         expected_vms = [self.vm1.pk]
         self.assertEqual(vms, expected_vms)
+
+    def test_without_info(self):
+        """
+        Listing the VMs of a cluster does not load their cached info.
+        """
+        url = '/cluster/%s/virtual_machines'
+        VirtualMachine.objects.update(cached=datetime.now())
+        self.client.login(username=self.admin.username, password='secret')
+        loaded = []
+        load = CachedInfo.load
+
+        def counting_load(obj):
+            loaded.append(obj)
+            return load(obj)
+        CachedInfo.load = staticmethod(counting_load)
+        try:
+            response = self.client.get(url % self.cluster.slug)
+        finally:
+            CachedInfo.load = load
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([], loaded)
@@ -24,7 +24,7 @@ from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import PermissionDenied
 from django.core.urlresolvers import reverse
-from django.db.models import Q, Sum
+from django.db.models import Q
 from django.http import (HttpResponse, HttpResponseRedirect,
                          HttpResponseForbidden)
 from django.shortcuts import get_object_or_404, render_to_response, redirect
@@ -47,6 +47,7 @@ log_action = LogItem.objects.log_action
 
 from ganeti_webmgr.ganeti_web.backend.queries import (vm_qs_for_users,
                                                       cluster_qs_for_user)
+from ganeti_webmgr.ganeti_web.backend.snapshots import PermissionSnapshot
 
 from .forms import EditClusterForm, QuotaForm
 from .models import Cluster
@@ -57,6 +58,7 @@ from ganeti_webmgr.jobs.models import Job
 
 from ganeti_webmgr.ganeti_web.views import render_404
 from ganeti_webmgr.ganeti_web.views.generic import (NO_PRIVS,
+                                                    KeysetPaginationMixin,
                                                     LoginRequiredMixin,
                                                     PaginationMixin,
                                                     GWMBaseView)
@@ -74,25 +76,25 @@ class ClusterDetailView(LoginRequiredMixin, DetailView):
 
     def get_object(self, queryset=None):
         self.cluster = get_object_or_404(
-            Cluster, slug=self.kwargs["cluster_slug"])
+            Cluster.objects.select_related("stats"),
+            slug=self.kwargs["cluster_slug"])
         return self.cluster
 
     def get_context_data(self, **kwargs):
         cluster = self.cluster
         user = self.request.user
-        admin = user.is_superuser or user.has_perm("admin", cluster)
+        snapshot = PermissionSnapshot.for_request(self.request)
+        admin = user.is_superuser or snapshot.has_perm("admin", cluster)
 
         # If we're not admin we might still have admin on a VM so this
         # is to determine if we should show the VM tab to the user.
-        show_vms = admin or user.get_objects_any_perms(
-            VirtualMachine, perms=['admin']).filter(cluster=cluster)
+        show_vms = admin or snapshot.has_vm_perm_on_cluster("admin", cluster)
 
         master_node = {"exists": False}
-        if cluster.info:
-            master_node['hostname'] = cluster.info.get("master", None)
-            if master_node['hostname']:
-                master_node['exists'] = cluster.nodes.filter(
-                    hostname=master_node['hostname']).exists()
+        if cluster.master:
+            master_node['hostname'] = cluster.master
+            master_node['exists'] = cluster.nodes.filter(
+                hostname=master_node['hostname']).exists()
 
         return {
             "cluster": cluster,
@@ -113,7 +115,7 @@ class ClusterListView(LoginRequiredMixin, PaginationMixin, GWMBaseView,
     def get_queryset(self):
         self.queryset = cluster_qs_for_user(self.request.user)
         qs = super(ClusterListView, self).get_queryset()
-        qs = qs.select_related("nodes", "virtual_machines")
+        qs = qs.select_related("stats")
         return qs
 
     def get_context_data(self, **kwargs):
@@ -159,7 +161,7 @@ class ClusterVMListView(BaseVMListView):
 
 
 class ClusterJobListView(LoginRequiredMixin, PaginationMixin, GWMBaseView,
-                         SingleTableView):
+                         KeysetPaginationMixin, SingleTableView):
 
     template_name = "ganeti/cluster/jobs.html"
     model = Job
@@ -176,7 +178,8 @@ class ClusterJobListView(LoginRequiredMixin, PaginationMixin, GWMBaseView,
         self.get_kwargs()
         self.cluster = get_object_or_404(Cluster, slug=self.cluster_slug)
         perms = self.can_create(self.cluster)
-        self.queryset = self.cluster.jobs.all()
+        self.queryset = self.cluster.jobs.select_related('cluster') \
+            .prefetch_related('obj')
         if not perms:
             raise PermissionDenied(NO_PRIVS)
 
@@ -201,29 +204,13 @@ def nodes(request, cluster_slug):
     if not (user.is_superuser or user.has_perm('admin', cluster)):
         raise PermissionDenied(NO_PRIVS)
 
-    # query allocated CPUS for all nodes in this list.  Must be done here to
-    # avoid querying Node.allocated_cpus for each node in the list.  Repackage
-    # list so it is easier to retrieve the values in the template
-    values = VirtualMachine.objects \
-        .filter(cluster=cluster, status='running') \
-        .exclude(virtual_cpus=-1) \
-        .order_by() \
-        .values('primary_node') \
-        .annotate(cpus=Sum('virtual_cpus'))
-    cpus = {}
-    nodes = cluster.nodes.all()
-    for d in values:
-        cpus[d['primary_node']] = d['cpus']
-
-    # Include nodes that do not have any virtual machines on them.
-    for node in nodes:
-        if node.pk not in cpus:
-            cpus[node.pk] = 0
+    # the resources allocated on every node are queried together rather
+    # than for each node in the list
+    nodes = cluster.nodes.with_allocation()
 
     return render_to_response("ganeti/node/table.html",
                               {'cluster': cluster,
                                'nodes': nodes,
-                               'cpus': cpus,
                                },
                               context_instance=RequestContext(request),
                               )
@@ -252,8 +239,8 @@ def edit(request, cluster_slug=None):
             #   virtual machines on edit of cluster
             if cluster.info is None:
                 try:
-                    cluster.sync_nodes()
-                    cluster.sync_virtual_machines()
+                    nodes = cluster.sync_nodes()
+                    cluster.sync_virtual_machines(nodes=nodes)
                 except GanetiApiError:
                     # ganeti errors here are silently discarded.  It's
                     # valid to enter bad info.  A user might be adding
@@ -291,8 +278,8 @@ def refresh(request, cluster_slug):
     cluster = get_object_or_404(Cluster, slug=cluster_slug)
     try:
         cluster.refresh()
-        cluster.sync_nodes(remove=True)
-        cluster.sync_virtual_machines(remove=True)
+        nodes = cluster.sync_nodes(remove=True)
+        cluster.sync_virtual_machines(remove=True, nodes=nodes)
     except GanetiApiError as e:
         msg = str(e)
         msg = "<p>%s</p>" % msg
@@ -130,7 +130,7 @@ def owner_qs_for_superuser(cluster):
 def vm_qs_for_admins(user):
     """
     Retrieve a queryset of all of the virtual machines for which this user is
-    an administrator.
+    an administrator, directly or through cluster permissions.
     """
 
     if user.is_superuser:
@@ -138,9 +138,8 @@ def vm_qs_for_admins(user):
     elif user.is_anonymous():
         qs = VirtualMachine.objects.none()
     else:
-        qs = user.get_objects_any_perms(VirtualMachine, groups=True,
-                                        perms=["admin"])
-        qs |= cluster_vm_qs(user, ['admin'])
+        qs = VirtualMachine.objects.filter(access__user=user,
+                                           access__admin=True)
 
     return qs
 
@@ -149,24 +148,26 @@ def vm_qs_for_users(user, clusters=True):
     """
     Retrieves a queryset of all the virtual machines for which the user has
     any permission.
+
+    Unless clusters is False, this includes the virtual machines the user is
+    an administrator of through cluster permissions.  Those are looked up in
+    the VirtualMachineAccess index with a single join.
     """
 
     if user.is_superuser:
         qs = VirtualMachine.objects.all()
     elif user.is_anonymous():
         qs = VirtualMachine.objects.none()
+    elif clusters:
+        # the index has one row per user and VM, so no distinct() is needed
+        qs = VirtualMachine.objects.filter(access__user=user)
     else:
         # If no permissions are provided, then *any* permission will cause a VM
         # to be added to the query.
-        qs = user.get_objects_any_perms(VirtualMachine, groups=True)
-
-        # Add all VMs including VMs you have permission to via Cluster Perms
-        if clusters:
-            # Union of vms a user has any permissions to
-            # and vms a user has admin permissions to via cluster perms
-            qs |= cluster_vm_qs(user, ['admin'])
+        qs = user.get_objects_any_perms(VirtualMachine, groups=True) \
+            .distinct()
 
-    return qs.distinct()
+    return qs
 
 
 def cluster_vm_qs(user, perms=[], groups=True):
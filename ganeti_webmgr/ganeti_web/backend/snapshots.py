@@ -0,0 +1,249 @@
+# Copyright (C) 2012 Oregon State University et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+from django.db.models import Q
+
+from object_permissions.registration import get_model_perms, permission_map
+
+from ganeti_webmgr.clusters.models import Cluster
+from ganeti_webmgr.ganeti_web.models import PermissionsVersion
+from ganeti_webmgr.virtualmachines.models import VirtualMachine
+
+
+SESSION_KEY = '_permission_snapshot'
+REQUEST_ATTR = '_perm_snapshot'
+
+
+class PermissionSnapshot(object):
+    """
+    The Cluster permissions of a user, and the permissions they hold on any
+    VirtualMachine of each Cluster, including the permissions of their
+    groups, read in one query per model.
+
+    Snapshots are stored in the session and reused until the user's
+    PermissionsVersion changes, so that requests only need to read the
+    version instead of querying permissions again.  The snapshot is also
+    kept on the request, so the version is read once per request.  They are
+    kept per Cluster so that they stay small however many VirtualMachines
+    the user may access.  The permissions on a single VirtualMachine are
+    queried when they are first needed.  Superusers are not special cased,
+    callers check is_superuser as they did before.
+    """
+
+    def __init__(self, user, version, clusters, vm_clusters):
+        self.user = user
+        self.user_id = user.pk
+        self.version = version
+        # {cluster id: set of perms}
+        self.clusters = clusters
+        # {cluster id: set of perms held on any of its vms}
+        self.vm_clusters = vm_clusters
+        # {vm id: set of perms}, queried as they are needed
+        self.vms = {}
+
+    @classmethod
+    def take(cls, user, version=None):
+        """
+        Query the permissions of a user.
+        """
+        if version is None:
+            version = PermissionsVersion.current(user)
+
+        clusters = {}
+        for row in cls._rows(user, Cluster):
+            clusters.setdefault(row[0], set()).update(row[1])
+
+        vm_clusters = {}
+        for row in cls._rows(user, VirtualMachine, 'obj__cluster'):
+            vm_clusters.setdefault(row[2], set()).update(row[1])
+
+        return cls(user, version, clusters, vm_clusters)
+
+    @staticmethod
+    def _rows(user, model, *extra, **filters):
+        """
+        Yields (obj id, perms, *extra) for every permission row of a user or
+        of their groups, optionally filtered.
+        """
+        fields = get_model_perms(model)
+        rows = permission_map[model].objects \
+            .filter(Q(user=user) | Q(group__user=user), **filters) \
+            .values_list('obj', *(tuple(fields) + extra))
+        for row in rows:
+            perms = [f for f, value in zip(fields, row[1:]) if value]
+            yield (row[0], perms) + row[len(fields) + 1:]
+
+    @classmethod
+    def for_request(cls, request):
+        """
+        Returns the snapshot of the requesting user, reusing the one stored
+        in their session unless their permissions changed since it was
+        taken.  The snapshot is kept on the request for later calls.
+        """
+        snapshot = getattr(request, REQUEST_ATTR, None)
+        if snapshot is None:
+            snapshot = cls._for_request(request)
+            setattr(request, REQUEST_ATTR, snapshot)
+        return snapshot
+
+    @classmethod
+    def _for_request(cls, request):
+        user = request.user
+        version = PermissionsVersion.current(user)
+        session = getattr(request, 'session', None)
+        if session is None:
+            return cls.take(user, version)
+
+        stored = session.get(SESSION_KEY)
+        if stored and stored['user'] == user.pk \
+                and stored['version'] == version:
+            return cls(user, version, stored['clusters'],
+                       stored['vm_clusters'])
+
+        snapshot = cls.take(user, version)
+        session[SESSION_KEY] = {
+            'user': snapshot.user_id,
+            'version': snapshot.version,
+            'clusters': snapshot.clusters,
+            'vm_clusters': snapshot.vm_clusters,
+        }
+        return snapshot
+
+    def get_perms(self, obj):
+        """
+        Returns the permissions held on a Cluster or VirtualMachine.  The
+        permissions on a VirtualMachine are queried, unless none are held on
+        any VirtualMachine of its Cluster.
+        """
+        if isinstance(obj, Cluster):
+            return self.clusters.get(obj.pk, set())
+        elif isinstance(obj, VirtualMachine):
+            if obj.cluster_id not in self.vm_clusters:
+                return set()
+            if obj.pk not in self.vms:
+                perms = set()
+                for row in self._rows(self.user, VirtualMachine, obj=obj):
+                    perms.update(row[1])
+                self.vms[obj.pk] = perms
+            return self.vms[obj.pk]
+        return set()
+
+    def get_perms_any(self, model):
+        """
+        Returns the permissions held on any object of a model.
+        """
+        perms = set()
+        if model is Cluster:
+            for obj_perms in self.clusters.values():
+                perms.update(obj_perms)
+        elif model is VirtualMachine:
+            for obj_perms in self.vm_clusters.values():
+                perms.update(obj_perms)
+        return perms
+
+    def has_perm(self, perm, obj):
+        return perm in self.get_perms(obj)
+
+    def has_any_perms(self, obj, perms=None):
+        """
+        Check whether any of the given permissions, or any permission at all,
+        is held on an object or on any object of a model.
+        """
+        if isinstance(obj, type):
+            held = self.get_perms_any(obj)
+        else:
+            held = self.get_perms(obj)
+        if perms is None:
+            return bool(held)
+        return any(perm in held for perm in perms)
+
+    def has_vm_perm_on_cluster(self, perm, cluster):
+        """
+        Check whether a permission is held on any VirtualMachine of a
+        Cluster.
+        """
+        return perm in self.vm_clusters.get(cluster.pk, ())
+
+
+class PagePermissions(object):
+    """
+    The permissions of a user on a page of objects, read in at most one query
+    per model so that rows can check permissions without a query each.
+    Permissions are read for the Clusters and VirtualMachines in the page,
+    and for the Clusters of the other objects.  Superusers hold every
+    permission, and no query is made for them.
+    """
+
+    def __init__(self, clusters, vms, superuser=False):
+        # {cluster id: set of perms}
+        self.clusters = clusters
+        # {vm id: set of perms}
+        self.vms = vms
+        self.superuser = superuser
+
+    @classmethod
+    def load(cls, user, objects):
+        """
+        Query the permissions of a user on a page of objects.
+        """
+        if user.is_superuser:
+            return cls({}, {}, superuser=True)
+
+        cluster_ids = set()
+        vm_ids = set()
+        for obj in objects:
+            if isinstance(obj, Cluster):
+                cluster_ids.add(obj.pk)
+                continue
+            if isinstance(obj, VirtualMachine):
+                vm_ids.add(obj.pk)
+            cluster_id = getattr(obj, 'cluster_id', None)
+            if cluster_id is not None:
+                cluster_ids.add(cluster_id)
+
+        return cls(cls._perms(user, Cluster, cluster_ids),
+                   cls._perms(user, VirtualMachine, vm_ids))
+
+    @staticmethod
+    def _perms(user, model, ids):
+        perms = {}
+        if ids:
+            for row in PermissionSnapshot._rows(user, model, obj__in=ids):
+                perms.setdefault(row[0], set()).update(row[1])
+        return perms
+
+    def get_perms(self, obj):
+        if isinstance(obj, Cluster):
+            return self.clusters.get(obj.pk, set())
+        elif isinstance(obj, VirtualMachine):
+            return self.vms.get(obj.pk, set())
+        return set()
+
+    def has_perm(self, perm, obj):
+        return self.superuser or perm in self.get_perms(obj)
+
+    def has_any_perms(self, obj, perms=None):
+        """
+        Check whether any of the given permissions, or any permission at all,
+        is held on an object of the page.
+        """
+        if self.superuser:
+            return True
+        held = self.get_perms(obj)
+        if perms is None:
+            return bool(held)
+        return any(perm in held for perm in perms)
@@ -47,8 +47,8 @@ def instance_to_template(vm, name):
     template.template_name = name
     template.description = ""
     template.cluster = vm.cluster
-    template.start = vm.info["admin_state"]
-    template.disk_template = vm.info["disk_template"]
+    template.start = vm.admin_state == "up"
+    template.disk_template = vm.disk_template
     template.os = vm.operating_system
 
     # Backend parameters.
@@ -36,11 +36,21 @@ x.y.z (major.minor.patch) versioning pattern.
 
 def classify(cluster):
     """
-    Determine the class of a cluster by examining its version.
+    Determine the class of a cluster.
+
+    The class is stored on the cluster whenever its info is parsed, so its
+    version only needs to be examined if the info was never parsed.
     """
 
-    # Extract the version string from the cluster.
-    s = cluster.info["software_version"]
+    if cluster.capability is not None:
+        return cluster.capability
+    return classify_version(cluster.info["software_version"])
+
+
+def classify_version(s):
+    """
+    Determine the class of a cluster by examining its version string.
+    """
 
     # First, try the whole splitting thing. If we can't do it that way, assume
     # it's ancient.
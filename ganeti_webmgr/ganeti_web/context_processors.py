@@ -17,6 +17,7 @@
 
 from django.conf import settings
 from ganeti_webmgr.clusters.models import Cluster
+from ganeti_webmgr.ganeti_web.backend.snapshots import PermissionSnapshot
 
 
 def site(request):
@@ -61,7 +62,7 @@ def common_permissions(request):
         if user.is_superuser:
             return CLUSTER_ADMIN_PERMISSIONS
 
-        perms = user.get_perms_any(Cluster)
+        perms = PermissionSnapshot.for_request(request).get_perms_any(Cluster)
 
         if 'admin' in perms:
             return CLUSTER_ADMIN_PERMISSIONS
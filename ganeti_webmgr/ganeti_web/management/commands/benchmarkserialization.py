@@ -0,0 +1,77 @@
+import time
+from optparse import make_option
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+
+from ganeti_webmgr.clusters import serialization
+from ganeti_webmgr.clusters.models import CachedInfo
+from ganeti_webmgr.virtualmachines.models import VirtualMachine
+from ganeti_webmgr.utils.proxy.constants import (INSTANCES_BULK,
+                                                 XEN_HVM_INSTANCE,
+                                                 XEN_PVM_INSTANCE)
+
+
+class Command(BaseCommand):
+    help = ("Compares the encode time, decode time and stored size of the "
+            "serialized info codecs.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--limit', type='int', dest='limit', default=500,
+                    help='Number of cached instances to benchmark with.  '
+                         'Defaults to 500.'),
+        make_option('--repeat', type='int', dest='repeat', default=10,
+                    help='Number of times each codec encodes and decodes the '
+                         'instances.  Defaults to 10.'),
+    )
+
+    def handle(self, *args, **options):
+        infos = self.load_infos(options.get('limit'))
+        repeat = options.get('repeat')
+        self.stdout.write('Benchmarking %d instance documents, %d times\n\n'
+                          % (len(infos), repeat))
+
+        row = '%-14s %12s %12s %12s %8s\n'
+        self.stdout.write(row % ('Codec', 'Encode (ms)', 'Decode (ms)',
+                                 'Size (KiB)', 'Ratio'))
+        pickle_size = None
+        for name in ('pickle', 'json', 'json+zlib', 'msgpack', 'msgpack+zlib'):
+            codec = serialization.CODECS[name]
+            if not codec.available:
+                self.stdout.write('%-14s not available\n' % name)
+                continue
+
+            start = time.time()
+            for i in xrange(repeat):
+                encoded = [codec.encode(info) for info in infos]
+            encode_time = (time.time() - start) / repeat
+
+            start = time.time()
+            for i in xrange(repeat):
+                for data in encoded:
+                    serialization.decode(data, allow_pickle=True)
+            decode_time = (time.time() - start) / repeat
+
+            size = sum(len(data) for data in encoded)
+            if pickle_size is None:
+                pickle_size = size
+            self.stdout.write(row % (name, '%.2f' % (encode_time * 1000),
+                                     '%.2f' % (decode_time * 1000),
+                                     '%.1f' % (size / 1024.0),
+                                     '%.2f' % (float(size) / pickle_size)))
+
+    def load_infos(self, limit):
+        """
+        Returns the cached info of up to limit instances, read without
+        instantiating them.  Sample instances are used if none are cached.
+        """
+        content_type = ContentType.objects.get_for_model(VirtualMachine)
+        rows = CachedInfo.objects.filter(content_type=content_type) \
+            .exclude(serialized_info='') \
+            .values_list('serialized_info', flat=True)[:limit]
+        infos = [serialization.decode(data) for data in rows]
+        infos = [info for info in infos if info]
+        if not infos:
+            samples = INSTANCES_BULK + [XEN_HVM_INSTANCE, XEN_PVM_INSTANCE]
+            infos = [samples[i % len(samples)] for i in xrange(limit)]
+        return infos
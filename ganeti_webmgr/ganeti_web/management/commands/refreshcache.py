@@ -1,15 +1,156 @@
-from django.core.management.base import NoArgsCommand
-from ganeti_webmgr.clusters.models import Cluster
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+
+from ganeti_webmgr.clusters.models import Cluster, no_lazy_refresh
 from ganeti_webmgr.nodes.models import Node
 from ganeti_webmgr.virtualmachines.models import VirtualMachine
 
+from ganeti_webmgr.utils import rapi_pool_stats
 from ganeti_webmgr.utils.client import GanetiApiError
 
 
-class Command(NoArgsCommand):
+STEPS = ('clusters', 'nodes', 'instances')
+
+
+class ClusterRefresh(object):
+    """
+    Refreshes the cached objects of a single cluster, keeping track of how
+    long each step took and which steps failed.
+
+    The cluster's info is refreshed in one lane, and its nodes and then its
+    instances are synchronized in another, since instances need the node map
+    built by the node synchronization.  Both lanes may run at the same time,
+    limited by a per-cluster semaphore.  The cluster is loaded without lazy
+    or background refreshes, so its info is refreshed exactly once.
+    """
+
+    def __init__(self, cluster_id, hostname, steps, concurrency, remove,
+                 query=False, incremental=False):
+        self.cluster_id = cluster_id
+        self.hostname = hostname
+        self.steps = steps
+        self.sync_options = {
+            'remove': remove,
+            'query': query,
+            'incremental': incremental,
+        }
+        self.semaphore = threading.BoundedSemaphore(concurrency)
+        self.times = {}
+        self.errors = {}
+
+    def lanes(self):
+        """
+        Returns the lanes of steps that need to be run for this cluster.
+        """
+        lanes = []
+        if 'clusters' in self.steps:
+            lanes.append(['clusters'])
+        lane = [step for step in ('nodes', 'instances') if step in self.steps]
+        if lane:
+            lanes.append(lane)
+        return lanes
+
+    def run(self, lane):
+        """
+        Run a lane of steps.
+        """
+        for step in lane:
+            with self.semaphore:
+                self.run_step(step)
+
+    def run_in_worker(self, lane):
+        """
+        Run a lane of steps from the worker pool, closing the worker's
+        database connection afterwards.
+        """
+        try:
+            self.run(lane)
+        finally:
+            connection.close()
+
+    def run_step(self, step):
+        start = time.time()
+        try:
+            getattr(self, 'refresh_%s' % step)()
+        except GanetiApiError as e:
+            self.errors[step] = str(e)
+        except Exception as e:
+            self.errors[step] = '%s: %s' % (e.__class__.__name__, e)
+        self.times[step] = time.time() - start
+
+    def load(self):
+        with no_lazy_refresh():
+            return Cluster.objects.get(pk=self.cluster_id)
+
+    def refresh_clusters(self):
+        cluster = self.load()
+        cluster.refresh()
+        if cluster.error:
+            self.errors['clusters'] = cluster.error
+
+    def refresh_nodes(self):
+        cluster = self.load()
+        self.nodes = cluster.sync_nodes(**self.sync_options)
+
+    def refresh_instances(self):
+        cluster = self.load()
+        # if synchronizing the nodes failed the map is queried instead
+        nodes = getattr(self, 'nodes', None)
+        cluster.sync_virtual_machines(nodes=nodes, **self.sync_options)
+
+    @property
+    def total(self):
+        return sum(self.times.values())
+
+
+class Command(BaseCommand):
     help = "Refreshes the Cache for Clusters, Nodes and Virtual Machines."
 
-    def handle_noargs(self, **options):
+    option_list = BaseCommand.option_list + (
+        # append options default to None, optparse would append to a shared
+        # default list
+        make_option('--cluster', action='append', dest='clusters',
+                    metavar='CLUSTER',
+                    help='Only refresh the cluster with this slug or '
+                         'hostname.  May be given more than once.'),
+        make_option('--only', action='append', dest='only',
+                    choices=STEPS,
+                    help='Only refresh clusters, nodes or instances.  May be '
+                         'given more than once.'),
+        make_option('--workers', type='int', dest='workers', default=8,
+                    help='Number of clusters refreshed concurrently.  With '
+                         '1, clusters are refreshed one at a time in the '
+                         'calling thread.  Defaults to 8.'),
+        make_option('--per-cluster', type='int', dest='per_cluster',
+                    default=2,
+                    help='Maximum number of concurrent refresh steps for a '
+                         'single cluster.  Defaults to 2.'),
+        make_option('--force', action='store_true', dest='force',
+                    default=False,
+                    help='Rewrite the cache of every object, even if it was '
+                         'not modified in ganeti.'),
+        make_option('--remove', action='store_true', dest='remove',
+                    default=False,
+                    help='Delete nodes and instances that are no longer in '
+                         'ganeti.'),
+        make_option('--query', action='store_true', dest='query',
+                    default=False,
+                    help='Only retrieve the node and instance fields stored '
+                         'in the database.  Their cached info is refreshed '
+                         'when they are next loaded.'),
+        make_option('--incremental', action='store_true', dest='incremental',
+                    default=False,
+                    help='Only retrieve nodes and instances that were added '
+                         'or modified in ganeti.'),
+    )
+
+    def handle(self, *args, **options):
         self.refresh_objects(**options)
 
     def refresh_objects(self, **options):
@@ -17,8 +158,9 @@ class Command(NoArgsCommand):
         This was originally the code in the 0009
         and then 0010 'force_object_refresh' migration
 
-        Force a refresh of all Cluster, Nodes, and VirtualMachines, and
-        import any new Nodes.
+        Refresh Clusters and synchronize their Nodes and VirtualMachines,
+        importing any new Nodes and VirtualMachines.  Clusters are refreshed
+        concurrently by a pool of worker threads.
         """
         write = self.stdout.write
         flush = self.stdout.flush
@@ -31,33 +173,99 @@ class Command(NoArgsCommand):
                 flush()
 
         verbosity = int(options.get('verbosity'))
+        only = options.get('only')
+        steps = [step for step in STEPS if not only or step in only]
+        workers = options.get('workers')
+        per_cluster = options.get('per_cluster')
+        if workers < 1 or per_cluster < 1:
+            raise CommandError('--workers and --per-cluster must be at '
+                               'least 1')
+        if options.get('query') and options.get('incremental'):
+            raise CommandError('--query and --incremental can not be used '
+                               'together')
+
+        clusters = Cluster.objects.all()
+        names = options.get('clusters')
+        if names:
+            clusters = clusters.filter(Q(slug__in=names) |
+                                       Q(hostname__in=names))
+            known = set()
+            for slug, hostname in clusters.values_list('slug', 'hostname'):
+                known.update((slug, hostname))
+            unknown = set(names) - known
+            if unknown:
+                raise CommandError('Unknown cluster(s): %s'
+                                   % ', '.join(sorted(unknown)))
+        clusters = clusters.values_list('id', 'hostname')
+
+        if options.get('force'):
+            ids = [id for id, hostname in clusters]
+            if 'clusters' in steps:
+                Cluster.objects.filter(id__in=ids).update(mtime=None)
+            if 'nodes' in steps:
+                Node.objects.filter(cluster__in=ids).update(mtime=None)
+            if 'instances' in steps:
+                VirtualMachine.objects.filter(cluster__in=ids) \
+                    .update(mtime=None)
 
         wf('- Refreshing Cached Cluster Objects', verbosity=verbosity)
 
-        wf('> Synchronizing Cluster Nodes ', True, verbosity=verbosity)
-        flush()
-        Cluster.objects.all().update(mtime=None)
-        for cluster in Cluster.objects.all().iterator():
-            try:
-                cluster.sync_nodes()
-                wf('.', verbosity=verbosity)
-            except GanetiApiError:
-                wf('E', verbosity=verbosity)
+        refreshes = [ClusterRefresh(id, hostname, steps, per_cluster,
+                                    options.get('remove'),
+                                    options.get('query'),
+                                    options.get('incremental'))
+                     for id, hostname in clusters]
 
-        Node.objects.all().update(mtime=None)
-        wf('> Refreshing Node Caches ', True, verbosity=verbosity)
-        for node in Node.objects.all().iterator():
-            try:
+        tasks = [(refresh, lane) for refresh in refreshes
+                 for lane in refresh.lanes()]
+        if workers == 1:
+            for refresh, lane in tasks:
+                refresh.run(lane)
                 wf('.', verbosity=verbosity)
-            except GanetiApiError:
-                wf('E', verbosity=verbosity)
-
-        VirtualMachine.objects.all().update(mtime=None)
-        wf('> Refreshing Instance Caches ', True, verbosity=verbosity)
-        for instance in VirtualMachine.objects.all().iterator():
-            try:
+        else:
+            pool = ThreadPool(workers)
+            results = [pool.apply_async(refresh.run_in_worker, (lane,))
+                       for refresh, lane in tasks]
+            pool.close()
+            for result in results:
+                result.get()
                 wf('.', verbosity=verbosity)
-            except GanetiApiError:
-                    wf('E', verbosity=verbosity)
+            pool.join()
+
+        wf('\n', verbosity=verbosity)
+        self.report(refreshes, steps, wf, verbosity)
 
+    def report(self, refreshes, steps, wf, verbosity):
+        """
+        Print a table of timings and errors for each cluster, and with
+        verbosity above 1 the usage of each cluster's RAPI connection pool.
+        """
+        width = max([len('Cluster')] + [len(r.hostname) for r in refreshes])
+        row = '%%-%ds' % width + ' %10s' * (len(steps) + 1) + '  %s'
+
+        wf(row % (('Cluster',) + tuple(s.capitalize() for s in steps)
+                  + ('Total', 'Errors')), verbosity=verbosity)
+        for refresh in refreshes:
+            times = ['%.2fs' % refresh.times[step]
+                     if step in refresh.times else '-' for step in steps]
+            errors = ['%s: %s' % (step, refresh.errors[step])
+                      for step in steps if step in refresh.errors]
+            wf(row % tuple([refresh.hostname] + times
+                           + ['%.2fs' % refresh.total,
+                              '; '.join(errors) or '-']),
+               True, verbosity=verbosity)
         wf('\n', verbosity=verbosity)
+
+        if verbosity > 1:
+            stats = rapi_pool_stats()
+            fields = ('requests', 'connections', 'reused', 'resets')
+            row = '%%-%ds' % width + ' %12s' * len(fields)
+            wf(row % (('Cluster',) + tuple(f.capitalize() for f in fields)),
+               True, verbosity=verbosity)
+            for refresh in refreshes:
+                if refresh.cluster_id in stats:
+                    pool = stats[refresh.cluster_id]
+                    wf(row % ((refresh.hostname,)
+                              + tuple(pool[f] for f in fields)),
+                       True, verbosity=verbosity)
+            wf('\n', verbosity=verbosity)
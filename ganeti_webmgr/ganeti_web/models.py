@@ -23,8 +23,11 @@ from django.contrib.auth.models import User, Group
 from django.contrib.sites import models as sites_app
 from django.contrib.sites.management import create_default_site
 from django.contrib.sites.models import Site
-from django.db.models.signals import post_save, post_syncdb
-from django.db.utils import DatabaseError
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      post_syncdb, pre_delete)
+from django.db.utils import DatabaseError, IntegrityError
 
 from ganeti_webmgr.utils.logs import register_log_actions
 
@@ -38,7 +41,9 @@ from ganeti_webmgr.muddle_users import signals as muddle_user_signals
 from ganeti_webmgr.authentication.models import Organization
 from ganeti_webmgr.clusters.models import Cluster
 from ganeti_webmgr.nodes.models import Node
-from ganeti_webmgr.virtualmachines.models import VirtualMachine
+from ganeti_webmgr.virtualmachines.models import (VirtualMachine,
+                                                  VirtualMachineAccess)
+from ganeti_webmgr.utils import chunks
 from ganeti_webmgr.utils.client import GanetiApiError
 
 import permissions
@@ -48,6 +53,57 @@ from ganeti_webmgr.authentication.models import Profile
 # XXX: am I wrong or is it not used anywhere?
 FINISHED_JOBS = 'success', 'unknown', 'error'
 
+# Number of users whose PermissionsVersion is bumped per query
+BUMP_BATCH_SIZE = 500
+
+
+class PermissionsVersion(models.Model):
+    """
+    A counter per user, incremented whenever a permission held by the user
+    or one of their groups, or one of their group memberships, changes.
+    Permission snapshots taken at an older version are stale.  Users whose
+    permissions never changed have no row.
+    """
+    user = models.OneToOneField(User, related_name='+')
+    version = models.PositiveIntegerField(default=0)
+
+    @classmethod
+    def current(cls, user):
+        """
+        Returns the current version of a user.
+        """
+        for version in cls.objects.filter(user=user) \
+                .values_list('version', flat=True):
+            return version
+        return 0
+
+    @classmethod
+    def bump(cls, users):
+        """
+        Increment the version of some users, making their snapshots stale.
+
+        @param users - primary keys of the users
+        """
+        for batch in chunks(set(users), BUMP_BATCH_SIZE):
+            versions = cls.objects.filter(user__in=batch)
+            existing = set(versions.values_list('user', flat=True))
+            versions.update(version=F('version') + 1)
+            missing = set(batch) - existing
+            if not missing:
+                continue
+
+            sid = transaction.savepoint()
+            try:
+                cls.objects.bulk_create([cls(user_id=user_id, version=1)
+                                         for user_id in missing])
+            except IntegrityError:
+                # created by another process since the update
+                transaction.savepoint_rollback(sid)
+                cls.objects.filter(user__in=missing) \
+                    .update(version=F('version') + 1)
+            else:
+                transaction.savepoint_commit(sid)
+
 
 def create_profile(sender, instance, **kwargs):
     """
@@ -135,8 +191,77 @@ muddle_user_signals.view_group_edited.connect(log_group_edit)
 # These are part of the DB schema and should not be changed without serious
 # forethought.
 # You *must* syncdb after you change these.
-register(permissions.CLUSTER_PARAMS, Cluster, 'ganeti_web')
-register(permissions.VIRTUAL_MACHINE_PARAMS, VirtualMachine, 'ganeti_web')
+cluster_perms = register(permissions.CLUSTER_PARAMS, Cluster, 'ganeti_web')
+vm_perms = register(permissions.VIRTUAL_MACHINE_PARAMS, VirtualMachine,
+                    'ganeti_web')
+
+
+def update_vm_access(sender, instance, **kwargs):
+    """
+    Updates the VirtualMachineAccess of the users holding a permission on a
+    VirtualMachine or Cluster, and makes permission snapshots stale.
+    object_permissions sends its revoked signal before revoked permissions
+    are written, so the permission rows are watched instead of the granted
+    and revoked signals.
+    """
+    if instance.user_id is not None:
+        users = [instance.user_id]
+    else:
+        users = list(User.objects.filter(groups=instance.group_id)
+                     .values_list('pk', flat=True))
+    if sender is cluster_perms:
+        vms = VirtualMachine.objects.filter(cluster=instance.obj_id)
+    else:
+        vms = [instance.obj_id]
+    VirtualMachineAccess.store(users, vms,
+                               revoked=kwargs['signal'] is post_delete)
+    PermissionsVersion.bump(users)
+
+
+def update_member_vm_access(sender, instance, action, reverse, pk_set,
+                            **kwargs):
+    """
+    Updates the VirtualMachineAccess of users joining or leaving groups.
+    """
+    if action == 'pre_clear' and reverse:
+        # the members of a group are gone once it is cleared
+        instance._vm_access_users = list(
+            instance.user_set.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            users = [instance.pk]
+        elif action == 'post_clear':
+            users = instance._vm_access_users
+        else:
+            users = pk_set
+        VirtualMachineAccess.store(users, revoked=action != 'post_add')
+        PermissionsVersion.bump(users)
+
+
+def save_group_members(sender, instance, **kwargs):
+    """
+    Records the members of a group being deleted, whose access is updated
+    once it is gone.
+    """
+    instance._vm_access_users = list(
+        instance.user_set.values_list('pk', flat=True))
+
+
+def update_group_vm_access(sender, instance, **kwargs):
+    """
+    Updates the VirtualMachineAccess of the members of a deleted group.
+    """
+    VirtualMachineAccess.store(instance._vm_access_users, revoked=True)
+    PermissionsVersion.bump(instance._vm_access_users)
+
+# registration is delayed if the permission tables do not exist yet
+if cluster_perms is not None and vm_perms is not None:
+    for perms_model in (cluster_perms, vm_perms):
+        post_save.connect(update_vm_access, sender=perms_model)
+        post_delete.connect(update_vm_access, sender=perms_model)
+m2m_changed.connect(update_member_vm_access, sender=User.groups.through)
+pre_delete.connect(save_group_members, sender=Group)
+post_delete.connect(update_group_vm_access, sender=Group)
 
 
 # register log actions
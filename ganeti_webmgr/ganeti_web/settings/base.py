@@ -116,7 +116,10 @@ LOGGING = {
         'mail_admins': {
             'level': 'ERROR',
             'class': 'django.utils.log.AdminEmailHandler'
-        }
+        },
+        'null': {
+            'class': 'django.utils.log.NullHandler',
+        },
     },
     'loggers': {
         'django.request': {
@@ -124,6 +127,11 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': True,
         },
+        # messages still reach any handlers configured on the root logger
+        'ganeti_webmgr': {
+            'handlers': ['null'],
+            'propagate': True,
+        },
     }
 }
 # -- End Logging Configuration ----------
@@ -193,9 +201,37 @@ LANGUAGES = (
 #    checked when the object is instantiated. It defaults to 600000ms, or ten
 #    minutes.
 LAZY_CACHE_REFRESH = 600000
+#    BACKGROUND_CACHE_REFRESH stops expired objects from being refreshed while
+#    they are instantiated.  The cached info is served instead, and the object
+#    is refreshed by a background worker.
+BACKGROUND_CACHE_REFRESH = False
+#    REFRESH_LOCK_TIMEOUT (seconds) is how long a process may hold the lease on
+#    refreshing an object before other processes may take it over.  Only one
+#    process refreshes an object at a time.  Set it to 0 to disable the lease.
+#    Leases are kept in the cache, so they can only be enabled once CACHES is
+#    set to a cache shared by every process, such as memcached.
+REFRESH_LOCK_TIMEOUT = 0
+#    SERIALIZED_INFO_CODEC is the format the cached info is stored in.  One of
+#    json, json+zlib, msgpack or msgpack+zlib.  msgpack requires msgpack-python.
+SERIALIZED_INFO_CODEC = 'json'
+#    RECONCILIATION_CACHE_TIMEOUT (seconds) is how long the names of a cluster's
+#    nodes and instances are kept for the import pages.  Set it to 0 to fetch
+#    them for every page.
+RECONCILIATION_CACHE_TIMEOUT = 30
+#    KEYSET_PAGINATION pages through the VM, job and error lists by the sort
+#    columns of the last row shown instead of by page number, which keeps deep
+#    pages fast on large lists.  Their totals are counted once every
+#    KEYSET_COUNT_TIMEOUT seconds.
+KEYSET_PAGINATION = False
+KEYSET_COUNT_TIMEOUT = 60
 # Other GWM Stuff
 VNC_PROXY = 'localhost:8888'
 RAPI_CONNECT_TIMEOUT = 3
+# Each cluster's RAPI client keeps up to RAPI_POOL_SIZE connections alive.
+# Connections idle for longer than RAPI_POOL_IDLE_TIMEOUT seconds are closed
+# rather than reused.  Set it to None to never close them.
+RAPI_POOL_SIZE = 10
+RAPI_POOL_IDLE_TIMEOUT = 30
 
 
 def create_secrets(folder='.secrets'):
@@ -19,7 +19,6 @@
 from datetime import datetime
 import re
 
-from django.db.models import Count
 from django.template import Library, Node, TemplateSyntaxError
 from django.template.defaultfilters import stringfilter, filesizeformat
 from django.utils.safestring import mark_safe
@@ -60,6 +59,15 @@ def vmfield_nic(form, index):
     return data
 
 
+@register.inclusion_tag('ganeti/cache_status.html')
+def cache_status(obj):
+    """
+    Render the age of a cluster object's cached info, and whether it is stale
+    or waiting for a background refresh.
+    """
+    return {'obj': obj}
+
+
 @register.filter
 def class_name(obj):
     """ returns the modelname of the objects class """
@@ -129,7 +137,7 @@ def is_drbd(vm):
     """ simple filter for returning true of false if a virtual machine
     has DRBD for disklayout
     """
-    return 'drbd' == vm.info['disk_template']
+    return 'drbd' == vm.disk_template
 
 
 @register.filter
@@ -137,7 +145,7 @@ def is_shared(vm):
     """ Simple filter for returning true or false if a virtual machine
     has shared for disklayout
     """
-    return 'shared' == vm.info['disk_template']
+    return 'shared' == vm.disk_template
 
 
 @register.filter
@@ -343,7 +351,6 @@ def num_reducer(num1, num2, size_tag):
         return "%.2f / %.2f" % (num1/1024**5, num2/1024**5)
 
 
-# XXX Possible QuerySet (cluster.available_ram)
 @register.simple_tag
 def cluster_memory(cluster, allocated=True, tag=False):
     """
@@ -361,7 +368,6 @@ def cluster_memory(cluster, allocated=True, tag=False):
                        float(d['total']*1024**2), size_tag.strip())
 
 
-# XXX Possible QuerySet (cluster.available_disk)
 @register.simple_tag
 def cluster_disk(cluster, allocated=True, tag=False):
     """
@@ -379,31 +385,22 @@ def cluster_disk(cluster, allocated=True, tag=False):
                        float(d['total']*1024**2), size_tag.strip())
 
 
-# XXX QuerySet
 @register.simple_tag
 def format_running_vms(cluster):
     """
     Return number of VMs that are available and number of all VMs
     """
-    return "%d/%d" % \
-        (cluster.virtual_machines.filter(status="running").count(),
-         cluster.virtual_machines.all().count())
+    stats = cluster.statistics
+    return "%d/%d" % (stats.vms_running, stats.virtual_machines)
 
 
-# XXX Possible QuerySet
 @register.simple_tag
 def format_online_nodes(cluster):
     """
     Return number of nodes that are online and number of all nodes
     """
-    annotation = cluster.nodes.values('offline').annotate(count=Count('pk'))
-    offline = online = 0
-    for values in annotation:
-        if values['offline']:
-            offline = values['count']
-        else:
-            online = values['count']
-    return "%d/%d" % (online, offline+online)
+    stats = cluster.statistics
+    return "%d/%d" % (stats.nodes_online, stats.nodes)
 
 
 @register.tag
@@ -1,19 +1,27 @@
 from django.contrib.auth.models import AnonymousUser, Group, User
 from django.test import TestCase
+from django.test.client import RequestFactory
 
 from ganeti_webmgr.django_test_tools.users import UserTestMixin
 
 from ..backend.queries import (
-    cluster_qs_for_user, owner_qs, cluster_vm_qs
+    cluster_qs_for_user, owner_qs, cluster_vm_qs, vm_qs_for_admins,
+    vm_qs_for_users
 )
+from ..backend.snapshots import PermissionSnapshot, SESSION_KEY
+from ..context_processors import common_permissions
+from ..models import PermissionsVersion
 from ganeti_webmgr.clusters.models import Cluster
-from ganeti_webmgr.virtualmachines.models import VirtualMachine
+from ganeti_webmgr.virtualmachines.models import (VirtualMachine,
+                                                  VirtualMachineAccess)
 
 __all__ = (
     "TestClusterQSForUser",
     "TestOwnerQSNoGroups",
     "TestOwnerQSWithGroups",
     "TestClusterVMQS",
+    "TestVMAccess",
+    "TestPermissionSnapshot",
 )
 
 
@@ -222,3 +230,229 @@ class TestClusterVMQS(TestCase):
         vms = cluster_vm_qs(self.standard, perms=['admin'])
         self.standard.grant('admin', self.vm1)
         self.assertQuerysetEqual(vms, [])
+
+
+class TestVMAccess(TestCase):
+
+    def setUp(self):
+        self.cluster = Cluster.objects.create(hostname="ganeti.example.org")
+        self.vm1 = VirtualMachine.objects.create(
+            hostname="vm1", cluster=self.cluster
+        )
+        self.vm2 = VirtualMachine.objects.create(
+            hostname="vm2", cluster=self.cluster
+        )
+        self.user = User.objects.create_user('user', password='secret')
+        self.group = Group.objects.create(name='group')
+
+    def tearDown(self):
+        VirtualMachine.objects.all().delete()
+        self.cluster.delete()
+        self.user.delete()
+        Group.objects.all().delete()
+
+    def assertAccess(self, admin, users):
+        self.assertEqual(set(admin), set(vm_qs_for_admins(self.user)))
+        self.assertEqual(set(users), set(vm_qs_for_users(self.user)))
+
+    def test_vm_perms(self):
+        self.user.grant('power', self.vm1)
+        self.assertAccess([], [self.vm1])
+        self.user.grant('admin', self.vm1)
+        self.assertAccess([self.vm1], [self.vm1])
+        self.user.revoke('admin', self.vm1)
+        self.assertAccess([], [self.vm1])
+        self.user.revoke_all(self.vm1)
+        self.assertAccess([], [])
+
+    def test_cluster_perms(self):
+        self.user.grant('create_vm', self.cluster)
+        self.assertAccess([], [])
+        self.user.grant('admin', self.cluster)
+        self.assertAccess([self.vm1, self.vm2], [self.vm1, self.vm2])
+
+        # new VMs are indexed when they are created
+        vm3 = VirtualMachine.objects.create(hostname="vm3",
+                                            cluster=self.cluster)
+        self.assertAccess([self.vm1, self.vm2, vm3],
+                          [self.vm1, self.vm2, vm3])
+        vm3.delete()
+        self.assertAccess([self.vm1, self.vm2], [self.vm1, self.vm2])
+
+        self.user.revoke('admin', self.cluster)
+        self.assertAccess([], [])
+
+    def test_group_perms(self):
+        self.group.grant('admin', self.vm1)
+        self.group.grant('power', self.vm2)
+        self.assertAccess([], [])
+
+        self.user.groups.add(self.group)
+        self.assertAccess([self.vm1], [self.vm1, self.vm2])
+        self.group.revoke('admin', self.vm1)
+        self.assertAccess([], [self.vm2])
+        self.group.user_set.remove(self.user)
+        self.assertAccess([], [])
+
+        self.group.user_set.add(self.user)
+        self.group.grant('admin', self.cluster)
+        self.assertAccess([self.vm1, self.vm2], [self.vm1, self.vm2])
+        self.group.user_set.clear()
+        self.assertAccess([], [])
+
+        self.user.groups.add(self.group)
+        self.group.delete()
+        self.assertAccess([], [])
+
+    def test_store(self):
+        """
+        Rebuilding the index only writes rows that changed.
+        """
+        self.user.grant('admin', self.cluster)
+        VirtualMachineAccess.objects.filter(virtual_machine=self.vm1) \
+            .delete()
+        VirtualMachineAccess.objects.filter(virtual_machine=self.vm2) \
+            .update(admin=False)
+
+        VirtualMachineAccess.store()
+        self.assertAccess([self.vm1, self.vm2], [self.vm1, self.vm2])
+        with self.assertNumQueries(4):
+            VirtualMachineAccess.store([self.user.pk])
+
+
+class TestPermissionSnapshot(TestCase):
+
+    def setUp(self):
+        self.cluster = Cluster.objects.create(hostname="ganeti.example.org")
+        self.vm = VirtualMachine.objects.create(
+            hostname="vm1", cluster=self.cluster
+        )
+        self.user = User.objects.create_user('user', password='secret')
+        self.group = Group.objects.create(name='group')
+        self.session = {}
+        self.request = self.new_request()
+
+    def tearDown(self):
+        VirtualMachine.objects.all().delete()
+        self.cluster.delete()
+        self.user.delete()
+        User.objects.filter(username='other').delete()
+        Group.objects.all().delete()
+
+    def new_request(self):
+        """
+        Returns a request of the user, sharing the session of the others.
+        """
+        request = RequestFactory().get('/')
+        request.user = self.user
+        request.session = self.session
+        return request
+
+    def snapshot(self):
+        """
+        Returns the snapshot of a new request.
+        """
+        return PermissionSnapshot.for_request(self.new_request())
+
+    def test_take(self):
+        self.user.grant('create_vm', self.cluster)
+        self.group.grant('admin', self.vm)
+        self.user.groups.add(self.group)
+
+        snapshot = PermissionSnapshot.take(self.user)
+        self.assertEqual(set(['create_vm']), snapshot.get_perms(self.cluster))
+        self.assertEqual(set(['admin']), snapshot.get_perms(self.vm))
+        self.assertTrue(snapshot.has_perm('admin', self.vm))
+        self.assertFalse(snapshot.has_perm('admin', self.cluster))
+        self.assertTrue(snapshot.has_any_perms(self.cluster))
+        self.assertFalse(snapshot.has_any_perms(self.cluster, ['admin']))
+        self.assertTrue(snapshot.has_any_perms(VirtualMachine, ['admin']))
+        self.assertTrue(snapshot.has_vm_perm_on_cluster('admin',
+                                                        self.cluster))
+        self.assertFalse(snapshot.has_vm_perm_on_cluster('power',
+                                                         self.cluster))
+
+    def test_for_request(self):
+        self.user.grant('create_vm', self.cluster)
+        # the snapshot is taken once, then only the version is read
+        with self.assertNumQueries(3):
+            PermissionSnapshot.for_request(self.request)
+        with self.assertNumQueries(1):
+            snapshot = self.snapshot()
+        self.assertEqual(set(['create_vm']), snapshot.get_perms(self.cluster))
+
+        # the snapshot is kept on the request
+        with self.assertNumQueries(0):
+            self.assertTrue(PermissionSnapshot.for_request(self.request)
+                            is PermissionSnapshot.for_request(self.request))
+
+        # only per cluster permissions are stored, so the permissions on a
+        # vm are queried unless none are held on the vms of its cluster
+        with self.assertNumQueries(0):
+            self.assertEqual(set(), snapshot.get_perms(self.vm))
+        self.user.grant('power', self.vm)
+        snapshot = self.snapshot()
+        stored = self.session[SESSION_KEY]
+        self.assertEqual({self.cluster.pk: set(['power'])},
+                         stored['vm_clusters'])
+        self.assertFalse('vms' in stored)
+        with self.assertNumQueries(1):
+            self.assertEqual(set(['power']), snapshot.get_perms(self.vm))
+            self.assertEqual(set(['power']), snapshot.get_perms(self.vm))
+        self.user.revoke('power', self.vm)
+
+        # snapshots are stale once permissions change
+        self.user.grant('admin', self.cluster)
+        snapshot = self.snapshot()
+        self.assertTrue(snapshot.has_perm('admin', self.cluster))
+
+        self.group.grant('power', self.vm)
+        self.user.groups.add(self.group)
+        snapshot = self.snapshot()
+        self.assertTrue(snapshot.has_perm('power', self.vm))
+
+        self.group.delete()
+        self.user.revoke('admin', self.cluster)
+        snapshot = self.snapshot()
+        self.assertEqual(set(['create_vm']), snapshot.get_perms(self.cluster))
+        self.assertEqual(set(), snapshot.get_perms(self.vm))
+
+    def test_version_per_user(self):
+        """
+        Permission changes only make the snapshots of affected users stale.
+        """
+        other = User.objects.create_user('other', password='secret')
+        version = PermissionsVersion.current(self.user)
+        self.snapshot()
+
+        other.grant('admin', self.cluster)
+        self.group.grant('admin', self.cluster)
+        other.groups.add(self.group)
+        self.assertEqual(version, PermissionsVersion.current(self.user))
+        with self.assertNumQueries(1):
+            self.snapshot()
+
+        self.user.groups.add(self.group)
+        self.assertEqual(version + 1, PermissionsVersion.current(self.user))
+        self.group.revoke('admin', self.cluster)
+        self.assertEqual(version + 2, PermissionsVersion.current(self.user))
+        self.assertFalse(self.snapshot().has_perm('admin', self.cluster))
+
+        # group deletion bumps each remaining member
+        self.group.grant('admin', self.cluster)
+        versions = PermissionsVersion.current(self.user), \
+            PermissionsVersion.current(other)
+        self.group.delete()
+        self.assertEqual(versions[0] + 1,
+                         PermissionsVersion.current(self.user))
+        self.assertEqual(versions[1] + 1, PermissionsVersion.current(other))
+
+    def test_common_permissions(self):
+        self.assertFalse(common_permissions(self.new_request())['create_vm'])
+        self.user.grant('create_vm', self.cluster)
+        perms = common_permissions(self.new_request())
+        self.assertTrue(perms['create_vm'])
+        self.assertFalse(perms['cluster_admin'])
+        self.user.grant('admin', self.cluster)
+        perms = common_permissions(self.new_request())
+        self.assertTrue(perms['cluster_admin'])
@@ -8,9 +8,10 @@ class Mock(object):
     pass
 
 
-def make_mock_cluster(version):
+def make_mock_cluster(version, capability=None):
     cluster = Mock()
     cluster.info = {"software_version": version}
+    cluster.capability = capability
     return cluster
 
 
@@ -40,6 +41,10 @@ class TestClassify(TestCase):
         cluster = make_mock_cluster("2.5.0")
         self.assertEqual(classify(cluster), GANETI25)
 
+    def test_stored_capability(self):
+        cluster = make_mock_cluster("2.2.0", GANETI25)
+        self.assertEqual(classify(cluster), GANETI25)
+
 
 class TestHasShutdownTimeout(TestCase):
 
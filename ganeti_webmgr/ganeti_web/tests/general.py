@@ -15,26 +15,33 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
 # USA.
 
+from datetime import datetime, timedelta
+
 from django.conf import settings
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User, Group
 from django.test import TestCase
-from django.test.client import Client
+from django.test.client import Client, RequestFactory
 # Per #6579, do not change this import without discussion.
 from django.utils import simplejson as json
 
 from ganeti_webmgr.django_test_tools.views import ViewTestMixin
 
 from ganeti_webmgr.utils.proxy.constants import JOB_ERROR
-from ganeti_webmgr.utils.models import SSHKey
+from ganeti_webmgr.utils.models import GanetiError, SSHKey
 
-from ganeti_webmgr.clusters.models import Cluster
-from ganeti_webmgr.virtualmachines.models import VirtualMachine
+from ganeti_webmgr.clusters.models import Cluster, ClusterReconciliation
+from ganeti_webmgr.virtualmachines.models import (NetworkInterface,
+                                                  VirtualMachine)
 from ganeti_webmgr.jobs.models import Job
 from ..backend.queries import vm_qs_for_admins
+from ..views.general import merge_errors, paginate_errors
+from ..views.pagination import encode_cursor, paginate_keyset
 
 
-__all__ = ('TestGeneralViews', 'TestOverviewVMSummary')
+__all__ = ('TestGeneralViews', 'TestOverviewVMSummary',
+           'TestKeysetPagination')
 
 
 class TestGeneralViews(TestCase, ViewTestMixin):
@@ -90,6 +97,9 @@ class TestGeneralViews(TestCase, ViewTestMixin):
                    finished="2011-01-05 21:59", status="error")
         job1.save()
         job.rapi.GetJobStatus.response = JOB_ERROR
+        self.cluster.reconcile()
+        cluster1.reconcile()
+        self.cluster.rapi.GetInstances.reset()
 
         url = "/"
         args = []
@@ -147,6 +157,21 @@ class TestGeneralViews(TestCase, ViewTestMixin):
         self.assertEqual(2, response.context["missing"])
         self.assertEqual(4, response.context["import_ready"])
 
+        # the counts are read without querying ganeti
+        self.cluster.rapi.GetInstances.assertNotCalled(self)
+
+        # orphans are counted from the database, and clusters that were never
+        # synchronized are reconciled
+        vm1.owner = self.user.get_profile()
+        vm1.save()
+        ClusterReconciliation.objects.filter(cluster=cluster1).delete()
+        response = self.c.get(url % args)
+        self.assertEqual(1, response.context["orphaned"])
+        self.assertEqual(2, response.context["missing"])
+        self.assertEqual(4, response.context["import_ready"])
+        self.assertTrue(ClusterReconciliation.objects
+                        .filter(cluster=cluster1).exists())
+
     def test_used_resources(self):
         """ tests the used_resources view """
 
@@ -256,6 +281,40 @@ class TestGeneralViews(TestCase, ViewTestMixin):
         self.assertContains(response, "asd@asd", count=1)
         self.assertContains(response, "foo@bar", count=1)
 
+    def test_nic_lookup(self):
+        """
+        Instances are looked up by the IP or MAC address of a NIC.
+
+        Verifies:
+            * users without permissions on the instance do not find it
+            * users with permissions and superusers are redirected to it
+        """
+        url = reverse('search-nic-lookup')
+        # loading an expired VM would replace its NICs with the RAPI's
+        VirtualMachine.objects.filter(pk=self.vm.pk) \
+            .update(cached=datetime.now())
+        NetworkInterface.objects.create(virtual_machine=self.vm, index=0,
+                                        ip='10.1.2.3',
+                                        mac='aa:00:00:c5:47:2e')
+
+        self.assertTrue(self.c.login(username=self.user.username,
+                                     password='secret'))
+        response = self.c.get(url, {'address': '10.1.2.3'})
+        self.assertEqual(404, response.status_code)
+
+        vm_url = self.vm.get_absolute_url()
+        for user in (self.user1, self.user2):
+            self.assertTrue(self.c.login(username=user.username,
+                                         password='secret'))
+            for address in ('10.1.2.3', 'AA:00:00:C5:47:2E'):
+                response = self.c.get(url, {'address': address})
+                self.assertEqual(302, response.status_code)
+                self.assertTrue(response['location'].endswith(vm_url))
+
+        for params in ({'address': '10.1.2.4'}, {}):
+            response = self.c.get(url, params)
+            self.assertEqual(404, response.status_code)
+
 
 class TestOverviewVMSummary(TestCase):
     def setUp(self):
@@ -326,3 +385,118 @@ class TestOverviewVMSummary(TestCase):
             }
         }
         self.assertEqual(vm_summary, expected_summary)
+
+
+class TestKeysetPagination(TestCase):
+
+    def setUp(self):
+        self.cluster = Cluster.objects.create(hostname='test.example.test',
+                                              slug='OSL_TEST')
+        now = datetime.now().replace(microsecond=0)
+        self.times = [now - timedelta(minutes=i) for i in range(5, 0, -1)]
+
+        self.errors = [GanetiError.objects.create(cluster=self.cluster,
+                                                  obj=self.cluster,
+                                                  msg='error %d' % i,
+                                                  timestamp=time)
+                       for i, time in enumerate(self.times)]
+
+        # jobs are cached so that loading them does not query ganeti
+        def job(job_id, finished):
+            job = Job(job_id=job_id, cluster=self.cluster, obj=self.cluster,
+                      status='error', finished=finished, cached=now)
+            job.save()
+            return job
+        self.unfinished = job(1, None)
+        # finished at the same time as an error
+        self.tied = job(2, self.times[2])
+        self.late = job(3, now)
+
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        Job.objects.all().delete()
+        GanetiError.objects.all().delete()
+        Cluster.objects.all().delete()
+        cache.clear()
+
+    def walk(self, paginate):
+        """
+        Follow the next cursors from the first page, then the previous
+        cursors back from the last page, and return the rows of both walks.
+        """
+        forward = []
+        page = paginate(None)
+        self.assertFalse(page.has_previous())
+        forward.extend(page.object_list)
+        while page.has_next():
+            page = paginate(page.next_cursor)
+            forward.extend(page.object_list)
+
+        backward = list(page.object_list)
+        while page.has_previous():
+            page = paginate(page.previous_cursor)
+            backward[:0] = page.object_list
+        return forward, backward
+
+    def test_paginate_keyset(self):
+        """
+        Pages follow the ordering of the queryset, in both directions
+        """
+        qs = GanetiError.objects.order_by('-timestamp')
+
+        def paginate(cursor):
+            page = paginate_keyset(qs, cursor, 2)
+            self.assertTrue(page.keyset)
+            self.assertEqual(5, page.paginator.count)
+            return page
+
+        expected = list(GanetiError.objects.order_by('-timestamp', '-pk'))
+        forward, backward = self.walk(paginate)
+        self.assertEqual(expected, forward)
+        self.assertEqual(expected, backward)
+
+        # invalid cursors, and cursors of another ordering, are ignored
+        for cursor in ('garbage',
+                       encode_cursor(['-timestamp', '-pk'], ['garbage', 1]),
+                       paginate_keyset(qs.order_by('msg'), None,
+                                       2).next_cursor):
+            page = paginate_keyset(qs, cursor, 2)
+            self.assertEqual(expected[:2], page.object_list)
+            self.assertFalse(page.has_previous())
+
+    def test_paginate_keyset_fallback(self):
+        """
+        Querysets ordered by nullable columns or relations can't be paginated
+        """
+        # the default ordering includes the nullable code
+        self.assertEqual(None,
+                         paginate_keyset(GanetiError.objects.all(), None, 2))
+        self.assertEqual(None, paginate_keyset(
+            GanetiError.objects.order_by('cluster'), None, 2))
+        self.assertTrue(paginate_keyset(
+            GanetiError.objects.order_by('cluster__hostname'), None, 2))
+
+    def test_paginate_errors(self):
+        """
+        Errors and jobs are merged in the same order as merge_errors()
+        """
+        errors = GanetiError.objects.all()
+        jobs = Job.objects.all()
+
+        def paginate(cursor):
+            request = self.factory.get('/errors/',
+                                       {'cursor': cursor} if cursor else {})
+            page = paginate_errors(request, errors, jobs, 2)
+            self.assertEqual(8, page.paginator.count)
+            return page
+
+        # merge_errors() can't sort jobs without a finish time
+        expected = [(False, self.unfinished)] + \
+            merge_errors(errors, jobs.exclude(finished=None))
+        self.assertEqual((True, self.errors[0]), expected[1])
+        self.assertEqual([(True, self.errors[2]), (False, self.tied)],
+                         expected[3:5])
+        forward, backward = self.walk(paginate)
+        self.assertEqual(expected, forward)
+        self.assertEqual(expected, backward)
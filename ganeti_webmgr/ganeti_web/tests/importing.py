@@ -23,6 +23,8 @@ from django.test.client import Client
 
 from ganeti_webmgr.authentication.models import Profile, Organization
 from ganeti_webmgr.clusters.models import Cluster
+from ganeti_webmgr.utils.proxy.constants import INSTANCE
+from ganeti_webmgr.utils.proxy.response_map import ResponseMap
 from ganeti_webmgr.virtualmachines.models import VirtualMachine
 
 __all__ = ('ImportViews', )
@@ -215,8 +217,15 @@ class ImportViews(TestCase):
         Tests view for Virtual Machines missing from database
         """
         url = '/import/missing_db/'
-        self.cluster0.rapi.GetInstances.response = ['vm0', 'vm2']
-        self.cluster1.rapi.GetInstances.response = ['vm3', 'vm5']
+
+        def instances(*names):
+            return ResponseMap([
+                (((), {}), list(names)),
+                (((), {'bulk': True}),
+                 [dict(INSTANCE, name=name) for name in names]),
+            ])
+        self.cluster0.rapi.GetInstances.response = instances('vm0', 'vm2')
+        self.cluster1.rapi.GetInstances.response = instances('vm3', 'vm5')
 
         # anonymous user
         response = self.c.get(url, follow=True)
@@ -292,4 +301,9 @@ class ImportViews(TestCase):
         self.assertTemplateUsed(response, 'ganeti/importing/missing_db.html')
         self.assertFalse(response.context['form'].errors)
         self.assertEqual([], response.context['vms'])
-        self.assertTrue(VirtualMachine.objects.filter(hostname='vm2').exists())
+        self.assertEqual(['Imported 1 of 1 virtual machines from test0'],
+                         map(unicode, response.context['messages']))
+        vm2 = VirtualMachine.objects.get(hostname='vm2')
+        self.assertEqual(self.owner.id, vm2.owner_id)
+        self.assertEqual(512, vm2.ram)
+        self.assertTrue(vm2.cached)
@@ -0,0 +1,177 @@
+# Copyright (C) 2012 Oregon State University et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+import sys
+from copy import deepcopy
+from StringIO import StringIO
+
+from django.conf import settings
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from ganeti_webmgr.clusters import background as background_refresh
+from ganeti_webmgr.clusters.models import Cluster
+from ganeti_webmgr.nodes.models import Node
+from ganeti_webmgr.utils.client import GanetiApiError
+from ganeti_webmgr.utils.proxy.constants import NODES_BULK, NODES_MAP
+from ganeti_webmgr.virtualmachines.models import VirtualMachine
+
+from ..management.commands.refreshcache import Command
+
+
+__all__ = ['TestRefreshCacheCommand']
+
+
+class TestRefreshCacheCommand(TestCase):
+
+    def setUp(self):
+        self.cluster = Cluster.objects.create(hostname='ganeti.example.test',
+                                              slug='ganeti')
+        self.cluster2 = Cluster.objects.create(hostname='ganeti2.example.test',
+                                               slug='ganeti2')
+        for cluster in (self.cluster, self.cluster2):
+            cluster.rapi.GetNodes.reset()
+            cluster.rapi.GetInstances.reset()
+
+        # node hostnames are unique across clusters
+        nodes = deepcopy(NODES_BULK)
+        for node in nodes:
+            node['name'] = node['name'].replace('.example', '2.example')
+        self.cluster2.rapi.GetNodes.response = nodes
+
+    def tearDown(self):
+        for cluster in (self.cluster, self.cluster2):
+            cluster.rapi.GetNodes.error = None
+            cluster.rapi.GetInstances.error = None
+        self.cluster2.rapi.GetNodes.response = NODES_MAP
+        VirtualMachine.objects.all().delete()
+        Node.objects.all().delete()
+        Cluster.objects.all().delete()
+
+    def refresh(self, *args):
+        """
+        Run the command with the given arguments and return its output.
+        Clusters are refreshed in the calling thread, which can see the test
+        database.
+        """
+        command = Command()
+        parser = command.create_parser('django-admin.py', 'refreshcache')
+        options, args = parser.parse_args(['--workers', '1'] + list(args))
+        command.stdout = StringIO()
+        command.handle(*args, **vars(options))
+        return command.stdout.getvalue()
+
+    def test_options(self):
+        """
+        Test parsing the command's options
+
+        Verifies:
+            * repeatable options are collected
+            * unknown steps are rejected with a usage error
+            * invalid combinations and unknown clusters raise CommandError
+        """
+        parser = Command().create_parser('django-admin.py', 'refreshcache')
+        options, args = parser.parse_args(['--only', 'nodes',
+                                           '--only', 'instances',
+                                           '--cluster', 'ganeti',
+                                           '--workers', '2'])
+        self.assertEqual(['nodes', 'instances'], options.only)
+        self.assertEqual(['ganeti'], options.clusters)
+        self.assertEqual(2, options.workers)
+        self.assertEqual(2, options.per_cluster)
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            self.assertRaises(SystemExit, parser.parse_args,
+                              ['--only', 'jobs'])
+            self.assertTrue('invalid choice' in sys.stderr.getvalue())
+        finally:
+            sys.stderr = stderr
+
+        self.assertRaises(CommandError, self.refresh, '--workers', '0')
+        self.assertRaises(CommandError, self.refresh, '--per-cluster', '0')
+        self.assertRaises(CommandError, self.refresh, '--query',
+                          '--incremental')
+        self.assertRaises(CommandError, self.refresh, '--cluster', 'ganeti',
+                          '--cluster', 'missing')
+
+    def test_refresh(self):
+        """
+        Test refreshing every cluster
+        """
+        output = self.refresh()
+        for cluster in (self.cluster, self.cluster2):
+            self.assertTrue(cluster.nodes.exists())
+            self.assertTrue(cluster.virtual_machines.exists())
+            self.assertTrue(cluster.hostname in output)
+        self.assertFalse('Connections' in output)
+
+        # the RAPI connection pools are reported with a higher verbosity
+        output = self.refresh('--verbosity', '2')
+        self.assertTrue('Connections' in output)
+
+    def test_refresh_once(self):
+        """
+        Test that expired clusters are refreshed once
+
+        Verifies:
+            * loading the cluster does not queue a background refresh
+            * the cluster's info is retrieved once
+        """
+        queue = background_refresh.queue
+        background_refresh.queue = background_refresh.RefreshQueue(
+            threaded=False)
+        settings.BACKGROUND_CACHE_REFRESH = True
+        try:
+            self.cluster.rapi.GetInfo.reset()
+            self.refresh('--cluster', 'ganeti')
+            self.assertEqual(0, len(background_refresh.queue))
+        finally:
+            settings.BACKGROUND_CACHE_REFRESH = False
+            background_refresh.queue = queue
+        self.assertEqual([((), {})], self.cluster.rapi.GetInfo.calls)
+        self.assertTrue(Cluster.objects.get(pk=self.cluster.pk).cached)
+
+    def test_cluster_errors(self):
+        """
+        Test that an error in one cluster does not stop the others
+
+        Verifies:
+            * the other cluster is refreshed
+            * the failing cluster's other steps run
+            * the error is reported for the failing step
+        """
+        self.cluster2.rapi.GetInstances.error = GanetiApiError('Unreachable')
+        output = self.refresh()
+
+        self.assertTrue(self.cluster.nodes.exists())
+        self.assertTrue(self.cluster.virtual_machines.exists())
+        self.assertTrue(self.cluster2.nodes.exists())
+        self.assertFalse(self.cluster2.virtual_machines.exists())
+        self.assertTrue('instances: Unreachable' in output)
+
+    def test_limits(self):
+        """
+        Test that --cluster and --only limit the refresh
+        """
+        self.refresh('--cluster', 'ganeti2.example.test', '--only', 'nodes')
+
+        self.assertTrue(self.cluster2.nodes.exists())
+        self.assertFalse(self.cluster2.virtual_machines.exists())
+        self.cluster2.rapi.GetInstances.assertNotCalled(self)
+        self.assertFalse(self.cluster.nodes.exists())
+        self.cluster.rapi.GetNodes.assertNotCalled(self)
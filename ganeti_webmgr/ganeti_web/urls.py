@@ -151,7 +151,10 @@ urlpatterns += patterns(
 
     url(r'^search/suggestions.json', 'suggestions', name='search-suggestions'),
 
-    url(r'^search/detail_lookup', 'detail_lookup', name='search-detail-lookup')
+    url(r'^search/detail_lookup', 'detail_lookup',
+        name='search-detail-lookup'),
+
+    url(r'^search/nic_lookup', 'nic_lookup', name='search-nic-lookup'),
 )
 
 urlpatterns += patterns(
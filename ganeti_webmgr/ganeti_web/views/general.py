@@ -17,10 +17,12 @@
 
 from itertools import chain, izip, repeat
 
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.contenttypes.models import ContentType
-from django.core.exceptions import PermissionDenied
+from django.core.exceptions import PermissionDenied, ValidationError
 from django.db.models import Q, Count
+from django.db.models.fields import DateTimeField
 from django.shortcuts import render_to_response, get_object_or_404
 from django.template import RequestContext
 from django.utils.translation import ugettext as _
@@ -29,10 +31,12 @@ from django.http import HttpResponse
 
 from . import render_404
 from .generic import NO_PRIVS
+from .pagination import (KeysetPage, cached_count, decode_cursor,
+                         encode_cursor, keyset_filter)
 from ..constants import VERSION
 from ..backend.queries import vm_qs_for_admins
 
-from ganeti_webmgr.clusters.models import Cluster
+from ganeti_webmgr.clusters.models import Cluster, ClusterReconciliation
 from ganeti_webmgr.virtualmachines.models import VirtualMachine
 from ganeti_webmgr.jobs.models import Job
 from ganeti_webmgr.utils.models import GanetiError
@@ -68,6 +72,112 @@ def merge_errors(errors, jobs):
     return list(sorted(i, key=keyfunc))
 
 
+# Errors are sorted by their time, then GanetiErrors before Jobs, then pk, as
+# in merge_errors().  Jobs without a finish time are sorted first.
+ERROR_ORDERING = ('time', 'job', 'pk')
+
+
+def _error_segments(ganeti_errors, job_errors, cursor, before):
+    """
+    Returns the querysets of errors sorted after, or before, a cursor.  Each
+    is sorted in the same order as the page, and given as (queryset,
+    is_ganeti_error).
+    """
+    def ordering(*fields):
+        return [('-' if before else '') + field for field in fields]
+
+    jobs_unfinished = job_errors.filter(finished__isnull=True) \
+        .order_by(*ordering('pk'))
+    jobs = job_errors.filter(finished__isnull=False) \
+        .order_by(*ordering('finished', 'pk'))
+    errors = ganeti_errors.order_by(*ordering('timestamp', 'pk'))
+
+    if cursor is None:
+        segments = [(errors, True), (jobs_unfinished, False), (jobs, False)]
+    elif cursor[0] is None:
+        # within the unfinished jobs
+        pk_filter = Q(pk__lt=cursor[2]) if before else Q(pk__gt=cursor[2])
+        segments = [(jobs_unfinished.filter(pk_filter), False)]
+        if not before:
+            segments += [(errors, True), (jobs, False)]
+    else:
+        time, job, pk = cursor
+        if job:
+            errors = errors.filter(**{
+                'timestamp__lte' if before else 'timestamp__gt': time})
+            jobs = jobs.filter(keyset_filter(
+                [('finished', False, None), ('pk', False, None)],
+                [time, pk], before))
+        else:
+            errors = errors.filter(keyset_filter(
+                [('timestamp', False, None), ('pk', False, None)],
+                [time, pk], before))
+            jobs = jobs.filter(**{
+                'finished__lt' if before else 'finished__gte': time})
+        segments = [(errors, True), (jobs, False)]
+        if before:
+            segments.append((jobs_unfinished, False))
+    return segments
+
+
+def paginate_errors(request, ganeti_errors, job_errors, per_page):
+    """
+    Returns a KeysetPage of merged GanetiErrors and Jobs, as returned by
+    merge_errors().
+    """
+    decoded = None
+    if request.GET.get('cursor'):
+        decoded = decode_cursor(request.GET['cursor'], ERROR_ORDERING)
+    cursor = None
+    before = False
+    if decoded is not None:
+        values, before = decoded
+        try:
+            cursor = (DateTimeField().to_python(values[0]), bool(values[1]),
+                      int(values[2]))
+        except (ValidationError, TypeError, ValueError):
+            before = False
+
+    def key(item):
+        is_ganeti_error, obj = item
+        if is_ganeti_error:
+            return obj.timestamp, False, obj.pk
+        return obj.finished, True, obj.pk
+
+    def sort_key(item):
+        # None can't be compared with datetimes, so unfinished jobs are
+        # sorted first explicitly
+        time, job, pk = key(item)
+        return time is not None, time, job, pk
+
+    rows = []
+    for qs, is_ganeti_error in _error_segments(ganeti_errors, job_errors,
+                                               cursor, before):
+        # every segment is sorted, so the page is within the first
+        # per_page + 1 rows of each
+        rows.extend(izip(repeat(is_ganeti_error), qs[:per_page + 1]))
+    rows.sort(key=sort_key, reverse=before)
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before:
+        rows.reverse()
+
+    if rows:
+        first = encode_cursor(ERROR_ORDERING, key(rows[0]), True)
+        last = encode_cursor(ERROR_ORDERING, key(rows[-1]))
+    else:
+        first = last = None
+    if before:
+        next_cursor = last
+        previous_cursor = first if more else None
+    else:
+        next_cursor = last if more else None
+        previous_cursor = first if cursor is not None else None
+
+    count = cached_count(ganeti_errors) + cached_count(job_errors)
+    return KeysetPage(rows, count, next_cursor, previous_cursor)
+
+
 USED_NOTHING = dict(disk=0, ram=0, virtual_cpus=0)
 
 
@@ -111,7 +221,13 @@ def get_errors(request):
         ganeti_errors |= qs.get_errors(obj=clusters)
 
     # merge error lists
-    errors = merge_errors(ganeti_errors, job_errors)
+    if settings.KEYSET_PAGINATION:
+        page = paginate_errors(request, ganeti_errors, job_errors,
+                               settings.ITEMS_PER_PAGE)
+        errors = page.object_list
+    else:
+        page = None
+        errors = merge_errors(ganeti_errors, job_errors)
 
     return render_to_response("ganeti/errors.html",
                               {
@@ -119,6 +235,7 @@ def get_errors(request):
                                   'cluster_list': clusters,
                                   'user': request.user,
                                   'errors': errors,
+                                  'page': page,
                               },
                               context_instance=RequestContext(request))
 
@@ -160,35 +277,21 @@ def get_vm_counts(clusters):
     """
     Helper for getting the list of orphaned/ready to import/missing VMs.
 
+    Orphaned VMs are counted from the database.  The other counts are read
+    from the ClusterReconciliation of each cluster, which is updated when the
+    cluster's VMs are synchronized, so ganeti is only queried for clusters
+    that were never synchronized.
+
     @param clusters the list of clusters, for which numbers of VM are counted.
-                    May be None, if update is set.
     """
-    format_key = 'cluster_admin_%d'
-    orphaned = import_ready = missing = 0
-
-    # update the values that were not cached
-    if clusters.exists():
-        annotated = VirtualMachine.objects \
-            .filter(cluster__in=clusters,
-                    owner=None).order_by().values("cluster__pk") \
-            .annotate(orphaned=Count("id"))
-
-        result = {}
-        for i in annotated:
-            result[format_key % i["cluster__pk"]] = {"orphaned": i["orphaned"]}
-            orphaned += i["orphaned"]
-        for cluster in clusters:
-            key = format_key % cluster.pk
-
-            if key not in result:
-                result[key] = {"orphaned": 0}
-
-            result[key]["import_ready"] = len(cluster.missing_in_db)
-            result[key]["missing"] = len(cluster.missing_in_ganeti)
+    orphaned = VirtualMachine.objects \
+        .filter(cluster__in=clusters, owner=None).count()
 
-            import_ready += result[key]["import_ready"]
-            missing += result[key]["missing"]
+    for cluster in Cluster.objects.filter(pk__in=clusters,
+                                          reconciliation__isnull=True):
+        cluster.reconcile()
 
+    import_ready, missing = ClusterReconciliation.totals(clusters)
     return orphaned, import_ready, missing
 
 
@@ -277,7 +380,7 @@ def overview(request, rest=False):
     else:
         context = {
             'admin': admin,
-            'cluster_list': clusters,
+            'cluster_list': clusters.select_related('stats'),
             'user': request.user,
             'errors': errors,
             'orphaned': orphaned,
@@ -10,6 +10,12 @@ from django.utils.decorators import method_decorator
 from django.utils.http import urlencode
 from django.utils.translation import ugettext as _
 
+from django_tables2 import RequestConfig
+from django_tables2.rows import BoundRows
+
+from ..backend.snapshots import PagePermissions
+from .pagination import paginate_keyset
+
 # Standard translation messages. We use these everywhere.
 
 NO_PRIVS = _('You do not have sufficient privileges')
@@ -105,6 +111,73 @@ class PaginationMixin(object):
         return self.request.GET.get("count", self.paginate_by)
 
 
+class PagePermissionsMixin(object):
+    """
+    Helper for table views which loads the permissions of the user on the
+    displayed page of objects, so that rendering rows can check
+    ``table.permissions`` instead of querying for each row.
+
+    Must come before KeysetPaginationMixin, so that the page is known.
+    """
+
+    def get_table(self):
+        table = super(PagePermissionsMixin, self).get_table()
+        page = getattr(table, 'page', None)
+        rows = page.object_list if page is not None else table.rows
+        table.permissions = PagePermissions.load(
+            self.request.user, [row.record for row in rows])
+        return table
+
+
+class KeysetPaginationMixin(object):
+    """
+    Helper for table views which paginates tables with keyset pagination
+    instead of OFFSET when KEYSET_PAGINATION is enabled.  Tables sorted by a
+    column that can not be used as a key, such as a nullable one, are
+    paginated as usual.
+
+    Must come after PagePermissionsMixin, which uses the page, and before
+    SingleTableView.
+    """
+
+    def keyset_paginated(self):
+        return settings.KEYSET_PAGINATION
+
+    def paginate_queryset(self, queryset, page_size):
+        # the table is paginated instead, avoid counting and slicing twice
+        if self.keyset_paginated():
+            return (None, None, queryset, False)
+        return super(KeysetPaginationMixin, self) \
+            .paginate_queryset(queryset, page_size)
+
+    def get_table(self):
+        if not self.keyset_paginated():
+            return super(KeysetPaginationMixin, self).get_table()
+
+        table = self.get_table_class()(self.get_table_data())
+        RequestConfig(self.request, paginate=False).configure(table)
+        per_page = self.table_pagination['per_page']
+        try:
+            per_page = max(1, int(
+                self.request.GET[table.prefixed_per_page_field]))
+        except (KeyError, ValueError):
+            pass
+        cursor_field = '%scursor' % (table.prefix or '')
+        page = None
+        if hasattr(table.data, 'queryset'):
+            page = paginate_keyset(table.data.queryset,
+                                   self.request.GET.get(cursor_field),
+                                   per_page, cursor_field)
+        if page is None:
+            # not sorted by a key
+            RequestConfig(self.request, self.get_table_pagination()) \
+                .configure(table)
+        else:
+            page.object_list = BoundRows(page.object_list, table)
+            table.page = page
+        return table
+
+
 class SortingMixin(object):
     """
     A mixin which provides sorting for a ListView
@@ -14,20 +14,28 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
 # USA.
+import logging
 from collections import defaultdict
 
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import PermissionDenied
 from django.shortcuts import render_to_response
 from django.template import RequestContext
+from django.utils.translation import ugettext as _
 
 from ..forms.importing import ImportForm, OrphanForm, VirtualMachineForm
 from .generic import NO_PRIVS
 
-from ganeti_webmgr.clusters.models import Cluster
+from ganeti_webmgr.clusters.models import Cluster, ClusterReconciliation
+from ganeti_webmgr.clusters.reconciliation import reconcile
+from ganeti_webmgr.utils.client import GanetiApiError
 from ganeti_webmgr.virtualmachines.models import VirtualMachine
 
 
+logger = logging.getLogger(__name__)
+
+
 @login_required
 def orphans(request):
     """
@@ -58,15 +66,14 @@ def orphans(request):
             owner = data['owner']
             vm_ids = data['virtual_machines']
 
-            # update the owner and save the vm.  This isn't the most efficient
-            # way of updating the VMs but we would otherwise need to group them
-            # by cluster
-            orphaned = defaultdict(lambda: 0)
-            for id in vm_ids:
-                vm = VirtualMachine.objects.get(id=id)
-                vm.owner = owner
-                vm.save()
-                orphaned[vm.cluster_id] -= 1
+            # update the owners with one query per cluster, and their owner
+            # tags concurrently
+            errors = VirtualMachine.assign_owner(
+                VirtualMachine.objects.filter(id__in=vm_ids), owner)
+            for hostname, error in errors:
+                messages.error(request, _('Could not update the owner tag of '
+                                          '%(hostname)s: %(error)s')
+                               % {'hostname': hostname, 'error': error})
 
             # remove updated vms from the list
             vms_with_cluster = [i for i in vms_with_cluster
@@ -101,10 +108,8 @@ def missing_ganeti(request):
         if not clusters:
             raise PermissionDenied(NO_PRIVS)
 
-    vms = []
-    for cluster in clusters:
-        for vm in cluster.missing_in_ganeti:
-            vms.append((vm, vm))
+    vms = [(vm, vm) for result in reconcile(clusters, 'instances')
+           for vm in result.missing_in_ganeti]
 
     if request.method == 'POST':
         # process updates if this was a form submission
@@ -120,6 +125,7 @@ def missing_ganeti(request):
                 missing[i.cluster_id] -= 1
 
             q.delete()
+            ClusterReconciliation.adjust('missing', missing)
 
             # remove updated vms from the list
             vms = filter(lambda x: unicode(x[0]) not in vm_ids, vms)
@@ -127,19 +133,10 @@ def missing_ganeti(request):
     else:
         form = VirtualMachineForm(vms)
 
-    vms = {}
-    for cluster in clusters:
-        for vm in cluster.missing_in_ganeti:
-            vms[vm] = (cluster.hostname, vm)
-
-    vmhostnames = vms.keys()
-    vmhostnames.sort()
-
-    vms_tuplelist = []
-    for i in vmhostnames:
-        vms_tuplelist.append((i, vms[i][0], vms[i][1]))
-
-    vms = vms_tuplelist
+    # the names in ganeti are cached, so only the database is queried again
+    vms = sorted((vm, result.cluster.hostname, vm)
+                 for result in reconcile(clusters, 'instances')
+                 for vm in result.missing_in_ganeti)
 
     return render_to_response("ganeti/importing/missing.html",
                               {'vms': vms,
@@ -160,10 +157,9 @@ def missing_db(request):
         if not clusters:
             raise PermissionDenied(NO_PRIVS)
 
-    vms = []
-    for cluster in clusters:
-        for hostname in cluster.missing_in_db:
-            vms.append(('%s:%s' % (cluster.id, hostname), hostname))
+    vms = [('%s:%s' % (result.cluster.id, hostname), hostname)
+           for result in reconcile(clusters, 'instances')
+           for hostname in result.missing_in_db]
 
     if request.method == 'POST':
         # process updates if this was a form submission
@@ -175,17 +171,38 @@ def missing_db(request):
             vm_ids = data['virtual_machines']
 
             import_ready = defaultdict(lambda: 0)
-            orphaned = defaultdict(lambda: 0)
 
-            # create missing VMs
+            # group the selected VMs by cluster so that each cluster's
+            # instances are fetched with a single RAPI call
+            selected = defaultdict(list)
             for vm in vm_ids:
                 cluster_id, host = vm.split(':')
-                cluster = Cluster.objects.get(id=cluster_id)
-                VirtualMachine(hostname=host, cluster=cluster,
-                               owner=owner).save()
-                import_ready[cluster.pk] -= 1
-                if owner is None:
-                    orphaned[cluster.pk] += 1
+                selected[int(cluster_id)].append(host)
+
+            # create missing VMs.  The progress of each batch is logged, and
+            # the number imported from each cluster is shown once it is done.
+            for cluster in Cluster.objects.filter(id__in=selected):
+                def progress(done, total):
+                    logger.info('Imported %d of %d virtual machines from %s',
+                                done, total, cluster.hostname)
+                try:
+                    imported = cluster.import_virtual_machines(
+                        selected[cluster.pk], owner, progress)
+                except GanetiApiError as e:
+                    messages.error(request, _('Could not import virtual '
+                                              'machines from %(cluster)s: '
+                                              '%(error)s')
+                                   % {'cluster': cluster.hostname,
+                                      'error': e})
+                    continue
+                messages.success(request, _('Imported %(count)d of %(total)d '
+                                            'virtual machines from '
+                                            '%(cluster)s')
+                                 % {'count': len(imported),
+                                    'total': len(selected[cluster.pk]),
+                                    'cluster': cluster.hostname})
+                import_ready[cluster.pk] -= len(imported)
+            ClusterReconciliation.adjust('import_ready', import_ready)
 
             # remove created vms from the list
             vms = filter(lambda x: unicode(x[0])
@@ -194,19 +211,12 @@ def missing_db(request):
     else:
         form = ImportForm(vms)
 
-    vms = {}
-    for cluster in clusters:
-        for hostname in cluster.missing_in_db:
-            vms[hostname] = (u'%s:%s' % (cluster.id, hostname),
-                             unicode(cluster.hostname), unicode(hostname))
-    vmhostnames = vms.keys()
-    vmhostnames.sort()
-
-    vms_tuplelist = []
-    for i in vmhostnames:
-        vms_tuplelist.append(vms[i])
-
-    vms = vms_tuplelist
+    # the names in ganeti are cached, so only the database is queried again
+    vms = sorted(((u'%s:%s' % (result.cluster.id, hostname),
+                   unicode(result.cluster.hostname), unicode(hostname))
+                  for result in reconcile(clusters, 'instances')
+                  for hostname in result.missing_in_db),
+                 key=lambda vm: vm[2])
 
     return render_to_response("ganeti/importing/missing_db.html",
                               {'vms': vms,
@@ -25,6 +25,7 @@ from ..forms.importing import NodeForm
 from .generic import NO_PRIVS
 
 from ganeti_webmgr.clusters.models import Cluster
+from ganeti_webmgr.clusters.reconciliation import reconcile
 from ganeti_webmgr.nodes.models import Node
 from ganeti_webmgr.virtualmachines.models import VirtualMachine
 
@@ -55,10 +56,8 @@ def missing_ganeti(request):
         if not clusters:
             raise PermissionDenied(NO_PRIVS)
 
-    nodes = []
-    for cluster in clusters:
-        for node in cluster.nodes_missing_in_ganeti:
-            nodes.append((node, node))
+    nodes = [(node, node) for result in reconcile(clusters, 'nodes')
+             for node in result.missing_in_ganeti]
 
     if request.method == 'POST':
         # process updates if this was a form submission
@@ -72,19 +71,10 @@ def missing_ganeti(request):
     else:
         form = NodeForm(nodes)
 
-    nodes = {}
-    for cluster in clusters:
-        for node in cluster.nodes_missing_in_ganeti:
-            nodes[node] = (cluster.hostname, node)
-
-    node_hostnames = nodes.keys()
-    node_hostnames.sort()
-
-    node_tuple_list = []
-    for i in node_hostnames:
-        node_tuple_list.append((i, nodes[i][0], nodes[i][1]))
-
-    nodes = node_tuple_list
+    # the names in ganeti are cached, so only the database is queried again
+    nodes = sorted((node, result.cluster.hostname, node)
+                   for result in reconcile(clusters, 'nodes')
+                   for node in result.missing_in_ganeti)
 
     return render_to_response("ganeti/importing/nodes/missing.html",
                               {'nodes': nodes,
@@ -106,10 +96,9 @@ def missing_db(request):
         if not clusters:
             raise PermissionDenied(NO_PRIVS)
 
-    nodes = []
-    for cluster in clusters:
-        for hostname in cluster.nodes_missing_in_db:
-            nodes.append(('%s:%s' % (cluster.id, hostname), hostname))
+    nodes = [('%s:%s' % (result.cluster.id, hostname), hostname)
+             for result in reconcile(clusters, 'nodes')
+             for hostname in result.missing_in_db]
 
     if request.method == 'POST':
         # process updates if this was a form submission
@@ -141,19 +130,12 @@ def missing_db(request):
     else:
         form = NodeForm(nodes)
 
-    nodes = {}
-    for cluster in clusters:
-        for hostname in cluster.nodes_missing_in_db:
-            nodes[hostname] = ('%s:%s' % (cluster.id, hostname),
-                               cluster.hostname, hostname)
-    node_hostnames = nodes.keys()
-    node_hostnames.sort()
-
-    nodes_tuple_list = []
-    for i in node_hostnames:
-        nodes_tuple_list.append(nodes[i])
-
-    nodes = nodes_tuple_list
+    # the names in ganeti are cached, so only the database is queried again
+    nodes = sorted((('%s:%s' % (result.cluster.id, hostname),
+                     result.cluster.hostname, hostname)
+                    for result in reconcile(clusters, 'nodes')
+                    for hostname in result.missing_in_db),
+                   key=lambda node: node[2])
 
     return render_to_response("ganeti/importing/nodes/import.html",
                               {'nodes': nodes,
@@ -0,0 +1,263 @@
+# Copyright (C) 2012 Oregon State University et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+"""
+Keyset pagination.
+
+Pages are selected by filtering on the sort columns of the last row of the
+previous page, instead of with OFFSET, and the total is counted once and
+cached.  Deep pages are then as fast as the first one, at the cost of only
+linking to the previous and next pages.
+
+A cursor encodes the ordering and the sort values of the row a page starts
+after, or ends before.  Cursors for another ordering are ignored.
+"""
+
+import base64
+import datetime
+import hashlib
+from decimal import Decimal
+
+import simplejson as json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.sql.datastructures import EmptyResultSet
+
+
+class KeysetPaginator(object):
+    """
+    Stands in for a Paginator in templates, which only use its count.
+    """
+
+    def __init__(self, count):
+        self.count = count
+
+
+class KeysetPage(object):
+    """
+    A page of rows selected by a cursor.
+
+    @param object_list - the rows of the page
+    @param count - the estimated number of rows in every page
+    @param next_cursor - cursor of the next page, None if this is the last
+    @param previous_cursor - cursor of the previous page, None if this is the
+    first
+    @param cursor_field - name of the GET parameter holding the cursor
+    """
+    keyset = True
+
+    def __init__(self, object_list, count, next_cursor, previous_cursor,
+                 cursor_field='cursor'):
+        self.object_list = object_list
+        self.paginator = KeysetPaginator(count)
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.cursor_field = cursor_field
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def encode_cursor(ordering, values, before=False):
+    """
+    Encode the position after, or before, a row with the given sort values.
+    """
+    data = json.dumps([list(ordering), [_encode_value(v) for v in values],
+                       before], separators=(',', ':'))
+    # padding is dropped, it would be escaped in links
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+
+def decode_cursor(cursor, ordering):
+    """
+    Returns the values and direction of a cursor, or None if it is invalid or
+    was made for another ordering.  Values are not converted back.
+    """
+    try:
+        cursor = str(cursor)
+        cursor_ordering, values, before = json.loads(
+            base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (TypeError, ValueError, UnicodeError):
+        return None
+    if cursor_ordering != list(ordering) or len(values) != len(ordering):
+        return None
+    return values, bool(before)
+
+
+def keyset_fields(queryset):
+    """
+    Returns the fields ordering a queryset, followed by the primary key if
+    it is not one of them, as (field name, descending, model field) tuples.
+
+    Keyset pagination needs a total order on non null values, so None is
+    returned if the queryset is ordered by anything other than non null
+    columns, such as a nullable column or a relation.
+    """
+    ordering = list(queryset.query.order_by
+                    or queryset.query.get_meta().ordering)
+    model = queryset.model
+    pk_name = model._meta.pk.name
+
+    fields = []
+    for name in ordering:
+        descending = name.startswith('-')
+        name = name.lstrip('-')
+        if name in ('pk', pk_name):
+            fields.append((name, descending, model._meta.pk))
+            return fields
+
+        field_model = model
+        parts = name.split('__')
+        try:
+            for part in parts:
+                field = field_model._meta.get_field(part)
+                if field.null:
+                    return None
+                if field.rel and part != parts[-1]:
+                    field_model = field.rel.to
+        except (FieldDoesNotExist, AttributeError):
+            return None
+        if field.rel:
+            return None
+        fields.append((name, descending, field))
+
+    descending = fields[0][1] if fields else False
+    fields.append(('pk', descending, model._meta.pk))
+    return fields
+
+
+def keyset_filter(fields, values, before=False):
+    """
+    Returns a filter selecting the rows sorted after, or before, the given
+    values of the fields.
+    """
+    q = None
+    equal = {}
+    for (name, descending, field), value in zip(fields, values):
+        lookup = 'lt' if descending != before else 'gt'
+        clause = Q(**dict(equal, **{'%s__%s' % (name, lookup): value}))
+        q = clause if q is None else q | clause
+        equal[name] = value
+    return q
+
+
+def row_values(fields, row):
+    """
+    Returns the values of the fields of a row.
+    """
+    values = []
+    for name, descending, field in fields:
+        value = row
+        for part in name.split('__'):
+            value = getattr(value, part)
+        values.append(value)
+    return values
+
+
+def cached_count(queryset):
+    """
+    Returns the number of rows of a queryset.  Counts are cached for
+    KEYSET_COUNT_TIMEOUT seconds, so the total shown by keyset pages may be
+    slightly out of date.
+    """
+    try:
+        sql, params = queryset.order_by().query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    key = 'keyset-count:%s' % hashlib.md5(
+        (sql % tuple(repr(p) for p in params)).encode('utf-8')).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, settings.KEYSET_COUNT_TIMEOUT)
+    return count
+
+
+def paginate_keyset(queryset, cursor, per_page, cursor_field='cursor'):
+    """
+    Returns the KeysetPage of a queryset starting after, or ending before,
+    a cursor, or the first page if there is no valid cursor.  None is
+    returned if the queryset's ordering can not be used for keyset
+    pagination.
+    """
+    fields = keyset_fields(queryset)
+    if fields is None:
+        return None
+    ordering = ['%s%s' % ('-' if descending else '', name)
+                for name, descending, field in fields]
+
+    decoded = decode_cursor(cursor, ordering) if cursor else None
+    before = False
+    qs = queryset.order_by(*ordering)
+    if decoded is not None:
+        values, before = decoded
+        try:
+            values = [field.to_python(value)
+                      for (name, descending, field), value
+                      in zip(fields, values)]
+        except (ValidationError, TypeError, ValueError):
+            # tampered with, start over
+            decoded = None
+            before = False
+        else:
+            qs = qs.filter(keyset_filter(fields, values, before))
+            if before:
+                reverse = [o[1:] if o.startswith('-') else '-' + o
+                           for o in ordering]
+                qs = qs.order_by(*reverse)
+
+    rows = list(qs[:per_page + 1])
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before:
+        rows.reverse()
+
+    if rows:
+        first = encode_cursor(ordering, row_values(fields, rows[0]), True)
+        last = encode_cursor(ordering, row_values(fields, rows[-1]))
+    else:
+        first = last = None
+    if before:
+        next_cursor = last
+        previous_cursor = first if more else None
+    else:
+        next_cursor = last if more else None
+        previous_cursor = first if decoded is not None else None
+
+    return KeysetPage(rows, cached_count(queryset), next_cursor,
+                      previous_cursor, cursor_field)
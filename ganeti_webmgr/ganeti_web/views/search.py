@@ -5,7 +5,9 @@ from django.http import (HttpResponse, HttpResponseRedirect,
                          HttpResponseNotFound)
 from django.utils import simplejson as json
 
-from ganeti_webmgr.virtualmachines.models import VirtualMachine
+from ganeti_webmgr.virtualmachines.models import (NetworkInterface,
+                                                  VirtualMachine)
+from ganeti_webmgr.ganeti_web.backend.queries import vm_qs_for_users
 from ganeti_webmgr.clusters.models import Cluster
 from ganeti_webmgr.nodes.models import Node
 
@@ -108,3 +110,28 @@ def detail_lookup(request):
 
     # Redirect to the absolute URL of the object
     return HttpResponseRedirect(obj.get_absolute_url())
+
+
+@login_required
+def nic_lookup(request):
+    '''
+    Look up and redirect to the detail page for the virtual machine with a
+    NIC with the given address, on any cluster.  Only virtual machines the
+    user has permissions on are found, so that the lookup does not reveal
+    which machine owns an address.
+
+    There must be one supplied GET parameter:
+        `address`:  IP or MAC address of the NIC.
+    '''
+    address = request.GET.get('address', None)
+    if not address:
+        return HttpResponseNotFound()
+
+    # the NIC table is indexed, so no instance info needs to be decoded
+    try:
+        nic = NetworkInterface.lookup(address) \
+            .filter(virtual_machine__in=vm_qs_for_users(request.user))[0]
+    except IndexError:
+        return HttpResponseNotFound()
+
+    return HttpResponseRedirect(nic.virtual_machine.get_absolute_url())
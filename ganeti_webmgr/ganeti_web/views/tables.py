@@ -1,3 +1,5 @@
+from django.core.urlresolvers import reverse
+from django.utils.html import escape
 from django.utils.safestring import mark_safe
 
 from django_tables2 import (Table, Column, LinkColumn, TemplateColumn,
@@ -10,6 +12,10 @@ from ..templatetags.webmgr_tags import (render_storage, render_os,
 from ganeti_webmgr.utils import hv_prettify
 
 
+# permissions on a VirtualMachine that allow viewing its details
+VIEW_VM_PERMS = ('admin', 'power', 'remove', 'modify', 'tags')
+
+
 class BaseTable(Table):
     def __init__(self, *args, **kwargs):
         kwargs['template'] = kwargs.get("template", "table.html")
@@ -28,24 +34,37 @@ class BaseVMTable(BaseTable):
         accessor="cluster.slug",
         verbose_name='cluster'
     )
-    hostname = LinkColumn(
-        "instance-detail",
-        kwargs={"cluster_slug": A("cluster.slug"),
-                "instance": A("hostname")},
-        verbose_name='name',
-    )
+    hostname = Column(verbose_name='name')
     owner = Column()
     node = Column(verbose_name='node', accessor="primary_node")
     operating_system = Column(verbose_name='OS')
     ram = Column(verbose_name='RAM')
     disk_size = Column(verbose_name='disk space')
     virtual_cpus = Column(verbose_name='vCPUs')
+    disk_template = Column(verbose_name='disk template')
+    hypervisor = Column()
+    admin_state = Column(verbose_name='admin state')
 
     class Meta:
         sequence = ("status", "hostname", "cluster", "...")
         order_by = ("hostname")
         empty_text = "No Virtual Machines"
 
+    def render_hostname(self, value, record):
+        # only link to the details of VMs the user may view.  The view
+        # attaches the permissions of the page as table.permissions.
+        permissions = getattr(self, 'permissions', None)
+        if permissions is not None and not (
+                permissions.has_any_perms(record.cluster,
+                                          ['admin', 'create_vm']) or
+                permissions.has_any_perms(record, VIEW_VM_PERMS)):
+            return value
+        url = reverse('instance-detail', args=[record.cluster.slug, value])
+        return mark_safe('<a href="%s">%s</a>' % (url, escape(value)))
+
+    def render_hypervisor(self, value):
+        return hv_prettify(value)
+
     def render_disk_size(self, value):
         return render_storage(value)
 
@@ -131,25 +150,22 @@ class ClusterTable(BaseTable):
     )
     description = Column()
     version = Column(
-        accessor="info.software_version",
-        orderable=False,
+        accessor="software_version",
         default="unknown"
     )
     hypervisor = Column(
-        accessor="info.default_hypervisor",
-        orderable=False,
+        accessor="default_hypervisor",
         default="unknown"
     )
     master_node = LinkColumn(
         "node-detail",
         kwargs={"cluster_slug": A("slug"),
-                "host": A("info.master")},
-        accessor="info.master",
-        orderable=False,
+                "host": A("master")},
+        accessor="master",
         default="unknown"
     )
-    nodes = Column(accessor="nodes.count", orderable=False)
-    vms = Column(accessor="virtual_machines.count", verbose_name='VMs',
+    nodes = Column(accessor="statistics.nodes", orderable=False)
+    vms = Column(accessor="statistics.virtual_machines", verbose_name='VMs',
                  orderable=False)
 
     class Meta:
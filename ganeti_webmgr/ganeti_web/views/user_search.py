@@ -2,7 +2,8 @@ from django.http import HttpResponse
 from django.contrib.auth.models import User, Group
 from django.utils import simplejson
 
-from ganeti_webmgr.authentication.models import ClusterUser
+from ganeti_webmgr.authentication.models import (ClusterUser, Organization,
+                                                 Profile)
 
 
 def search_users(request):
@@ -50,7 +51,7 @@ def search_cluster_users(term=None, pk=None, limit=10):
     else:
         clusterUsers = ClusterUser.objects.all()
 
-    clusterUsers = clusterUsers.values('pk', 'name')
+    clusterUsers = clusterUsers.values('pk', 'name', 'real_type')
 
     if pk:
         query = clusterUsers[0]['name']
@@ -63,15 +64,13 @@ def search_cluster_users(term=None, pk=None, limit=10):
         clusterUsers = clusterUsers[:limit]
 
     # lable each item based on its real_type
+    labels = {
+        Profile._get_real_type().pk: 'user',
+        Organization._get_real_type().pk: 'group',
+    }
     labeledUsers = []
     for i in clusterUsers:
-        f = 'other'
-        userType = str(ClusterUser.objects.get(id=i['pk'])
-                       .cast()._get_real_type())
-        if userType == "profile":
-            f = 'user'
-        elif userType == "organization":
-            f = 'group'
+        f = labels.get(i['real_type'], 'other')
         labeledUsers.append((i['name'], f, i['pk']))
 
     clusterUsers = labeledUsers
@@ -1,11 +1,13 @@
 from datetime import datetime
 
+from django.conf import settings
 from django.db import models
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.generic import GenericForeignKey
 
 from ganeti_webmgr.utils import get_rapi
 from ganeti_webmgr.utils.client import GanetiApiError
+from ganeti_webmgr.clusters import background as background_refresh
 from ganeti_webmgr.clusters.models import CachedClusterObject
 
 
@@ -67,12 +69,25 @@ class Job(CachedClusterObject):
     def _refresh(self):
         return self.rapi.GetJobStatus(self.job_id)
 
-    def load_info(self):
+    def load_info(self, background=None):
         """
         Load info for class.  This will load from ganeti if ignore_cache==True,
         otherwise this will always load from the cache.
+
+        With background refreshing enabled the job is queued for a refresh
+        instead of being loaded from ganeti.
         """
-        if self.id and (self.ignore_cache or self.info is None):
+        if background is None:
+            background = settings.BACKGROUND_CACHE_REFRESH
+
+        # jobs are cached when their info is stored, so the info is only
+        # loaded here if it may be missing
+        if self.id and (self.ignore_cache or
+                        self.cached is None and self.info is None):
+            if background:
+                background_refresh.queue.enqueue(self)
+                return
+
             try:
                 self.refresh()
             except GanetiApiError as e:
@@ -91,6 +106,7 @@ class Job(CachedClusterObject):
         valid = self.valid_job(info)
         if valid:
             self.info = info
+            self.cached = datetime.now()
             self.save()
         # else:
         #     Job.objects.get(job_id=self.info['id']).delete()
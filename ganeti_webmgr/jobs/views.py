@@ -26,6 +26,7 @@ from .models import Job
 from ganeti_webmgr.clusters.models import Cluster
 from ganeti_webmgr.virtualmachines.models import VirtualMachine
 from ganeti_webmgr.nodes.models import Node
+from ganeti_webmgr.ganeti_web.backend.snapshots import PermissionSnapshot
 from ganeti_webmgr.ganeti_web.views.generic import NO_PRIVS, LoginRequiredMixin
 
 
@@ -40,7 +41,8 @@ class JobDetailView(LoginRequiredMixin, DetailView):
     def get_context_data(self, **kwargs):
         job = kwargs["object"]
         user = self.request.user
-        admin = user.is_superuser or user.has_perm("admin", job.cluster)
+        snapshot = PermissionSnapshot.for_request(self.request)
+        admin = user.is_superuser or snapshot.has_perm("admin", job.cluster)
 
         return {
             "job": job,
@@ -1,13 +1,55 @@
 from django.db import models
-from django.db.models import Sum, Q
+from django.db.models import Count, Sum
+from django.db.models.query import QuerySet
 
-from ganeti_webmgr.clusters.models import CachedClusterObject
+from ganeti_webmgr.clusters.models import (CachedClusterObject,
+                                           UPDATE_BATCH_SIZE)
 from ganeti_webmgr.virtualmachines.models import VirtualMachine
 from ganeti_webmgr.jobs.models import Job
 
 from ganeti_webmgr.ganeti_web import constants
-from ganeti_webmgr.utils import get_rapi
+from ganeti_webmgr.utils import chunks, get_rapi
 from ganeti_webmgr.utils.fields import LowerCaseCharField
+from ganeti_webmgr.utils.models import QuerySetManager
+
+
+def annotate_allocation(nodes):
+    """
+    Set the RAM, disk and virtual CPUs allocated to instances on each of
+    several nodes, and the number of their primary and secondary instances,
+    with a fixed number of grouped queries however many nodes there are.
+
+    RAM is allocated by running instances and disk by every instance, on
+    both their primary and secondary nodes.  Virtual CPUs are allocated by
+    running instances on their primary node.  Primary and secondary nodes
+    are grouped by separate queries, which unlike an OR of both can use
+    their indexes.
+    """
+    allocation = dict((node.pk, {'ram': 0, 'disk': 0, 'cpus': 0,
+                                 'primary': 0, 'secondary': 0})
+                      for node in nodes)
+    for batch in chunks(allocation, UPDATE_BATCH_SIZE):
+        for field in ('primary_node', 'secondary_node'):
+            vms = VirtualMachine.objects.filter(**{'%s__in' % field: batch}) \
+                .order_by().values(field)
+            groups = [
+                (field.split('_')[0], vms.annotate(total=Count('pk'))),
+                ('ram', vms.filter(status='running').exclude(ram=-1)
+                    .annotate(total=Sum('ram'))),
+                ('disk', vms.exclude(disk_size=-1)
+                    .annotate(total=Sum('disk_size'))),
+            ]
+            if field == 'primary_node':
+                groups.append(
+                    ('cpus', vms.filter(status='running')
+                        .exclude(virtual_cpus=-1)
+                        .annotate(total=Sum('virtual_cpus'))))
+            for name, values in groups:
+                for row in values:
+                    allocation[row[field]][name] += row['total'] or 0
+
+    for node in nodes:
+        node._allocation = allocation[node.pk]
 
 
 class Node(CachedClusterObject):
@@ -24,6 +66,11 @@ class Node(CachedClusterObject):
 
     ROLE_CHOICES = ((k, v) for k, v in constants.NODE_ROLE_MAP.items())
 
+    # fields requested from the RAPI query resource when only the database
+    # columns are synchronized.  These are the keys parse_persistent_info uses.
+    QUERY_FIELDS = ('name', 'mtime', 'mtotal', 'mfree', 'dtotal', 'dfree',
+                    'csockets', 'offline', 'role')
+
     cluster = models.ForeignKey('clusters.Cluster', related_name='nodes')
     hostname = LowerCaseCharField(max_length=128, unique=True)
     cluster_hash = models.CharField(max_length=40, editable=False)
@@ -42,6 +89,8 @@ class Node(CachedClusterObject):
     last_job = models.ForeignKey('jobs.Job', related_name="+", null=True,
                                  blank=True)
 
+    objects = QuerySetManager()
+
     def __unicode__(self):
         return self.hostname
 
@@ -62,6 +111,33 @@ class Node(CachedClusterObject):
         return 'node-detail', (), {'cluster_slug': self.cluster.slug,
                                    'host': self.hostname}
 
+    class QuerySet(QuerySet):
+
+        _with_allocation = False
+
+        def with_allocation(self):
+            """
+            Annotate each node with the resources allocated to its
+            instances, with grouped queries for all of the nodes rather
+            than three queries per node.  See annotate_allocation().
+            """
+            clone = self._clone()
+            clone._with_allocation = True
+            return clone
+
+        def _clone(self, *args, **kwargs):
+            clone = super(Node.QuerySet, self)._clone(*args, **kwargs)
+            clone._with_allocation = self._with_allocation
+            return clone
+
+        def iterator(self):
+            nodes = super(Node.QuerySet, self).iterator()
+            if not self._with_allocation:
+                return nodes
+            nodes = list(nodes)
+            annotate_allocation(nodes)
+            return iter(nodes)
+
     def _refresh(self):
         """ returns node info from the ganeti server """
         return self.rapi.GetNode(self.hostname)
@@ -89,19 +165,20 @@ class Node(CachedClusterObject):
         return data
 
     @property
-    def ram(self):
-        """ returns dict of free and total ram """
-        values = (VirtualMachine.objects
-                  .filter(Q(primary_node=self) | Q(secondary_node=self))
-                  .filter(status='running')
-                  .exclude(ram=-1).order_by()
-                  .aggregate(used=Sum('ram')))
-
-        total = self.ram_total
-        used = total - self.ram_free
-        allocated = values.get("used") or 0
-        free = total - allocated if allocated >= 0 and total >= 0 else -1
+    def allocation(self):
+        """
+        Returns the RAM, disk and virtual CPUs allocated to this node's
+        instances.  They are set for every node loaded with
+        Node.objects.with_allocation(), and queried otherwise.
+        """
+        if getattr(self, '_allocation', None) is None:
+            annotate_allocation([self])
+        return self._allocation
 
+    @staticmethod
+    def _usage(total, free, allocated):
+        used = total - free
+        free = total - allocated if allocated >= 0 and total >= 0 else -1
         return {
             'total': total,
             'free':  free,
@@ -109,33 +186,31 @@ class Node(CachedClusterObject):
             'used': used,
         }
 
+    @property
+    def ram(self):
+        """ returns dict of free and total ram """
+        return self._usage(self.ram_total, self.ram_free,
+                           self.allocation['ram'])
+
     @property
     def disk(self):
         """ returns dict of free and total disk space """
-        values = VirtualMachine.objects \
-            .filter(Q(primary_node=self) | Q(secondary_node=self)) \
-            .exclude(disk_size=-1).order_by() \
-            .aggregate(used=Sum('disk_size'))
-
-        total = self.disk_total
-        used = total - self.disk_free
-        allocated = values.get("used") or 0
-        free = total - allocated if allocated >= 0 and total >= 0 else -1
-
-        return {
-            'total': total,
-            'free':  free,
-            'allocated': allocated,
-            'used': used,
-        }
+        return self._usage(self.disk_total, self.disk_free,
+                           self.allocation['disk'])
 
     @property
     def allocated_cpus(self):
-        values = VirtualMachine.objects \
-            .filter(primary_node=self, status='running') \
-            .exclude(virtual_cpus=-1).order_by() \
-            .aggregate(cpus=Sum('virtual_cpus'))
-        return values.get("cpus") or 0
+        return self.allocation['cpus']
+
+    @property
+    def primary_count(self):
+        """ number of instances using this node as their primary node """
+        return self.allocation['primary']
+
+    @property
+    def secondary_count(self):
+        """ number of instances using this node as their secondary node """
+        return self.allocation['secondary']
 
     def set_role(self, role, force=False):
         """
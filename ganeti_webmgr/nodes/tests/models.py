@@ -275,3 +275,42 @@ class TestNodeModel(TestCase, NodeTestCaseMixin):
         node.delete()
         node2.delete()
         c.delete()
+
+    def test_with_allocation(self):
+        """
+        Tests annotating nodes with Node.objects.with_allocation()
+
+        Verifies:
+            * allocation of every node is queried with grouped queries
+            * annotated values match the per-node properties
+        """
+        node, c = self.create_node()
+        node2, c = self.create_node(cluster=c, hostname='two')
+        node.refresh()
+        node2.refresh()
+
+        VirtualMachine.objects.create(cluster=c, primary_node=node,
+                                      secondary_node=node2, hostname='foo',
+                                      ram=123, disk_size=100, virtual_cpus=2,
+                                      status='running')
+        VirtualMachine.objects.create(cluster=c, primary_node=node2,
+                                      hostname='bar', ram=456, disk_size=200,
+                                      virtual_cpus=4, status='admin_down')
+
+        with self.assertNumQueries(8):
+            nodes = list(c.nodes.with_allocation().order_by('hostname'))
+        with self.assertNumQueries(0):
+            self.assertEqual({'ram': 123, 'disk': 100, 'cpus': 2,
+                              'primary': 1, 'secondary': 0},
+                             nodes[0].allocation)
+            self.assertEqual({'ram': 123, 'disk': 300, 'cpus': 0,
+                              'primary': 1, 'secondary': 1},
+                             nodes[1].allocation)
+            self.assertEqual(1, nodes[1].primary_count)
+            self.assertEqual(1, nodes[1].secondary_count)
+
+        for annotated in nodes:
+            node = Node.objects.get(pk=annotated.pk)
+            self.assertEqual(node.ram, annotated.ram)
+            self.assertEqual(node.disk, annotated.disk)
+            self.assertEqual(node.allocated_cpus, annotated.allocated_cpus)
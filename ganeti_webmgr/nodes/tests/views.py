@@ -15,7 +15,10 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
 # USA.
 
+from datetime import datetime
+
 from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
 from django.test import TestCase
 # Per #6579, do not change this import without discussion.
 from django.utils import simplejson as json
@@ -73,6 +76,41 @@ class TestNodeViews(TestCase, NodeTestCaseMixin, UserTestMixin, ViewTestMixin):
         self.assert_standard_fails(url, args)
         self.assert_200(url, args, users, 'ganeti/virtual_machine/list.html')
 
+    def test_primary_vm_links(self):
+        """
+        Only the VMs whose details the user may view are linked
+        """
+        url = '/cluster/%s/node/%s/primary' % (self.cluster.slug,
+                                               self.node.hostname)
+        vm1 = VirtualMachine.objects.create(cluster=self.cluster,
+                                            hostname='vm1.example.bak',
+                                            primary_node=self.node)
+        VirtualMachine.objects.create(cluster=self.cluster,
+                                      hostname='vm2.example.bak',
+                                      primary_node=self.node)
+        VirtualMachine.objects.update(cached=datetime.now())
+        self.user_migrate.grant('power', vm1)
+        def link(hostname):
+            url = reverse('instance-detail',
+                          args=[self.cluster.slug, hostname])
+            return '<a href="%s">%s</a>' % (url, hostname)
+
+        self.assertTrue(self.client.login(username=self.user_migrate.username,
+                                     password='secret'))
+        response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        permissions = response.context['table'].permissions
+        self.assertTrue(permissions.has_perm('power', vm1))
+        self.assertFalse(permissions.has_perm('admin', self.cluster))
+        self.assertContains(response, link('vm1.example.bak'))
+        self.assertNotContains(response, link('vm2.example.bak'))
+        self.assertContains(response, 'vm2.example.bak')
+
+        self.assertTrue(self.client.login(username=self.user_admin.username,
+                                     password='secret'))
+        response = self.client.get(url)
+        self.assertContains(response, link('vm2.example.bak'))
+
     def test_secondary_vms(self):
         args = (self.cluster.slug, self.node.hostname)
         url = '/cluster/%s/node/%s/secondary'
@@ -33,6 +33,7 @@ log_action = LogItem.objects.log_action
 
 from ganeti_webmgr.utils.client import GanetiApiError
 from ganeti_webmgr.ganeti_web import constants
+from ganeti_webmgr.ganeti_web.backend.snapshots import PermissionSnapshot
 from ganeti_webmgr.ganeti_web.views.generic import NO_PRIVS, LoginRequiredMixin
 from ganeti_webmgr.ganeti_web.views.tables import NodeVMTable
 from ganeti_webmgr.virtualmachines.views import BaseVMListView
@@ -66,8 +67,9 @@ class NodeDetailView(LoginRequiredMixin, DetailView):
 
     def get_context_data(self, **kwargs):
         user = self.request.user
-        admin = user.is_superuser or user.has_perm('admin', self.cluster)
-        modify = admin or user.has_perm('migrate', self.cluster)
+        snapshot = PermissionSnapshot.for_request(self.request)
+        admin = user.is_superuser or snapshot.has_perm('admin', self.cluster)
+        modify = admin or snapshot.has_perm('migrate', self.cluster)
         readonly = not (admin or modify)
 
         return {
@@ -97,8 +99,10 @@ class BaseNodeVMListView(BaseVMListView):
             self.kwargs["cluster_slug"], self.kwargs["host"])
 
         user = self.request.user
-        self.admin = (user.is_superuser or user.has_any_perms(self.cluster,
-                      ["admin", "migrate"]))
+        snapshot = PermissionSnapshot.for_request(self.request)
+        self.admin = (user.is_superuser or
+                      snapshot.has_any_perms(self.cluster,
+                                             ["admin", "migrate"]))
         if not self.admin:
             raise PermissionDenied(NO_PRIVS)
 
@@ -4,7 +4,7 @@ from collections import defaultdict
 
 from django.conf import settings
 
-from .client import GanetiRapiClient, GanetiApiError
+from .client import GanetiRapiClient, GanetiApiError, RS_NORMAL
 from .proxy import RapiProxy, XenRapiProxy
 
 from ganeti_webmgr.ganeti_web import constants
@@ -16,6 +16,26 @@ def generate_random_password(length=12):
     return "".join(random.sample(string.letters + string.digits, length))
 
 
+def chunks(seq, size):
+    """
+    Split a sequence into lists of at most ``size`` items.
+    """
+    seq = list(seq)
+    return [seq[i:i + size] for i in xrange(0, len(seq), size)]
+
+
+def query_infos(result):
+    """
+    Converts the result of a RAPI query into a list of dictionaries keyed by
+    field name, like the ones returned by bulk RAPI calls.  Fields without
+    data, such as the memory of an offline node, are set to None.
+    """
+    names = [field['name'] for field in result['fields']]
+    return [dict((name, value if status == RS_NORMAL else None)
+                 for name, (status, value) in zip(names, row))
+            for row in result['data']]
+
+
 RAPI_CACHE = {}
 RAPI_CACHE_HASHES = {}
 
@@ -84,11 +104,13 @@ def get_rapi(hash, cluster):
 
     # delete any old version of the client that was cached.
     if cluster in RAPI_CACHE_HASHES:
-        del RAPI_CACHE[RAPI_CACHE_HASHES[cluster]]
+        RAPI_CACHE.pop(RAPI_CACHE_HASHES[cluster]).Close()
 
     # Set connect timeout in settings.py so that you do not learn patience.
     rapi = rapi_client(host, port, user, password,
-                       timeout=settings.RAPI_CONNECT_TIMEOUT)
+                       timeout=settings.RAPI_CONNECT_TIMEOUT,
+                       pool_size=settings.RAPI_POOL_SIZE,
+                       idle_timeout=settings.RAPI_POOL_IDLE_TIMEOUT)
     RAPI_CACHE[hash] = rapi
     RAPI_CACHE_HASHES[cluster] = hash
     return rapi
@@ -98,10 +120,22 @@ def clear_rapi_cache():
     """
     clears the rapi cache
     """
+    for rapi in RAPI_CACHE.values():
+        rapi.Close()
     RAPI_CACHE.clear()
     RAPI_CACHE_HASHES.clear()
 
 
+def rapi_pool_stats():
+    """
+    Returns the connection pool statistics of every cached RAPI client, keyed
+    by the id of its cluster.
+    """
+    return dict((cluster, RAPI_CACHE[hash].GetPoolStats())
+                for cluster, hash in RAPI_CACHE_HASHES.items()
+                if hash in RAPI_CACHE)
+
+
 def cluster_default_info(cluster, hypervisor=None):
     """
     Returns a dictionary containing the following
@@ -278,15 +312,27 @@ def contains(e, t):
 def get_hypervisor(vm):
     """
     Given a VirtualMachine object,
+    return its hypervisor.  The hypervisor stored when its info was parsed
+    is used if there is one.
+    """
+    if vm.hypervisor:
+        return vm.hypervisor
+    if vm.info:
+        return info_hypervisor(vm.info)
+    return None
+
+
+def info_hypervisor(info):
+    """
+    Given the info of an instance,
     return its hypervisor depending on what hvparam fields
     it contains.
     """
-    if vm.info:
-        info = vm.info['hvparams']
-        if 'serial_console' in info:
-            return 'kvm'
-        elif 'initrd_path' in info:
-            return 'xen-pvm'
-        elif 'acpi' in info:
-            return 'xen-hvm'
+    info = info.get('hvparams') or {}
+    if 'serial_console' in info:
+        return 'kvm'
+    elif 'initrd_path' in info:
+        return 'xen-pvm'
+    elif 'acpi' in info:
+        return 'xen-hvm'
     return None
@@ -27,8 +27,11 @@ Ganeti RAPI client.
 import logging
 import simplejson as json
 import socket
+import threading
+import time
 
 import requests
+from requests.adapters import HTTPAdapter
 
 
 GANETI_RAPI_PORT = 5080
@@ -71,6 +74,13 @@ JOB_STATUS_ALL = frozenset([
 # Legacy name
 JOB_STATUS_WAITLOCK = JOB_STATUS_WAITING
 
+# Query result status
+RS_NORMAL = 0
+RS_UNKNOWN = 1
+RS_NODATA = 2
+RS_UNAVAIL = 3
+RS_OFFLINE = 4
+
 # Internal constants
 _REQ_DATA_VERSION_FIELD = "__version__"
 _INST_NIC_PARAMS = frozenset(["mac", "ip", "mode", "link"])
@@ -159,7 +169,8 @@ class GanetiRapiClient(object):  # pylint: disable-msg=R0904
     _json_encoder = json.JSONEncoder(sort_keys=True)
 
     def __init__(self, host, port=GANETI_RAPI_PORT, username=None,
-                 password=None, timeout=60, logger=logging):
+                 password=None, timeout=60, logger=logging, pool_size=10,
+                 idle_timeout=None):
         """
         Initializes this class.
 
@@ -172,6 +183,11 @@ class GanetiRapiClient(object):  # pylint: disable-msg=R0904
         :type password: string
         :param password: the password to connect with
         :param logger: Logging object
+        :type pool_size: int
+        :param pool_size: the maximum number of kept-alive connections
+        :type idle_timeout: int or None
+        :param idle_timeout: seconds after which idle connections are closed
+            instead of reused, or None to keep them open
         """
 
         if username is not None and password is None:
@@ -194,6 +210,83 @@ class GanetiRapiClient(object):  # pylint: disable-msg=R0904
 
         self._base_url = "https://%s" % address
 
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._resets = 0
+        self._connections = 0
+        self._last_used = None
+        self._session = self._CreateSession()
+
+    def _CreateSession(self):
+        """
+        Creates the session used for requests to the cluster.  Connections in
+        its pool are kept alive and reused by later requests.
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount("https://", adapter)
+        return session
+
+    def _CountConnections(self):
+        """
+        Counts the connections opened by the current session.
+        """
+        count = 0
+        pools = self._session.get_adapter(self._base_url).poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                count += pool.num_connections
+        return count
+
+    def _GetSession(self):
+        """
+        Returns the session, replacing it first if its connections have been
+        idle for longer than the idle timeout.
+        """
+        with self._lock:
+            now = time.time()
+            if (self.idle_timeout is not None and self._last_used is not None
+                    and now - self._last_used > self.idle_timeout):
+                self._connections += self._CountConnections()
+                self._session.close()
+                self._session = self._CreateSession()
+                self._resets += 1
+            self._last_used = now
+            self._requests += 1
+            return self._session
+
+    def GetPoolStats(self):
+        """
+        Returns statistics about the connection pool of this client.
+
+        :rtype: dict
+        :return: the pool size and idle timeout, the number of requests sent,
+            connections opened, requests that reused a connection, and times
+            the pool was reset because it was idle
+        """
+        with self._lock:
+            connections = self._connections + self._CountConnections()
+            return {
+                "pool_size": self.pool_size,
+                "idle_timeout": self.idle_timeout,
+                "requests": self._requests,
+                "connections": connections,
+                "reused": max(self._requests - connections, 0),
+                "resets": self._resets,
+            }
+
+    def Close(self):
+        """
+        Closes all pooled connections of this client.
+        """
+        with self._lock:
+            self._connections += self._CountConnections()
+            self._session.close()
+            self._session = self._CreateSession()
+
     def _SendRequest(self, method, path, query=None, content=None):
         """
         Sends an HTTP request.
@@ -242,7 +335,7 @@ class GanetiRapiClient(object):  # pylint: disable-msg=R0904
         # print "Sending request to %s %s" % (url, kwargs)
 
         try:
-            r = requests.request(method, url, **kwargs)
+            r = self._GetSession().request(method, url, **kwargs)
         except requests.ConnectionError:
             raise GanetiApiError("Couldn't connect to %s" % self._base_url)
         except requests.Timeout:
@@ -85,7 +85,7 @@ class GanetiError(models.Model):
 
             qs = self.filter(cleared=False)
 
-            if obj:
+            if obj is not None:
                 qs = qs.get_errors(obj)
 
             return qs.update(cleared=True)
@@ -20,7 +20,8 @@ __all__ = ['INSTANCE', 'INSTANCES', 'XEN_PVM_INSTANCE', 'XEN_HVM_INSTANCE',
            'XEN_INSTANCES', 'NODE', 'NODES', 'NODES_BULK', 'INFO', 'XEN_INFO',
            'OPERATING_SYSTEMS', 'XEN_OPERATING_SYSTEMS', 'JOB', 'JOB_RUNNING',
            'JOB_ERROR', 'JOB_DELETE_SUCCESS', 'JOB_LOG', 'INSTANCES_BULK',
-           'NODES_MAP']
+           'NODES_MAP', 'INSTANCES_MAP', 'QUERY_INSTANCES', 'QUERY_NODES',
+           'QUERY_MAP']
 
 from .response_map import ResponseMap
 
@@ -606,7 +607,7 @@ INSTANCES_BULK = [{'admin_state': False,
                                 'vnc_x509_path': '',
                                 'vnc_x509_verify': False},
                    'mtime': 1285883187.8692000,
-                   'name': 'vm1.example.bak',
+                   'name': 'gimager.example.bak',
                    'network_port': 11165,
                    'nic.bridges': ['br42'],
                    'nic.ips': [None],
@@ -655,7 +656,7 @@ INSTANCES_BULK = [{'admin_state': False,
                                 'vnc_x509_path': '',
                                 'vnc_x509_verify': False},
                    'mtime': 1285883187.8692000,
-                   'name': 'vm2.example.bak',
+                   'name': 'gimager2.example.bak',
                    'network_port': 11165,
                    'nic.bridges': ['br42'],
                    'nic.ips': [None],
@@ -682,3 +683,48 @@ NODES_MAP = ResponseMap([
     (((True,), {}), NODES_BULK),
     (((), {'bulk': True}), NODES_BULK),
 ])
+
+# map instances response for bulk argument
+INSTANCES_MAP = ResponseMap([
+    (((), {}), INSTANCES),
+    (((False,), {}), INSTANCES),
+    (((), {'bulk': False}), INSTANCES),
+    (((True,), {}), INSTANCES_BULK),
+    (((), {'bulk': True}), INSTANCES_BULK),
+])
+
+
+def query_result(infos, fields):
+    """
+    Build a RAPI query result for the given fields from bulk info.  Missing
+    values, such as the memory of an offline node, have the "no data" status.
+    """
+    return {
+        'fields': [{'name': field, 'title': field, 'kind': 'other',
+                    'doc': field} for field in fields],
+        'data': [[[0, info[field]] if info.get(field) is not None
+                  else [2, None] for field in fields] for info in infos],
+    }
+
+QUERY_INSTANCE_FIELDS = ['name', 'mtime', 'beparams', 'disk.sizes', 'os',
+                         'status', 'pnode', 'snodes', 'disk_template',
+                         'hypervisor', 'hvparams', 'admin_state',
+                         'network_port', 'nic.ips', 'nic.macs', 'nic.links',
+                         'nic.modes', 'tags']
+QUERY_NODE_FIELDS = ['name', 'mtime', 'mtotal', 'mfree', 'dtotal', 'dfree',
+                     'csockets', 'offline', 'role']
+QUERY_INSTANCES = query_result(INSTANCES_BULK, QUERY_INSTANCE_FIELDS)
+QUERY_NODES = query_result(NODES_BULK, QUERY_NODE_FIELDS)
+QUERY_FINGERPRINT_FIELDS = ['name', 'mtime', 'serial_no']
+QUERY_INSTANCES_FINGERPRINT = query_result(INSTANCES_BULK,
+                                           QUERY_FINGERPRINT_FIELDS)
+QUERY_NODES_FINGERPRINT = query_result(NODES_BULK, QUERY_FINGERPRINT_FIELDS)
+
+# map query responses for the resource and fields queried
+QUERY_MAP = ResponseMap([
+    ((('instance', QUERY_INSTANCE_FIELDS), {}), QUERY_INSTANCES),
+    ((('node', QUERY_NODE_FIELDS), {}), QUERY_NODES),
+    ((('instance', QUERY_FINGERPRINT_FIELDS), {}),
+     QUERY_INSTANCES_FINGERPRINT),
+    ((('node', QUERY_FINGERPRINT_FIELDS), {}), QUERY_NODES_FINGERPRINT),
+])
@@ -35,11 +35,12 @@ class RapiProxy(client.GanetiRapiClient):
         """
         instance = object.__new__(cls)
         instance.__init__(*args, **kwargs)
-        CallProxy.patch(instance, 'GetInstances', False, INSTANCES)
+        CallProxy.patch(instance, 'GetInstances', False, INSTANCES_MAP)
         CallProxy.patch(instance, 'GetInstance', False, INSTANCE)
         CallProxy.patch(instance, 'GetNodes', False, NODES_MAP)
         CallProxy.patch(instance, 'GetNode', False, NODE)
         CallProxy.patch(instance, 'GetInfo', False, INFO)
+        CallProxy.patch(instance, 'Query', False, QUERY_MAP)
         CallProxy.patch(instance, 'GetOperatingSystems', False,
                         OPERATING_SYSTEMS)
         CallProxy.patch(instance, 'GetJobStatus', False, JOB_RUNNING)
@@ -94,7 +95,7 @@ class XenRapiProxy(RapiProxy):
         instance.GetInstance = None
         instance.GetInfo = None
         instance.GetOperatingSystems = None
-        CallProxy.patch(instance, 'GetInstances', False, INSTANCES)
+        CallProxy.patch(instance, 'GetInstances', False, INSTANCES_MAP)
         CallProxy.patch(instance, 'GetInstance', False, XEN_PVM_INSTANCE)
         CallProxy.patch(instance, 'GetInfo', False, XEN_INFO)
         CallProxy.patch(instance, 'GetOperatingSystems', False,
@@ -115,7 +116,7 @@ class XenHvmRapiProxy(XenRapiProxy):
         instance.GetInstance = None
         instance.GetInfo = None
         instance.GetOperatingSystems = None
-        CallProxy.patch(instance, 'GetInstances', False, INSTANCES)
+        CallProxy.patch(instance, 'GetInstances', False, INSTANCES_MAP)
         CallProxy.patch(instance, 'GetInstance', False, XEN_HVM_INSTANCE)
         CallProxy.patch(instance, 'GetInfo', False, XEN_INFO)
         CallProxy.patch(instance, 'GetOperatingSystems', False,
@@ -1,3 +1,4 @@
+from .client import *
 from .fields import *
 from .ganeti_errors import *
 from .models import *
@@ -0,0 +1,102 @@
+# Copyright (C) 2010 Oregon State University et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+import time
+
+from django.test import SimpleTestCase
+
+from ganeti_webmgr.utils.client import GanetiRapiClient
+
+__all__ = (
+    "TestClientPool",
+)
+
+
+class FakeResponse(object):
+    status_code = 200
+    content = '"ok"'
+
+
+class FakeSession(object):
+    """
+    Stands in for a requests session, recording the requests sent through it.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url))
+        return FakeResponse()
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+
+class TestClientPool(SimpleTestCase):
+    """
+    Requests are sent through a pooled session owned by each client.
+    """
+
+    def setUp(self):
+        self.client = GanetiRapiClient("cluster.example.com", pool_size=3,
+                                       idle_timeout=30)
+
+    def test_pool_stats(self):
+        stats = self.client.GetPoolStats()
+        self.assertEqual(stats["pool_size"], 3)
+        self.assertEqual(stats["idle_timeout"], 30)
+        self.assertEqual(stats["requests"], 0)
+        self.assertEqual(stats["connections"], 0)
+        self.assertEqual(stats["resets"], 0)
+
+    def test_session_reused(self):
+        session = FakeSession(self.client._session)
+        self.client._session = session
+
+        self.assertEqual(self.client._SendRequest("GET", "/2/info"), "ok")
+        self.client._SendRequest("GET", "/2/info")
+        self.assertEqual(len(session.requests), 2)
+        self.assertEqual(session.requests[0],
+                         ("GET", "https://cluster.example.com:5080/2/info"))
+        stats = self.client.GetPoolStats()
+        self.assertEqual(stats["requests"], 2)
+        self.assertEqual(stats["resets"], 0)
+
+    def test_idle_timeout(self):
+        session = FakeSession(self.client._session)
+        self.client._session = session
+        self.client._SendRequest("GET", "/2/info")
+
+        # idle for longer than the timeout, a new session is used
+        new_session = FakeSession(self.client._CreateSession())
+        self.client._CreateSession = lambda: new_session
+        self.client._last_used = time.time() - 31
+        self.client._SendRequest("GET", "/2/info")
+        self.assertEqual(len(session.requests), 1)
+        self.assertEqual(len(new_session.requests), 1)
+        self.assertEqual(self.client.GetPoolStats()["resets"], 1)
+
+    def test_no_idle_timeout(self):
+        self.client.idle_timeout = None
+        session = FakeSession(self.client._session)
+        self.client._session = session
+        self.client._SendRequest("GET", "/2/info")
+        self.client._last_used = time.time() - 3600
+        self.client._SendRequest("GET", "/2/info")
+        self.assertEqual(len(session.requests), 2)
@@ -73,6 +73,7 @@ class TestGetHypervisor(SimpleTestCase):
             pass
 
         self.disp = InfoDispenser()
+        self.disp.hypervisor = ''
 
     def test_get_hypervisor_kvm(self):
         self.disp.info = INSTANCE
@@ -90,6 +91,11 @@ class TestGetHypervisor(SimpleTestCase):
         self.disp.info = {"hvparams": "asdfaf"}
         self.assertEqual(get_hypervisor(self.disp), None)
 
+    def test_get_hypervisor_stored(self):
+        self.disp.info = INSTANCE
+        self.disp.hypervisor = "xen-hvm"
+        self.assertEqual(get_hypervisor(self.disp), "xen-hvm")
+
 
 class TestHvPrettify(SimpleTestCase):
 
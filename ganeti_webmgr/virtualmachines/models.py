@@ -1,13 +1,25 @@
 
+from collections import defaultdict
+from itertools import izip_longest
+from multiprocessing.pool import ThreadPool
+
 from django.db import models
 from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.query import QuerySet
+
+from object_permissions.registration import get_model_perms, permission_map
 
-from ganeti_webmgr.clusters.models import CachedClusterObject
+from ganeti_webmgr.clusters.models import (CachedClusterObject, CachedInfo,
+                                           BULK_CREATE_BATCH_SIZE,
+                                           UPDATE_BATCH_SIZE)
 from ganeti_webmgr.jobs.models import Job
 
 from ganeti_webmgr.ganeti_web import constants
-from ganeti_webmgr.utils import generate_random_password, get_rapi
-from ganeti_webmgr.utils.client import REPLACE_DISK_AUTO
+from ganeti_webmgr.utils import (chunks, generate_random_password, get_rapi,
+                                 info_hypervisor)
+from ganeti_webmgr.utils.client import GanetiApiError, REPLACE_DISK_AUTO
 from ganeti_webmgr.utils.fields import LowerCaseCharField
 from ganeti_webmgr.vm_templates.models import VirtualMachineTemplate
 
@@ -16,6 +28,63 @@ if settings.VNC_PROXY:
                                                          request_ssh)
 
 
+def owner_tag_id(tag):
+    """
+    Find the owner named by a tag.
+
+    @param tag - one of an instance's tags
+    @returns the primary key of the owner, or None if the tag is not an owner
+    tag.  Owner tags that do not end with a primary key, which are not
+    written by GWM, are ignored.
+    """
+    if tag.startswith(constants.OWNER_TAG):
+        suffix = tag[len(constants.OWNER_TAG):]
+        if suffix.isdigit():
+            return int(suffix)
+    return None
+
+
+def owner_tag_changes(tags, owner_id):
+    """
+    Find the changes needed for an instance's tags to name its owner.
+
+    @param tags - the instance's current tags
+    @param owner_id - primary key of the owner, or None
+    @returns a list of owner tags to delete, and a list of tags to add
+    """
+    found = False
+    remove = []
+    for tag in tags:
+        id = owner_tag_id(tag)
+        if id is not None:
+            # Since there is no 'update tag' delete old tag and
+            #  replace with tag containing correct owner id.
+            if id == owner_id:
+                found = True
+            else:
+                remove.append(tag)
+    add = []
+    if owner_id and not found:
+        add.append('%s%s' % (constants.OWNER_TAG, owner_id))
+    return remove, add
+
+
+def tagged_owner(tags):
+    """
+    Find the owner named by an instance's owner tags.
+
+    @param tags - the instance's tags
+    @returns the primary key of the owner, None if there is no owner tag, or
+    0 if there are several, so that the extra tags are reconciled.  0 is
+    also stored when the owner changes.
+    """
+    owners = set(owner_tag_id(tag) for tag in tags or ())
+    owners.discard(None)
+    if len(owners) > 1:
+        return 0
+    return owners.pop() if owners else None
+
+
 class VirtualMachine(CachedClusterObject):
     """
     The VirtualMachine (VM) model represents VMs within a Ganeti cluster.
@@ -36,6 +105,13 @@ class VirtualMachine(CachedClusterObject):
         limit can be determined. (Later Date, if it will optimize db)
 
     """
+    # fields requested from the RAPI query resource when only the database
+    # columns are synchronized.  These are the keys parse_persistent_info uses.
+    QUERY_FIELDS = ('name', 'mtime', 'beparams', 'disk.sizes', 'os', 'status',
+                    'pnode', 'snodes', 'disk_template', 'hypervisor',
+                    'hvparams', 'admin_state', 'network_port', 'nic.ips',
+                    'nic.macs', 'nic.links', 'nic.modes', 'tags')
+
     cluster = models.ForeignKey('clusters.Cluster',
                                 related_name='virtual_machines',
                                 editable=False, default=0)
@@ -52,6 +128,21 @@ class VirtualMachine(CachedClusterObject):
     operating_system = models.CharField(max_length=128)
     status = models.CharField(max_length=14)
 
+    # attributes parsed from the cached info, stored so that lists can be
+    # filtered and sorted by them
+    disk_template = models.CharField(max_length=16, blank=True,
+                                     db_index=True, editable=False)
+    hypervisor = models.CharField(max_length=16, blank=True, db_index=True,
+                                  editable=False)
+    admin_state = models.CharField(max_length=8, blank=True, db_index=True,
+                                   editable=False)
+    network_port = models.IntegerField(null=True, blank=True,
+                                       editable=False)
+    # owner named by the instance's owner tag, so that owner tags can be
+    # reconciled without loading the cached info.  0 when the tag must be
+    # checked.  See tagged_owner().
+    tagged_owner = models.IntegerField(null=True, blank=True, editable=False)
+
     # node relations
     primary_node = models.ForeignKey('nodes.Node', related_name='primary_vms',
                                      null=True, blank=True)
@@ -87,42 +178,178 @@ class VirtualMachine(CachedClusterObject):
         ordering = ["hostname"]
         unique_together = (("cluster", "hostname"),)
 
+    def __init__(self, *args, **kwargs):
+        super(VirtualMachine, self).__init__(*args, **kwargs)
+        self._saved_owner_id = self.owner_id
+
     def __unicode__(self):
         return self.hostname
 
     def save(self, *args, **kwargs):
         """
         sets the cluster_hash for newly saved instances
+
+        Owner tags are not updated here, so saving never waits on the
+        cluster.  If the owner changed, tagged_owner is cleared so that the
+        tag is checked by reconcile_owner_tags().
         """
-        if self.id is None:
+        created = self.id is None
+        if created:
             self.cluster_hash = self.cluster.hash
+        elif self.owner_id != getattr(self, '_saved_owner_id',
+                                      self.owner_id):
+            self.tagged_owner = 0
 
-        info_ = self.info
-        if info_:
-            found = False
-            remove = []
-            if self.cluster.username:
-                for tag in info_['tags']:
-                    # Update owner Tag. Make sure the tag is set to the owner
-                    #  that is set in webmgr.
-                    if tag.startswith(constants.OWNER_TAG):
-                        id = int(tag[len(constants.OWNER_TAG):])
-                        # Since there is no 'update tag' delete old tag and
-                        #  replace with tag containing correct owner id.
-                        if id == self.owner_id:
-                            found = True
-                        else:
-                            remove.append(tag)
+        super(VirtualMachine, self).save(*args, **kwargs)
+        self._saved_owner_id = self.owner_id
+
+        if created:
+            VirtualMachineAccess.store(vms=[self.pk])
+
+    @classmethod
+    def assign_owner(cls, vms, owner):
+        """
+        Assign an owner to many VirtualMachines at once.  Owners are updated
+        with one query per cluster rather than by saving each VM, and the
+        owner tags of the instances are updated with concurrent RAPI calls.
+
+        @param vms - queryset of the VirtualMachines
+        @param owner - the new ClusterUser owner, or None
+        @returns a list of (hostname, error) for instances whose owner tag
+        could not be updated.  Their owners are still assigned.
+        """
+        # preventing circular imports
+        from ganeti_webmgr.clusters.models import Cluster
+
+        owner_id = owner.id if owner else None
+        hostnames = defaultdict(dict)
+        untagged = defaultdict(dict)
+        for id, hostname, cluster_id, tagged in vms.values_list(
+                'id', 'hostname', 'cluster', 'tagged_owner'):
+            hostnames[cluster_id][id] = hostname
+            if tagged != owner_id:
+                untagged[cluster_id][id] = (hostname, owner_id)
+
+        errors = []
+        for cluster in Cluster.objects.filter(id__in=hostnames):
+            ids = list(hostnames[cluster.id])
+            cls.objects.filter(cluster=cluster, id__in=ids) \
+                .update(owner=owner)
+            errors.extend(cls._update_owner_tags(cluster,
+                                                 untagged[cluster.id]))
+        return errors
+
+    @classmethod
+    def reconcile_owner_tags(cls, cluster, vms=None):
+        """
+        Make the owner tags of a cluster's instances match the owners set in
+        the database.  Owners are not tagged when they are saved, so this is
+        run when the cluster's VirtualMachines are synchronized.  The owners
+        are compared with the tagged_owner column, so only the cached info of
+        instances whose owner changed or whose tags drifted is loaded.
+
+        @param vms - queryset of the VirtualMachines to reconcile.  Defaults
+        to all of the cluster's VirtualMachines.
+        @returns a list of (hostname, error) for instances whose owner tag
+        could not be updated
+        """
+        if vms is None:
+            vms = cluster.virtual_machines.all()
+        owners = dict((id, (hostname, owner_id))
+                      for id, hostname, owner_id, tagged
+                      in vms.values_list('id', 'hostname', 'owner',
+                                         'tagged_owner')
+                      if owner_id != tagged)
+        return cls._update_owner_tags(cluster, owners)
+
+    @classmethod
+    def _update_owner_tags(cls, cluster, owners):
+        """
+        Update the owner tags of some of a cluster's instances, using the
+        tags in their cached info.  Instances without cached info are
+        skipped.  The RAPI calls are made concurrently, at most RAPI_POOL_SIZE
+        at a time so that every call can reuse one of the cluster's pooled
+        connections.  Tags can only be changed with the cluster's
+        credentials, so nothing is done for clusters without a username.
+        The tagged_owner of instances whose tags are correct afterwards is
+        updated, so they are not loaded again.
+
+        @param owners - dictionary mapping primary keys to the hostname and
+        owner id of each VirtualMachine
+        @returns a list of (hostname, error) for failed instances
+        """
+        if not cluster.username or not owners:
+            return []
+
+        content_type = ContentType.objects.get_for_model(cls)
+        infos = {}
+        for batch in chunks(owners.keys(), UPDATE_BATCH_SIZE):
+            for id, data in CachedInfo.objects \
+                    .filter(content_type=content_type, object_id__in=batch) \
+                    .values_list('object_id', 'serialized_info'):
+                info = cls.deserialize(data) if data else None
+                if info:
+                    infos[id] = info
+
+        changes = []
+        tagged = defaultdict(list)
+        for id, info in infos.items():
+            hostname, owner_id = owners[id]
+            remove, add = owner_tag_changes(info.get('tags', []), owner_id)
+            if remove or add:
+                changes.append((id, hostname, remove, add))
+            else:
+                tagged[owner_id].append(id)
+        if not changes:
+            cls._store_tagged_owners(tagged)
+            return []
+
+        rapi = cluster.rapi
+
+        def apply(change):
+            id, hostname, remove, add = change
+            try:
                 if remove:
-                    self.rapi.DeleteInstanceTags(self.hostname, remove)
-                    for tag in remove:
-                        info_['tags'].remove(tag)
-                if self.owner_id and not found:
-                    tag = '%s%s' % (constants.OWNER_TAG, self.owner_id)
-                    self.rapi.AddInstanceTags(self.hostname, [tag])
-                    self.info['tags'].append(tag)
+                    rapi.DeleteInstanceTags(hostname, remove)
+                if add:
+                    rapi.AddInstanceTags(hostname, add)
+            except GanetiApiError as e:
+                return e
+            return None
 
-        super(VirtualMachine, self).save(*args, **kwargs)
+        pool = ThreadPool(min(settings.RAPI_POOL_SIZE, len(changes)))
+        try:
+            results = pool.map(apply, changes)
+        finally:
+            pool.close()
+            pool.join()
+
+        # keep the cached tags in step with ganeti
+        errors = []
+        serialized = {}
+        for (id, hostname, remove, add), error in zip(changes, results):
+            if error is not None:
+                errors.append((hostname, error))
+                continue
+            info = infos[id]
+            info['tags'] = [tag for tag in info.get('tags', [])
+                            if tag not in remove] + add
+            serialized[id] = cls.serialize(info)
+            tagged[owners[id][1]].append(id)
+        CachedInfo.store_many(cls, serialized)
+        cls._store_tagged_owners(tagged)
+        return errors
+
+    @classmethod
+    def _store_tagged_owners(cls, tagged):
+        """
+        @param tagged - dictionary mapping owner ids to the primary keys of
+        the VirtualMachines whose instances are tagged with that owner
+        """
+        for owner_id, ids in tagged.items():
+            for batch in chunks(ids, UPDATE_BATCH_SIZE):
+                cls.objects.filter(pk__in=batch) \
+                    .update(tagged_owner=owner_id)
 
     @models.permalink
     def get_absolute_url(self):
@@ -142,10 +369,14 @@ class VirtualMachine(CachedClusterObject):
         return self.status == 'running'
 
     @classmethod
-    def parse_persistent_info(cls, info):
+    def parse_persistent_info(cls, info, nodes=None):
         """
         Loads all values from cached info, included persistent properties that
         are stored in the database
+
+        @param nodes - dictionary mapping node hostnames to primary keys.  If
+        not given, the primary and secondary nodes are looked up in a single
+        query.
         """
         from ganeti_webmgr.nodes.models import Node
         data = super(VirtualMachine, cls).parse_persistent_info(info)
@@ -160,30 +391,44 @@ class VirtualMachine(CachedClusterObject):
         data['disk_size'] = disk_size
         data['operating_system'] = info['os']
         data['status'] = info['status']
-
-        primary = info['pnode']
-        if primary:
-            try:
-                data['primary_node'] = Node.objects.get(hostname=primary)
-            except Node.DoesNotExist:
-                # node is not created yet.  fail silently
-                data['primary_node'] = None
-        else:
-            data['primary_node'] = None
-
-        secondary = info['snodes']
-        if len(secondary):
-            secondary = secondary[0]
-            try:
-                data['secondary_node'] = Node.objects.get(hostname=secondary)
-            except Node.DoesNotExist:
-                # node is not created yet.  fail silently
-                data['secondary_node'] = None
-        else:
-            data['secondary_node'] = None
+        data['disk_template'] = info.get('disk_template') or ''
+        data['hypervisor'] = info.get('hypervisor') or \
+            info_hypervisor(info) or ''
+        data['network_port'] = info.get('network_port')
+        data['tagged_owner'] = tagged_owner(info.get('tags'))
+
+        # ganeti 2.6 reports the admin state as a string, earlier versions
+        # whether the instance is marked up
+        admin_state = info.get('admin_state')
+        if isinstance(admin_state, bool):
+            admin_state = 'up' if admin_state else 'down'
+        data['admin_state'] = admin_state or ''
+
+        primary = info['pnode'].lower() if info['pnode'] else None
+        secondary = info['snodes'][0].lower() if info['snodes'] else None
+        if nodes is None:
+            nodes = {}
+            hostnames = [x for x in (primary, secondary) if x]
+            if hostnames:
+                nodes = dict(Node.objects.filter(hostname__in=hostnames)
+                             .values_list('hostname', 'id'))
+
+        # nodes that are not created yet are silently ignored
+        data['primary_node_id'] = nodes.get(primary)
+        data['secondary_node_id'] = nodes.get(secondary)
 
         return data
 
+    @classmethod
+    def store_related_info(cls, infos, created=False):
+        """
+        Rebuild the NetworkInterfaces of instances from their info, and index
+        who may access instances inserted in bulk.
+        """
+        NetworkInterface.store(infos)
+        if created:
+            VirtualMachineAccess.store(vms=infos.keys())
+
     @classmethod
     def _complete_job(cls, cluster_id, hostname, op, status):
         """
@@ -333,3 +578,196 @@ class VirtualMachine(CachedClusterObject):
 
     def __repr__(self):
         return "<VirtualMachine: '%s'>" % self.hostname
+
+
+class NetworkInterface(models.Model):
+    """
+    A NIC of a VirtualMachine.  NICs are parsed from the VM's cached info and
+    stored so that instances can be looked up by IP or MAC address without
+    decoding the info of every instance.
+    """
+    virtual_machine = models.ForeignKey(VirtualMachine, related_name='nics',
+                                        editable=False)
+    index = models.PositiveSmallIntegerField(editable=False)
+    ip = models.CharField(max_length=45, null=True, blank=True,
+                          db_index=True, editable=False)
+    mac = LowerCaseCharField(max_length=17, db_index=True, editable=False)
+    link = models.CharField(max_length=64, blank=True, db_index=True,
+                            editable=False)
+    mode = models.CharField(max_length=16, blank=True, db_index=True,
+                            editable=False)
+
+    class Meta:
+        ordering = ['virtual_machine', 'index']
+        unique_together = (('virtual_machine', 'index'),)
+
+    def __unicode__(self):
+        return u'%s nic%s' % (self.virtual_machine_id, self.index)
+
+    @staticmethod
+    def parse(info):
+        """
+        Returns a list of (ip, mac, link, mode) tuples for the NICs in an
+        instance's info, in order.
+        """
+        nics = []
+        for ip, mac, link, mode in izip_longest(info.get('nic.ips') or [],
+                                                info.get('nic.macs') or [],
+                                                info.get('nic.links') or [],
+                                                info.get('nic.modes') or []):
+            nics.append((ip or None, (mac or '').lower(), link or '',
+                         mode or ''))
+        return nics
+
+    @classmethod
+    def store(cls, infos):
+        """
+        Rebuild the NICs of many VirtualMachines.  Only the NICs of instances
+        whose NICs changed are replaced.
+
+        @param infos - dictionary mapping VirtualMachine primary keys to info
+        """
+        parsed = dict((id, cls.parse(info)) for id, info in infos.items())
+        current = defaultdict(list)
+        for batch in chunks(parsed, UPDATE_BATCH_SIZE):
+            rows = cls.objects.filter(virtual_machine__in=batch) \
+                .order_by('virtual_machine', 'index') \
+                .values_list('virtual_machine', 'ip', 'mac', 'link', 'mode')
+            for row in rows:
+                current[row[0]].append(row[1:])
+
+        changed = [id for id, nics in parsed.items() if current[id] != nics]
+        for batch in chunks(changed, UPDATE_BATCH_SIZE):
+            cls.objects.filter(virtual_machine__in=batch).delete()
+        new = [cls(virtual_machine_id=id, index=index, ip=ip, mac=mac,
+                   link=link, mode=mode)
+               for id in changed
+               for index, (ip, mac, link, mode) in enumerate(parsed[id])]
+        for batch in chunks(new, BULK_CREATE_BATCH_SIZE):
+            cls.objects.bulk_create(batch)
+
+    @classmethod
+    def lookup(cls, address):
+        """
+        Returns the NICs with an IP or MAC address, with their VirtualMachine
+        and its cluster.
+        """
+        address = address.strip()
+        return cls.objects.filter(models.Q(ip=address) |
+                                  models.Q(mac=address.lower())) \
+            .select_related('virtual_machine__cluster')
+
+
+class VirtualMachineAccess(models.Model):
+    """
+    A user's access to a VirtualMachine, through any permission on it or
+    admin permission on its cluster, granted to the user or to one of their
+    groups.  Superusers are not indexed.
+
+    This is a materialised index of the permissions, kept current by signals
+    connected in ganeti_web.models, so that the VirtualMachines a user may
+    access are found with one indexed join.
+    """
+    user = models.ForeignKey(User, related_name='+')
+    virtual_machine = models.ForeignKey(VirtualMachine, related_name='access')
+    admin = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = (('user', 'virtual_machine'),)
+
+    @classmethod
+    def store(cls, users=None, vms=None, revoked=False):
+        """
+        Recompute the access of users to VirtualMachines.  Only the rows that
+        changed are written.
+
+        @param users - primary keys of the users, or None for every user
+        @param vms - primary keys or a queryset of the VirtualMachines, or None
+        for every VirtualMachine
+        @param revoked - whether permissions were only revoked.  Access is then
+        only removed, so that no rows are added for objects being deleted.
+        """
+        from ganeti_webmgr.clusters.models import Cluster
+
+        if users is not None:
+            users = list(users)
+            if not users:
+                return
+        if vms is not None and not isinstance(vms, QuerySet):
+            vms = list(vms)
+            if not vms:
+                return
+
+        memberships = User.groups.through.objects.all()
+        if users is not None:
+            memberships = memberships.filter(user__in=users)
+
+        def holders(rows):
+            # the users holding each permission, directly or through a group
+            if users is not None:
+                rows = rows.filter(
+                    models.Q(user__in=users) |
+                    models.Q(group__in=memberships.values('group')))
+            rows = list(rows.values_list('user', 'group', 'obj', 'admin'))
+            members = defaultdict(set)
+            groups = set(row[1] for row in rows if row[1])
+            if groups:
+                for user_id, group_id in memberships \
+                        .filter(group__in=groups) \
+                        .values_list('user', 'group'):
+                    members[group_id].add(user_id)
+            for user_id, group_id, obj_id, admin in rows:
+                for holder in [user_id] if user_id else members[group_id]:
+                    yield holder, obj_id, bool(admin)
+
+        expected = {}
+        rows = permission_map[VirtualMachine].objects.exclude(
+            **dict((perm, 0) for perm in get_model_perms(VirtualMachine)))
+        if vms is not None:
+            rows = rows.filter(obj__in=vms)
+        for user_id, vm_id, admin in holders(rows):
+            key = (user_id, vm_id)
+            expected[key] = expected.get(key, False) or admin
+
+        rows = permission_map[Cluster].objects.filter(admin=True)
+        cluster_vms = VirtualMachine.objects.all()
+        if vms is not None:
+            cluster_vms = cluster_vms.filter(pk__in=vms)
+            rows = rows.filter(obj__in=cluster_vms.values('cluster'))
+        admins = defaultdict(set)
+        for user_id, cluster_id, admin in holders(rows):
+            admins[cluster_id].add(user_id)
+        if admins:
+            for cluster_id, vm_id in cluster_vms \
+                    .filter(cluster__in=admins.keys()) \
+                    .values_list('cluster', 'id'):
+                for user_id in admins[cluster_id]:
+                    expected[(user_id, vm_id)] = True
+
+        current = cls.objects.all()
+        if users is not None:
+            current = current.filter(user__in=users)
+        if vms is not None:
+            current = current.filter(virtual_machine__in=vms)
+        stale = []
+        changed = defaultdict(list)
+        for id, user_id, vm_id, admin in current.values_list(
+                'id', 'user', 'virtual_machine', 'admin'):
+            key = (user_id, vm_id)
+            if key not in expected:
+                stale.append(id)
+            elif expected.pop(key) != admin:
+                if revoked and not admin:
+                    continue
+                changed[not admin].append(id)
+
+        for batch in chunks(stale, UPDATE_BATCH_SIZE):
+            cls.objects.filter(id__in=batch).delete()
+        for admin, ids in changed.items():
+            for batch in chunks(ids, UPDATE_BATCH_SIZE):
+                cls.objects.filter(id__in=batch).update(admin=admin)
+        if not revoked:
+            new = [cls(user_id=user_id, virtual_machine_id=vm_id, admin=admin)
+                   for (user_id, vm_id), admin in expected.items()]
+            for batch in chunks(new, BULK_CREATE_BATCH_SIZE):
+                cls.objects.bulk_create(batch)
@@ -54,6 +54,7 @@ class MockCluster(object):
             }
         }
     }
+    capability = None
 
     rapi = MockRapi()
 
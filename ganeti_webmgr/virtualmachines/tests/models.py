@@ -18,21 +18,31 @@
 
 from datetime import datetime
 
-from django.test import TestCase
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
 
 from ganeti_webmgr.utils.proxy.constants import (INSTANCE, JOB, JOB_RUNNING,
                                                  JOB_DELETE_SUCCESS)
 
-from ganeti_webmgr.virtualmachines.models import VirtualMachine
-from ganeti_webmgr.clusters.models import Cluster
+from ganeti_webmgr.virtualmachines.models import (NetworkInterface,
+                                                  VirtualMachine,
+                                                  owner_tag_changes,
+                                                  tagged_owner)
+from ganeti_webmgr.clusters import background as background_refresh
+from ganeti_webmgr.clusters.models import Cluster, CachedInfo, RefreshLease
 from ganeti_webmgr.authentication.models import ClusterUser
 from ganeti_webmgr.jobs.models import Job
+from ganeti_webmgr.utils.client import GanetiApiError
 
 from ganeti_webmgr.ganeti_web import constants
 
 
 __all__ = (
     'TestVirtualMachineModel',
+    'TestRefreshLeaseTransaction',
     'VirtualMachineTestCaseMixin',
 )
 
@@ -104,6 +114,7 @@ class TestVirtualMachineModel(TestCase, VirtualMachineTestCaseMixin):
         Verifies:
             * mtime and ctime are parsed
             * ram, virtual_cpus, and disksize are parsed
+            * disk template, hypervisor, admin state and port are parsed
         """
         vm, cluster = self.create_virtual_machine()
         vm.info = INSTANCE
@@ -113,13 +124,159 @@ class TestVirtualMachineModel(TestCase, VirtualMachineTestCaseMixin):
         self.assertEqual(vm.ram, 512)
         self.assertEqual(vm.virtual_cpus, 2)
         self.assertEqual(vm.disk_size, 5120)
+        self.assertEqual(vm.disk_template, 'plain')
+        self.assertEqual(vm.hypervisor, 'kvm')
+        self.assertEqual(vm.admin_state, 'down')
+        self.assertEqual(vm.network_port, 11165)
 
         vm.delete()
         cluster.delete()
 
+    def test_nics(self):
+        """
+        Test storing the NICs of a VirtualMachine
+
+        Verifies:
+            * NICs are stored when the info is saved
+            * NICs are rebuilt when they change
+            * unchanged NICs are not rewritten
+            * instances are found by IP or MAC address
+        """
+        vm, cluster = self.create_virtual_machine()
+        info = dict(INSTANCE)
+        info.update({
+            'nic.ips': [None, '10.1.2.3'],
+            'nic.macs': ['AA:00:00:C5:47:2E', 'aa:00:00:c5:47:2f'],
+            'nic.links': ['br42', 'br43'],
+            'nic.modes': ['bridged', 'routed'],
+        })
+        vm.info = info
+        vm.save()
+        nics = vm.nics.values_list('index', 'ip', 'mac', 'link', 'mode')
+        self.assertEqual([
+            (0, None, 'aa:00:00:c5:47:2e', 'br42', 'bridged'),
+            (1, '10.1.2.3', 'aa:00:00:c5:47:2f', 'br43', 'routed'),
+        ], list(nics))
+
+        info['nic.ips'] = [None, '10.1.2.4']
+        NetworkInterface.store({vm.pk: info})
+        self.assertEqual(['10.1.2.4'], list(
+            vm.nics.filter(index=1).values_list('ip', flat=True)))
+
+        with self.assertNumQueries(1):
+            NetworkInterface.store({vm.pk: info})
+
+        for address in ('10.1.2.4', 'AA:00:00:C5:47:2F'):
+            nic = NetworkInterface.lookup(address)[0]
+            self.assertEqual(vm.pk, nic.virtual_machine.pk)
+        self.assertFalse(NetworkInterface.lookup('10.1.2.3'))
+
+        vm.delete()
+        cluster.delete()
+
+    def test_background_refresh(self):
+        """
+        Test loading an expired VirtualMachine with background refreshing
+
+        Verifies:
+            * the RAPI is not contacted while instantiating
+            * the VM is queued once and reported as stale
+            * draining the queue refreshes the VM
+        """
+        vm, cluster = self.create_virtual_machine()
+        VirtualMachine.objects.filter(pk=vm.pk).update(cached=None)
+        vm.rapi.GetInstance.reset()
+
+        queue = background_refresh.queue
+        background_refresh.queue = background_refresh.RefreshQueue(
+            threaded=False)
+        settings.BACKGROUND_CACHE_REFRESH = True
+        try:
+            vm = VirtualMachine.objects.get(pk=vm.pk)
+            VirtualMachine.objects.get(pk=vm.pk)
+            vm.rapi.GetInstance.assertNotCalled(self)
+            self.assertTrue(vm.stale)
+            self.assertTrue(vm.refresh_pending)
+            self.assertEqual(1, len(background_refresh.queue))
+
+            background_refresh.queue.drain()
+            vm.rapi.GetInstance.assertCalled(self)
+            self.assertEqual(0, len(background_refresh.queue))
+            vm = VirtualMachine.objects.get(pk=vm.pk)
+            self.assertFalse(vm.stale)
+            self.assertTrue(vm.cache_age is not None)
+        finally:
+            settings.BACKGROUND_CACHE_REFRESH = False
+            background_refresh.queue = queue
+
+        vm.delete()
+        cluster.delete()
+
+    def test_refresh_lease(self):
+        """
+        Test that only the holder of the refresh lease refreshes a VM
+
+        Verifies:
+            * a VM is not refreshed while another process holds the lease
+            * the lease is released after refreshing
+            * a lease taken over by another process is not released
+        """
+        vm, cluster = self.create_virtual_machine()
+        vm.rapi.GetInstance.reset()
+
+        settings.REFRESH_LOCK_TIMEOUT = 60
+        try:
+            lease = RefreshLease.acquire(vm, 60)
+            self.assertTrue(lease)
+            self.assertEqual(None, RefreshLease.acquire(vm, 60))
+            vm.refresh()
+            vm.rapi.GetInstance.assertNotCalled(self)
+
+            lease.release()
+            vm.refresh()
+            vm.rapi.GetInstance.assertCalled(self)
+            self.assertEqual(None, cache.get(lease.key))
+        finally:
+            settings.REFRESH_LOCK_TIMEOUT = 0
+
+        # the lease expired and another process took it
+        cache.set(lease.key, 'other', 60)
+        lease.release()
+        self.assertEqual('other', cache.get(lease.key))
+        cache.delete(lease.key)
+
+        vm.delete()
+        cluster.delete()
+
+    def test_refresh_lease_settings(self):
+        """
+        Test that leases can only be enabled with a shared cache
+        """
+        caches = settings.CACHES
+        settings.REFRESH_LOCK_TIMEOUT = 60
+        try:
+            self.assertRaises(ImproperlyConfigured,
+                              RefreshLease.check_settings)
+            settings.CACHES = {'default': {
+                'BACKEND': 'django.core.cache.backends.memcached.'
+                           'MemcachedCache',
+                'LOCATION': '127.0.0.1:11211'}}
+            RefreshLease.check_settings()
+
+            settings.CACHES = caches
+            settings.REFRESH_LOCK_TIMEOUT = 0
+            RefreshLease.check_settings()
+        finally:
+            settings.CACHES = caches
+            settings.REFRESH_LOCK_TIMEOUT = 0
+
     def test_update_owner_tag(self):
         """
         Test changing owner
+
+        Verify:
+            * saving does not update the owner tag
+            * reconciling replaces the owner tags that drifted
         """
         vm, cluster = self.create_virtual_machine()
 
@@ -128,32 +285,118 @@ class TestVirtualMachineModel(TestCase, VirtualMachineTestCaseMixin):
         owner0.save()
         owner1.save()
 
+        def reconcile():
+            self.assertEqual([], VirtualMachine.reconcile_owner_tags(cluster))
+            return VirtualMachine.objects.get(id=vm.id).info['tags']
+
         # no owner
         vm.refresh()
         self.assertEqual([], vm.info['tags'])
 
         # setting owner
+        rapi = cluster.rapi
+        rapi.AddInstanceTags.reset()
         vm.owner = owner0
         vm.save()
+        rapi.AddInstanceTags.assertNotCalled(self)
+        self.assertEqual([], vm.info['tags'])
         self.assertEqual(['%s%s' % (constants.OWNER_TAG, owner0.id)],
-                         vm.info['tags'])
+                         reconcile())
 
         # changing owner
         vm.owner = owner1
         vm.save()
         self.assertEqual(['%s%s' % (constants.OWNER_TAG, owner1.id)],
-                         vm.info['tags'])
+                         reconcile())
+
+        # tags in step with the owners are left alone
+        rapi.AddInstanceTags.reset()
+        rapi.DeleteInstanceTags.reset()
+        reconcile()
+        rapi.AddInstanceTags.assertNotCalled(self)
+        rapi.DeleteInstanceTags.assertNotCalled(self)
 
         # setting owner to none
         vm.owner = None
         vm.save()
-        self.assertEqual([], vm.info['tags'])
+        self.assertEqual([], reconcile())
 
         owner0.delete()
         owner1.delete()
         vm.delete()
         cluster.delete()
 
+    def test_malformed_owner_tag(self):
+        """
+        Test owner tags that do not end with a primary key
+
+        Verify:
+            * they are ignored when finding the tagged owner
+            * they are left alone when tagging the owner
+            * parsing an instance's info does not fail
+        """
+        bad = '%sbob' % constants.OWNER_TAG
+        tag = '%s%s' % (constants.OWNER_TAG, 42)
+        self.assertEqual(None, tagged_owner([bad]))
+        self.assertEqual(42, tagged_owner([bad, tag]))
+        self.assertEqual(([], [tag]), owner_tag_changes([bad], 42))
+        self.assertEqual(([tag], []), owner_tag_changes([bad, tag], None))
+
+        info = dict(INSTANCE, tags=[bad, tag])
+        data = VirtualMachine.parse_persistent_info(info)
+        self.assertEqual(42, data['tagged_owner'])
+
+    def test_assign_owner(self):
+        """
+        Test assigning an owner to many VirtualMachines
+
+        Verify:
+            * owners are updated without saving each vm
+            * stale owner tags are replaced, and the cached tags updated
+            * instances whose tags could not be updated are reported
+        """
+        vm0, cluster = self.create_virtual_machine()
+        vm1, cluster = self.create_virtual_machine(cluster, 'vm2.example.bak')
+        owner = ClusterUser.objects.create(name='owner')
+        stale = '%s%s' % (constants.OWNER_TAG, 99)
+        tag = '%s%s' % (constants.OWNER_TAG, owner.id)
+        vm0.refresh()
+        vm1.refresh()
+        CachedInfo.store(vm1, VirtualMachine.serialize(
+            dict(INSTANCE, tags=[stale, 'other'])))
+        rapi = cluster.rapi
+        rapi.AddInstanceTags.reset()
+        rapi.DeleteInstanceTags.reset()
+
+        vms = VirtualMachine.objects.filter(cluster=cluster)
+        self.assertEqual([], VirtualMachine.assign_owner(vms, owner))
+        for vm in VirtualMachine.objects.filter(cluster=cluster):
+            self.assertEqual(owner.id, vm.owner_id)
+        self.assertEqual([(('vm1.example.bak', [tag]), {}),
+                          (('vm2.example.bak', [tag]), {})],
+                         sorted(rapi.AddInstanceTags.calls))
+        self.assertEqual([(('vm2.example.bak', [stale]), {})],
+                         rapi.DeleteInstanceTags.calls)
+        self.assertEqual(
+            [tag], VirtualMachine.objects.get(id=vm0.id).info['tags'])
+        self.assertEqual(
+            ['other', tag], VirtualMachine.objects.get(id=vm1.id).info['tags'])
+
+        # tags are only updated for instances whose owner changed
+        rapi.AddInstanceTags.reset()
+        self.assertEqual([], VirtualMachine.assign_owner(vms, owner))
+        rapi.AddInstanceTags.assertNotCalled(self)
+
+        # failures are reported, but owners are still updated
+        rapi.DeleteInstanceTags.error = GanetiApiError('Tags locked')
+        errors = VirtualMachine.assign_owner(vms, None)
+        rapi.DeleteInstanceTags.error = None
+        self.assertEqual(['vm1.example.bak', 'vm2.example.bak'],
+                         sorted(hostname for hostname, error in errors))
+        self.assertFalse(vms.exclude(owner=None).exists())
+        self.assertEqual(
+            [tag], VirtualMachine.objects.get(id=vm0.id).info['tags'])
+
     def test_start(self):
         """
         Test VirtualMachine.start()
@@ -305,3 +548,34 @@ class TestVirtualMachineModel(TestCase, VirtualMachineTestCaseMixin):
 
         job.delete()
         cluster.delete()
+
+
+class TestRefreshLeaseTransaction(TransactionTestCase,
+                                  VirtualMachineTestCaseMixin):
+
+    def test_outer_transaction(self):
+        """
+        Taking and releasing the refresh lease does not commit the
+        transaction of the caller
+        """
+        vm, cluster = self.create_virtual_machine()
+        vm.rapi.GetInstance.reset()
+
+        settings.REFRESH_LOCK_TIMEOUT = 60
+        try:
+            with transaction.commit_manually():
+                VirtualMachine.objects.filter(pk=vm.pk) \
+                    .update(hostname='uncommitted.example.bak')
+                vm.refresh()
+                vm.rapi.GetInstance.assertCalled(self)
+                transaction.rollback()
+        finally:
+            settings.REFRESH_LOCK_TIMEOUT = 0
+
+        self.assertTrue(VirtualMachine.objects
+                        .filter(hostname=vm.hostname).exists())
+        self.assertFalse(VirtualMachine.objects
+                         .filter(hostname='uncommitted.example.bak').exists())
+
+        vm.delete()
+        cluster.delete()
@@ -1,9 +1,12 @@
-from django.contrib.auth.models import User
+from django.contrib.auth.models import Group, User
 from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
 # #6579.
 from django.utils import simplejson as json
 
+from ganeti_webmgr.clusters.models import CachedInfo
 from ganeti_webmgr.utils.models import SSHKey
+from ganeti_webmgr.virtualmachines.models import VirtualMachine
 from .base import TestVirtualMachineViewsBase
 
 __all__ = ['TestVirtualMachineViewList',
@@ -93,6 +96,142 @@ class TestVirtualMachineViewList(TestVirtualMachineViewsBase):
         vms = response.context["object_list"]
         self.assertEqual(set(vms), set([self.vm, vm1, vm2, vm3]))
 
+    def test_filters(self):
+        """
+        The VM list can be filtered by the stored instance attributes.
+        """
+
+        url = '/vms/'
+
+        vm1, cluster1 = self.create_virtual_machine(self.cluster, 'test1')
+        vm2, cluster1 = self.create_virtual_machine(self.cluster, 'test2')
+        # refresh now, so that loading the list doesn't reparse the info
+        vm1.refresh()
+        vm2.refresh()
+        VirtualMachine.objects.filter(pk=vm1.pk) \
+            .update(disk_template='drbd', hypervisor='kvm')
+        VirtualMachine.objects.filter(pk=vm2.pk) \
+            .update(disk_template='plain', hypervisor='kvm')
+
+        self.assertTrue(self.c.login(username=self.superuser.username,
+                                     password='secret'))
+        response = self.c.get(url, {'disk_template': 'drbd'})
+        self.assertEqual(200, response.status_code)
+        vms = response.context["table"].data
+        self.assertEqual([vm.id for vm in vms], [vm1.id])
+
+        filters = dict((f['name'], f) for f in response.context["filters"])
+        self.assertEqual('drbd', filters['disk_template']['selected'])
+        self.assertTrue('plain' in filters['disk_template']['choices'])
+        self.assertTrue('kvm' in filters['hypervisor']['choices'])
+
+    def test_owners(self):
+        """
+        The owners of the listed VMs are cast in one query per type.
+        """
+
+        url = '/vms/'
+
+        vm1, cluster1 = self.create_virtual_machine(self.cluster, 'test1')
+        vm2, cluster1 = self.create_virtual_machine(self.cluster, 'test2')
+        vm1.refresh()
+        vm2.refresh()
+        group = Group.objects.create(name='owners')
+        VirtualMachine.objects.filter(pk=vm1.pk) \
+            .update(owner=self.user.get_profile())
+        VirtualMachine.objects.filter(pk=vm2.pk) \
+            .update(owner=group.organization)
+
+        self.assertTrue(self.c.login(username=self.superuser.username,
+                                     password='secret'))
+        response = self.c.get(url)
+        self.assertEqual(200, response.status_code)
+        owners = dict((row.record.pk, row.record.owner)
+                      for row in response.context["table"].page.object_list)
+        self.assertEqual(self.user.get_profile(), owners[vm1.pk].cast())
+        self.assertEqual(group.organization, owners[vm2.pk].cast())
+        for owner in (owners[vm1.pk], owners[vm2.pk]):
+            self.assertTrue(hasattr(owner, '_cast_cache'))
+        self.assertContains(response, self.user.get_absolute_url())
+        group.delete()
+
+    def test_status_columns(self):
+        """
+        The status of listed VMs is rendered from their columns, without
+        loading their cached info.
+        """
+
+        url = '/vms/'
+
+        vm1, cluster1 = self.create_virtual_machine(self.cluster, 'test1')
+        vm2, cluster1 = self.create_virtual_machine(self.cluster, 'test2')
+        vm1.refresh()
+        vm2.refresh()
+        VirtualMachine.objects.filter(pk=vm1.pk) \
+            .update(admin_state='up', status='running')
+        VirtualMachine.objects.filter(pk=vm2.pk) \
+            .update(admin_state='down', status='ADMIN_down')
+
+        self.assertTrue(self.c.login(username=self.superuser.username,
+                                     password='secret'))
+        loaded = []
+        load = CachedInfo.load
+
+        def counting_load(obj):
+            loaded.append(obj)
+            return load(obj)
+        CachedInfo.load = staticmethod(counting_load)
+        try:
+            response = self.c.get(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        finally:
+            CachedInfo.load = load
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([], loaded)
+        self.assertContains(response, 'icon_running', 1)
+        self.assertContains(response, 'icon_stopped')
+
+    @override_settings(KEYSET_PAGINATION=True)
+    def test_keyset_pagination(self):
+        """
+        With keyset pagination, pages are linked by cursors, including in the
+        tables refreshed with AJAX.
+        """
+
+        url = '/vms/'
+
+        self.create_virtual_machine(self.cluster, 'test1')
+        self.create_virtual_machine(self.cluster, 'test2')
+        hostnames = list(VirtualMachine.objects.order_by('hostname')
+                         .values_list('hostname', flat=True))
+
+        self.assertTrue(self.c.login(username=self.superuser.username,
+                                     password='secret'))
+        response = self.c.get(url, {'per_page': 2})
+        self.assertEqual(200, response.status_code)
+        page = response.context["table"].page
+        self.assertTrue(page.keyset)
+        self.assertEqual(len(hostnames), page.paginator.count)
+        self.assertEqual(hostnames[:2],
+                         [row.record.hostname for row in page.object_list])
+        self.assertFalse(page.has_previous())
+        self.assertContains(response, 'cursor=%s' % page.next_cursor)
+
+        response = self.c.get(url, {'per_page': 2,
+                                    'cursor': page.next_cursor},
+                              HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(200, response.status_code)
+        self.assertTemplateUsed(response, 'table.html')
+        page = response.context["table"].page
+        self.assertEqual(hostnames[2:],
+                         [row.record.hostname for row in page.object_list])
+        self.assertFalse(page.has_next())
+        self.assertContains(response, 'cursor=%s' % page.previous_cursor)
+
+        # VMs sorted by a nullable column are paginated with offsets
+        response = self.c.get(url, {'per_page': 2, 'sort': 'node'})
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(hasattr(response.context["table"].page, 'keyset'))
+
 
 class TestVirtualMachineDetailView(TestVirtualMachineViewsBase):
 
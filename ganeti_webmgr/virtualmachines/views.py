@@ -47,10 +47,13 @@ from object_permissions.views.permissions import view_users, view_permissions
 
 
 from ganeti_webmgr.ganeti_web.backend.queries import vm_qs_for_users
+from ganeti_webmgr.ganeti_web.backend.snapshots import PermissionSnapshot
 from ganeti_webmgr.ganeti_web.caps import has_shutdown_timeout, has_balloonmem
 from ganeti_webmgr.ganeti_web.templatetags.webmgr_tags import render_storage
 from ganeti_webmgr.ganeti_web.views.generic import (NO_PRIVS,
+                                                    KeysetPaginationMixin,
                                                     LoginRequiredMixin,
+                                                    PagePermissionsMixin,
                                                     PaginationMixin,
                                                     GWMBaseView)
 from ganeti_webmgr.ganeti_web.views.tables import BaseVMTable
@@ -59,6 +62,7 @@ from .forms import (KvmModifyVirtualMachineForm, PvmModifyVirtualMachineForm,
                     HvmModifyVirtualMachineForm, ModifyConfirmForm,
                     MigrateForm, RenameForm, ChangeOwnerForm, ReplaceDisksForm)
 
+from ganeti_webmgr.authentication.models import ClusterUser
 from ganeti_webmgr.clusters.models import Cluster
 from ganeti_webmgr.jobs.models import Job
 from ganeti_webmgr.utils.models import SSHKey
@@ -94,6 +98,7 @@ def get_vm_and_cluster_or_404(cluster_slug, instance):
 
 
 class BaseVMListView(LoginRequiredMixin, PaginationMixin, GWMBaseView,
+                     PagePermissionsMixin, KeysetPaginationMixin,
                      SingleTableView):
     """
     A view for listing VirtualMachines. It does so using a custom table object
@@ -103,6 +108,15 @@ class BaseVMListView(LoginRequiredMixin, PaginationMixin, GWMBaseView,
     table_class = BaseVMTable
     template_name = "ganeti/virtual_machine/list.html"
 
+    # columns the list can be filtered by, with GET parameters of the same
+    # name.  They are stored on VirtualMachine so the filtering is done by
+    # the database.
+    filters = (
+        ('disk_template', _('Disk Template')),
+        ('hypervisor', _('Hypervisor')),
+        ('admin_state', _('Admin State')),
+    )
+
     def get_template_names(self):
         if self.request.is_ajax():
             template = ['table.html']  # all we need is the table
@@ -110,6 +124,36 @@ class BaseVMListView(LoginRequiredMixin, PaginationMixin, GWMBaseView,
             template = ['ganeti/virtual_machine/list.html']
         return template
 
+    def get_table_data(self):
+        qs = super(BaseVMListView, self).get_table_data() \
+            .select_related('cluster', 'owner')
+        for name, label in self.filters:
+            value = self.request.GET.get(name)
+            if value:
+                qs = qs.filter(**{name: value})
+        return qs
+
+    def get_table(self):
+        table = super(BaseVMListView, self).get_table()
+        # the owner column links to the real owner, cast them all at once
+        page = getattr(table, 'page', None)
+        rows = page.object_list if page is not None else table.rows
+        ClusterUser.cast_all(row.record.owner for row in rows)
+        return table
+
+    def get_context_data(self, **kwargs):
+        context = super(BaseVMListView, self).get_context_data(**kwargs)
+        # the values each filter can be set to, from the unfiltered list
+        vms = self.object_list.order_by()
+        context["filters"] = [
+            {"name": name, "label": label,
+             "selected": self.request.GET.get(name, ""),
+             "choices": [value for value in vms
+                         .values_list(name, flat=True).distinct()
+                         .order_by(name) if value]}
+            for name, label in self.filters]
+        return context
+
 
 class VMListView(BaseVMListView):
     def get_queryset(self):
@@ -531,11 +575,13 @@ def detail(request, cluster_slug, instance, rest=False):
     vm, cluster = get_vm_and_cluster_or_404(cluster_slug, instance)
 
     user = request.user
+    snapshot = PermissionSnapshot.for_request(request)
     cluster_admin = (user.is_superuser or
-                     user.has_any_perms(cluster, perms=['admin', 'create_vm']))
+                     snapshot.has_any_perms(cluster,
+                                            perms=['admin', 'create_vm']))
 
     if not cluster_admin:
-        perms = user.get_perms(vm)
+        perms = snapshot.get_perms(vm)
 
     if cluster_admin or 'admin' in perms:
         admin = True